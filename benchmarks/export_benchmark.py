@@ -0,0 +1,193 @@
+"""End-to-end export benchmark against the local mock DAP API server
+
+Usage: python benchmarks/export_benchmark.py [--formats jsonl,csv] [--query-types snapshot,incremental] ...
+
+Starts benchmarks/mock_dap_server.py, runs `python dap_core.py` against it once per format, query type
+and run, and reports the wall time, rows/s, MB/s of gzip data, the peak RSS of the exporter process
+and the time spent in each phase. The printed phases are taken from the server's view of the requests:
+
+    setup     process start, imports, authentication and schema fetch, until the job is submitted
+    job       job submission and polling, until the object URLs are requested
+    download  from the URL request until the last object has been sent
+    finalize  decompression, merging or conversion after the last byte, until the process exits
+
+The JSON results also hold `client_phases`, the seconds per phase recorded by the exporter in its
+metrics file; for phases run concurrently per object, such as downloads, these are summed over objects.
+
+Options after `--` are passed to dap_core.py, e.g. `-- --merge` or `-- --database-url sqlite:///x.db`.
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import urllib.request
+
+BENCHMARK_DIRECTORY = os.path.dirname(os.path.abspath(__file__))
+REPOSITORY_DIRECTORY = os.path.dirname(BENCHMARK_DIRECTORY)
+
+# Table offered by the mock server and exported by every run
+BENCHMARK_TABLE = "bench_table"
+
+PHASES = [
+    ("setup", None, "job_submitted"),
+    ("job", "job_submitted", "urls_requested"),
+    ("download", "urls_requested", "last_object_sent"),
+    ("finalize", "last_object_sent", None),
+]
+
+def start_server(arguments):
+    """Start the mock server on a free port and return the process and its base URL"""
+    command = [sys.executable, os.path.join(BENCHMARK_DIRECTORY, "mock_dap_server.py"), "--port", "0",
+               "--tables", BENCHMARK_TABLE, "--objects", str(arguments.objects),
+               "--rows-per-object", str(arguments.rows_per_object), "--row-bytes", str(arguments.row_bytes),
+               "--latency", str(arguments.latency), "--failure-rate", str(arguments.failure_rate),
+               "--truncate-rate", str(arguments.truncate_rate)]
+    server = subprocess.Popen(command, stdout=subprocess.PIPE, text=True)
+    line = server.stdout.readline()
+    if not line:
+        raise RuntimeError("The mock DAP server did not start")
+    return server, line.split()[-1]
+
+def server_request(base_url, path, method="GET"):
+    request = urllib.request.Request(f"{base_url}{path}", method=method, data=b"" if method == "POST" else None)
+    with urllib.request.urlopen(request) as response:
+        return json.load(response)
+
+def export_command(base_url, file_format, query_type, work_directory, arguments, extra_arguments):
+    command = [sys.executable, os.path.join(REPOSITORY_DIRECTORY, "dap_core.py"), "--base-url", base_url,
+               "--client-id", "benchmark", "--client-secret", "benchmark", "--tables", BENCHMARK_TABLE,
+               "--query-type", query_type, "--format", file_format,
+               "--output-directory", os.path.join(work_directory, "output"),
+               "--download-workers", str(arguments.download_workers)]
+    if query_type == "incremental":
+        command += ["--since", "2024-01-01T00:00:00+00:00"]
+    return command + extra_arguments
+
+def run_export(base_url, file_format, query_type, arguments, extra_arguments):
+    """Run one export in a child process and return its measurements"""
+    with tempfile.TemporaryDirectory(prefix="dap-benchmark-") as work_directory:
+        # A private catalog cache, so every run fetches the schema and the user's cache is left alone,
+        # and no usage tracking calls leave the machine
+        environment = dict(os.environ, DAP_CATALOG_DIRECTORY=os.path.join(work_directory, "catalog"), DAP_TRACKING="false")
+        output = None if arguments.verbose else subprocess.DEVNULL
+
+        if query_type == "incremental" and "--merge" in extra_arguments:
+            # Deltas can only be merged onto an existing snapshot, which is not part of the measurement
+            subprocess.run(export_command(base_url, file_format, "snapshot", work_directory, arguments, extra_arguments),
+                           cwd=REPOSITORY_DIRECTORY, env=environment, stdout=output, check=True)
+            os.remove(os.path.join(work_directory, "catalog", "canvas", "schemas", f"{BENCHMARK_TABLE}.json"))
+
+        command = export_command(base_url, file_format, query_type, work_directory, arguments, extra_arguments)
+        server_request(base_url, "/_mock/reset", "POST")
+        started = time.time()
+        process = subprocess.Popen(command, cwd=REPOSITORY_DIRECTORY, env=environment, stdout=output)
+        _, status, usage = os.wait4(process.pid, 0)
+        process.returncode = os.waitstatus_to_exitcode(status)
+        finished = time.time()
+        client_phases = read_client_phases(os.path.join(work_directory, "output", "dap_export_metrics.jsonl"))
+
+    stats = server_request(base_url, "/_mock/stats")
+    wall_time = finished - started
+    timeline = dict(stats["timeline"], started=started, finished=finished)
+    phases = {}
+    for phase, begin, end in PHASES:
+        begin_time = timeline.get(begin or "started")
+        end_time = timeline.get(end or "finished")
+        phases[phase] = end_time - begin_time if begin_time is not None and end_time is not None else None
+
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    peak_rss = usage.ru_maxrss * (1 if sys.platform == "darwin" else 1024)
+    return {
+        "format": file_format,
+        "query_type": query_type,
+        "exit_code": process.returncode,
+        "wall_time": wall_time,
+        "rows": stats["rows_served"],
+        "bytes": stats["bytes_served"],
+        "rows_per_second": stats["rows_served"] / wall_time,
+        "megabytes_per_second": stats["bytes_served"] / wall_time / (1024 * 1024),
+        "peak_rss_megabytes": peak_rss / (1024 * 1024),
+        "phases": phases,
+        "client_phases": client_phases,
+        "injected_failures": stats["injected_failures"],
+        "injected_truncations": stats["injected_truncations"],
+    }
+
+def read_client_phases(metrics_path):
+    """Sum the seconds per phase that the exporter recorded in its metrics file"""
+    phases = {}
+    if os.path.exists(metrics_path):
+        with open(metrics_path) as metrics_file:
+            for line in metrics_file:
+                event = json.loads(line)
+                if event["phase"] != "total":
+                    phases[event["phase"]] = phases.get(event["phase"], 0.0) + event["seconds"]
+    return phases
+
+def summarize(results):
+    """Combine the runs of one scenario into their median values"""
+    summary = dict(results[0])
+    for field in ("wall_time", "rows_per_second", "megabytes_per_second", "peak_rss_megabytes"):
+        summary[field] = statistics.median(result[field] for result in results)
+    summary["phases"] = {phase: statistics.median(result["phases"][phase] or 0.0 for result in results) for phase, _, _ in PHASES}
+    summary["exit_code"] = max(result["exit_code"] for result in results)
+    summary["runs"] = len(results)
+    return summary
+
+def print_summary(summaries):
+    header = f"{'scenario':<22} {'wall s':>7} {'rows/s':>10} {'MB/s':>7} {'RSS MB':>7} " + " ".join(f"{phase:>9}" for phase, _, _ in PHASES)
+    print(header)
+    for summary in summaries:
+        scenario = f"{summary['query_type']} {summary['format']}"
+        if summary["exit_code"]:
+            scenario += " FAILED"
+        phases = " ".join(f"{summary['phases'][phase]:>9.2f}" for phase, _, _ in PHASES)
+        print(f"{scenario:<22} {summary['wall_time']:>7.2f} {summary['rows_per_second']:>10.0f} "
+              f"{summary['megabytes_per_second']:>7.1f} {summary['peak_rss_megabytes']:>7.0f} {phases}")
+
+def parse_arguments(argv):
+    if "--" in argv:
+        index = argv.index("--")
+        argv, extra_arguments = argv[:index], argv[index + 1:]
+    else:
+        extra_arguments = []
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--formats", default="jsonl,csv")
+    parser.add_argument("--query-types", default="snapshot,incremental")
+    parser.add_argument("--runs", type=int, default=3, help="runs per scenario; the median is reported")
+    parser.add_argument("--objects", type=int, default=8)
+    parser.add_argument("--rows-per-object", type=int, default=50_000)
+    parser.add_argument("--row-bytes", type=int, default=200)
+    parser.add_argument("--latency", type=float, default=0.0)
+    parser.add_argument("--failure-rate", type=float, default=0.0)
+    parser.add_argument("--truncate-rate", type=float, default=0.0)
+    parser.add_argument("--download-workers", type=int, default=4)
+    parser.add_argument("--json", help="also write the results to this JSON file")
+    parser.add_argument("--verbose", action="store_true", help="show the output of the exporter")
+    return parser.parse_args(argv), extra_arguments
+
+def main(argv=None):
+    arguments, extra_arguments = parse_arguments(sys.argv[1:] if argv is None else argv)
+    server, base_url = start_server(arguments)
+    try:
+        summaries = []
+        for query_type in arguments.query_types.split(","):
+            for file_format in arguments.formats.split(","):
+                results = [run_export(base_url, file_format, query_type, arguments, extra_arguments) for _ in range(arguments.runs)]
+                summaries.append(summarize(results))
+    finally:
+        server.terminate()
+        server.wait()
+
+    print_summary(summaries)
+    if arguments.json:
+        with open(arguments.json, "w") as json_file:
+            json.dump(summaries, json_file, indent=4)
+    return 0 if all(summary["exit_code"] == 0 for summary in summaries) else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
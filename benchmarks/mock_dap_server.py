@@ -0,0 +1,393 @@
+"""A local stand-in for the DAP API that serves synthetic table data, for offline benchmarks
+
+Usage: python benchmarks/mock_dap_server.py [--port 8080] [--objects 8] [--rows-per-object 50000] ...
+
+Implements the endpoints the DAP client uses: authentication, table list, table schema, query job
+submission and polling, object URL resolution, and the presigned object downloads themselves, which
+support HTTP range requests. Objects are generated on first request as gzip JSONL or CSV in the
+format of the query, with `--latency` added to every request and `--failure-rate` / `--truncate-rate`
+of object downloads answered with HTTP 503 or cut off halfway; `--ignore-range` answers range requests
+with the whole object, like a server without range support. `--rate-limit` answers API requests
+beyond the given rate per access token with HTTP 429, like the API gateway does, and `--reuse-jobs`
+answers a repeated identical query with the job of the first one until that job expires after
+`--job-lifetime` seconds. Point the exporter at the printed
+URL with any client ID and secret.
+"""
+import argparse
+import asyncio
+import base64
+import csv
+import gzip
+import hashlib
+import hmac
+import io
+import itertools
+import json
+import random
+import time
+from datetime import datetime, timedelta, timezone
+
+from aiohttp import web
+
+# Key used to sign the mock access tokens; the DAP client does not verify the signature
+TOKEN_SIGNING_KEY = b"mock-dap-server"
+
+# Default time from the submission of a query job until it expires
+JOB_LIFETIME = timedelta(days=1)
+
+# Default lifetime of the access tokens handed out by the server
+TOKEN_LIFETIME = timedelta(hours=1)
+
+# The DAP client logs in again before every request once its token expires within five minutes, so
+# shorter tokens would not exercise the renewal but make every request log in
+MIN_TOKEN_LIFETIME = timedelta(minutes=5)
+
+# Characters repeated in the padding column, which is sized so that rows reach --row-bytes
+PADDING_ALPHABET = "abcdefghijklmnopqrstuvwxyz0123456789"
+
+TABLE_SCHEMA = {
+    "type": "object",
+    "properties": {
+        "key": {
+            "type": "object",
+            "properties": {"id": {"type": "integer", "format": "int64"}},
+            "required": ["id"],
+        },
+        "value": {
+            "type": "object",
+            "properties": {
+                "account_id": {"type": "integer", "format": "int64"},
+                "name": {"type": "string"},
+                "score": {"type": "number"},
+                "active": {"type": "boolean"},
+                "updated_at": {"type": "string", "format": "date-time"},
+                "padding": {"type": "string"},
+            },
+        },
+        "meta": {
+            "type": "object",
+            "properties": {"action": {"type": "string", "enum": ["U", "D"]}, "ts": {"type": "string", "format": "date-time"}},
+        },
+    },
+}
+
+VALUE_COLUMNS = list(TABLE_SCHEMA["properties"]["value"]["properties"])
+
+def base64url(data):
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode("ascii")
+
+def make_access_token(lifetime=TOKEN_LIFETIME, subject="mock"):
+    """Build a signed JWT whose `exp` claim the DAP client reads to schedule re-authentication"""
+    header = base64url(json.dumps({"alg": "HS256", "typ": "JWT"}).encode())
+    expires = int((datetime.now(timezone.utc) + lifetime).timestamp())
+    payload = base64url(json.dumps({"exp": expires, "sub": subject, "jti": random.getrandbits(32)}).encode())
+    signature = hmac.new(TOKEN_SIGNING_KEY, f"{header}.{payload}".encode(), hashlib.sha256).digest()
+    return f"{header}.{payload}.{base64url(signature)}"
+
+def isoformat(timestamp):
+    return timestamp.astimezone(timezone.utc).isoformat().replace("+00:00", "Z")
+
+class MockDAPServer:
+    """Serves the DAP API endpoints from memory and counts what it served"""
+
+    def __init__(self, tables, objects, rows_per_object, row_bytes, latency, failure_rate, truncate_rate, job_delay, job_delay_spread, seed,
+                 rate_limit=0.0, token_lifetime=TOKEN_LIFETIME, reuse_jobs=False, ignore_range=False, job_lifetime=JOB_LIFETIME):
+        self.tables = tables
+        self.objects = objects
+        self.rows_per_object = rows_per_object
+        self.row_bytes = row_bytes
+        self.latency = latency
+        self.failure_rate = failure_rate
+        self.truncate_rate = truncate_rate
+        self.job_delay = job_delay
+        self.job_delay_spread = job_delay_spread
+        self.random = random.Random(seed)
+        self.rate_limit = rate_limit
+        self.token_lifetime = token_lifetime
+        self.reuse_jobs = reuse_jobs
+        self.ignore_range = ignore_range
+        self.job_lifetime = job_lifetime
+        # Job of each distinct query, for --reuse-jobs
+        self.query_jobs = {}
+        # Remaining requests and time of the last refill of the rate limit bucket of each access token
+        self.buckets = {}
+        self.jobs = {}
+        self.object_specs = {}
+        self.job_ids = itertools.count(1)
+        self.reset()
+
+    def reset(self):
+        """Clear the counters, the timeline and the generated objects, e.g. between two benchmark runs"""
+        self.payloads = {}
+        self.stats = {"requests": 0, "objects_served": 0, "bytes_served": 0, "rows_served": 0,
+                      "injected_failures": 0, "injected_truncations": 0, "logins": 0, "throttled": 0}
+        # Wall clock time of the first (or, for downloads, last) request of each kind
+        self.timeline = {}
+
+    def mark(self, event, last=False):
+        if last or event not in self.timeline:
+            self.timeline[event] = time.time()
+
+    def application(self):
+        app = web.Application(middlewares=[self.latency_middleware, self.rate_limit_middleware])
+        app.add_routes([
+            web.post("/ids/auth/login", self.login),
+            web.get("/dap/query/{namespace}/table", self.table_list),
+            web.get("/dap/query/{namespace}/table/{table}/schema", self.table_schema),
+            web.post("/dap/query/{namespace}/table/{table}/data", self.submit_query),
+            web.get("/dap/job/{job_id}", self.job_status),
+            web.post("/dap/object/url", self.object_urls),
+            web.get("/objects/{object_id}/{file_name}", self.object_download),
+            web.get("/_mock/stats", self.statistics),
+            web.post("/_mock/reset", self.reset_statistics),
+        ])
+        return app
+
+    @web.middleware
+    async def latency_middleware(self, request, handler):
+        self.stats["requests"] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        return await handler(request)
+
+    @web.middleware
+    async def rate_limit_middleware(self, request, handler):
+        """Answer API requests beyond --rate-limit per second and access token with HTTP 429"""
+        if not self.rate_limit or not request.path.startswith("/dap/"):
+            return await handler(request)
+        now = time.monotonic()
+        token = request.headers.get("Authorization", "")
+        available, updated = self.buckets.get(token, (self.rate_limit, now))
+        available = min(self.rate_limit, available + (now - updated) * self.rate_limit)
+        if available < 1:
+            self.buckets[token] = (available, now)
+            self.stats["throttled"] += 1
+            return web.json_response({"error": {"type": "TooManyRequests", "message": "rate limit exceeded"}},
+                                     status=429, headers={"Retry-After": "1"})
+        self.buckets[token] = (available - 1, now)
+        return await handler(request)
+
+    async def login(self, request):
+        if not request.headers.get("Authorization", "").startswith("Basic "):
+            return web.json_response({"error": {"type": "AuthenticationError", "message": "missing credentials"}}, status=401)
+        self.mark("authenticated")
+        self.stats["logins"] += 1
+        return web.json_response({"access_token": make_access_token(self.token_lifetime), "expires_in": int(self.token_lifetime.total_seconds()),
+                                  "scope": "urn:canvas:dap", "token_type": "Bearer"})
+
+    async def table_list(self, request):
+        return web.json_response({"tables": self.tables})
+
+    async def table_schema(self, request):
+        if request.match_info["table"] not in self.tables:
+            return web.json_response({"error": {"type": "NotFoundError", "message": "no such table"}}, status=404)
+        self.mark("schema_fetched")
+        return web.json_response({"schema": TABLE_SCHEMA, "version": 1})
+
+    async def submit_query(self, request):
+        table = request.match_info["table"]
+        query = await request.json()
+        self.mark("job_submitted")
+        query_key = (request.match_info["namespace"], table, json.dumps(query, sort_keys=True))
+        now = datetime.now(timezone.utc)
+        if self.reuse_jobs and query_key in self.query_jobs and self.jobs[self.query_jobs[query_key]]["expires_at"] > now:
+            return web.json_response(self.job_document(self.query_jobs[query_key]))
+        job_id = f"mock-{next(self.job_ids):06d}"
+        job = {"table": table, "format": query["format"], "object_ids": [], "expires_at": now + self.job_lifetime,
+               "completes": time.monotonic() + self.job_delay + self.random.uniform(0, self.job_delay_spread)}
+        if "since" in query:
+            job["since"] = query["since"]
+            job["until"] = query.get("until") or isoformat(now)
+        else:
+            job["at"] = isoformat(now)
+        for index in range(self.objects):
+            object_id = f"{job_id}-{index:05d}"
+            job["object_ids"].append(object_id)
+            self.object_specs[object_id] = (job_id, index)
+        self.jobs[job_id] = job
+        self.query_jobs[query_key] = job_id
+        return web.json_response(self.job_document(job_id))
+
+    async def job_status(self, request):
+        job_id = request.match_info["job_id"]
+        if job_id not in self.jobs:
+            return web.json_response({"error": {"type": "NotFoundError", "message": "no such job"}}, status=404)
+        return web.json_response(self.job_document(job_id))
+
+    def job_document(self, job_id):
+        job = self.jobs[job_id]
+        expires_at = isoformat(job["expires_at"])
+        if time.monotonic() < job["completes"]:
+            return {"id": job_id, "status": "running", "expires_at": expires_at}
+        document = {"id": job_id, "status": "complete", "expires_at": expires_at, "schema_version": 1,
+                    "objects": [{"id": object_id} for object_id in job["object_ids"]]}
+        if "at" in job:
+            document["at"] = job["at"]
+        else:
+            document["since"] = job["since"]
+            document["until"] = job["until"]
+        return document
+
+    async def object_urls(self, request):
+        objects = await request.json()
+        self.mark("urls_requested")
+        urls = {}
+        for dap_object in objects:
+            object_id = dap_object["id"]
+            job = self.jobs[self.object_specs[object_id][0]]
+            file_name = f"part-{self.object_specs[object_id][1]:05d}.{job['format']}.gz"
+            urls[object_id] = {"url": str(request.url.with_path(f"/objects/{object_id}/{file_name}").with_query(None))}
+        return web.json_response({"urls": urls})
+
+    async def object_download(self, request):
+        object_id = request.match_info["object_id"]
+        if object_id not in self.object_specs:
+            return web.Response(status=404)
+        if self.random.random() < self.failure_rate:
+            self.stats["injected_failures"] += 1
+            return web.Response(status=503, text="injected failure")
+
+        payload = self.payload(object_id)
+        start, end = 0, len(payload) - 1
+        range_header = "" if self.ignore_range else request.headers.get("Range", "")
+        if range_header.startswith("bytes="):
+            first, _, last = range_header[len("bytes="):].partition("-")
+            start = int(first)
+            end = min(end, int(last)) if last else end
+            if start >= len(payload):
+                return web.Response(status=416, headers={"Content-Range": f"bytes */{len(payload)}"})
+
+        body = payload[start:end + 1]
+        response = web.StreamResponse(status=206 if range_header else 200)
+        response.content_type = "application/gzip"
+        response.content_length = len(body)
+        # Object storage sends the MD5 of single-part objects as their ETag
+        response.headers["ETag"] = f'"{hashlib.md5(payload).hexdigest()}"'
+        if range_header:
+            response.headers["Content-Range"] = f"bytes {start}-{end}/{len(payload)}"
+        await response.prepare(request)
+
+        if self.random.random() < self.truncate_rate:
+            # Send half of the object and drop the connection, as an interrupted transfer would
+            self.stats["injected_truncations"] += 1
+            await response.write(body[:len(body) // 2])
+            self.stats["bytes_served"] += len(body) // 2
+            request.transport.close()
+            return response
+
+        await response.write(body)
+        await response.write_eof()
+        self.stats["bytes_served"] += len(body)
+        if end == len(payload) - 1:
+            # Small range requests, such as ETag probes, do not count as a served object
+            self.mark("last_object_sent", last=True)
+            self.stats["objects_served"] += 1
+            self.stats["rows_served"] += self.rows_per_object
+        return response
+
+    async def statistics(self, request):
+        return web.json_response(dict(self.stats, timeline=self.timeline))
+
+    async def reset_statistics(self, request):
+        self.reset()
+        return web.json_response({})
+
+    def payload(self, object_id):
+        if object_id not in self.payloads:
+            job_id, index = self.object_specs[object_id]
+            job = self.jobs[job_id]
+            text = self.generate_records(job, index)
+            self.payloads[object_id] = gzip.compress(text.encode("utf-8"), compresslevel=6, mtime=0)
+        return self.payloads[object_id]
+
+    def generate_records(self, job, index):
+        """Generate the rows of one object; incremental jobs update existing keys and delete every tenth"""
+        incremental = "since" in job
+        first_id = index * self.rows_per_object
+        timestamp = job.get("until", job.get("at"))
+        padding = (PADDING_ALPHABET * (self.row_bytes // len(PADDING_ALPHABET) + 1))[:max(0, self.row_bytes - 120)]
+
+        rows = []
+        for row_number in range(self.rows_per_object):
+            row_id = first_id + row_number
+            action = "D" if incremental and row_id % 10 == 0 else "U"
+            value = {
+                "account_id": row_id % 97,
+                "name": f"name {row_id}",
+                "score": row_id / 7,
+                "active": row_id % 2 == 0,
+                "updated_at": f"2024-01-{row_id % 28 + 1:02d}T12:00:00Z",
+                "padding": padding,
+            }
+            rows.append((row_id, action, value))
+
+        if job["format"] == "csv":
+            output = io.StringIO()
+            writer = csv.writer(output, lineterminator="\n")
+            writer.writerow(["meta.ts", "meta.action", "key.id"] + [f"value.{column}" for column in VALUE_COLUMNS])
+            for row_id, action, value in rows:
+                values = ["NULL" if action == "D" else str(value[column]).lower() if isinstance(value[column], bool) else value[column]
+                          for column in VALUE_COLUMNS]
+                writer.writerow([timestamp, action, row_id] + values)
+            return output.getvalue()
+
+        lines = []
+        for row_id, action, value in rows:
+            record = {"key": {"id": row_id}, "meta": {"action": action, "ts": timestamp}}
+            if action != "D":
+                record["value"] = value
+            lines.append(json.dumps(record))
+        return "\n".join(lines) + "\n"
+
+def parse_arguments(argv=None):
+    parser = argparse.ArgumentParser(description="Serve synthetic DAP API responses for offline benchmarks.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8080, help="port to listen on, 0 for any free port")
+    parser.add_argument("--tables", default="bench_table", help="comma separated table names to offer")
+    parser.add_argument("--objects", type=int, default=8, help="objects produced by each query job")
+    parser.add_argument("--rows-per-object", type=int, default=50_000)
+    parser.add_argument("--row-bytes", type=int, default=200, help="approximate uncompressed size of one row")
+    parser.add_argument("--latency", type=float, default=0.0, help="seconds added to every request")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="fraction of object downloads answered with HTTP 503")
+    parser.add_argument("--truncate-rate", type=float, default=0.0, help="fraction of object downloads cut off halfway")
+    parser.add_argument("--job-delay", type=float, default=0.0, help="seconds until a submitted job completes")
+    parser.add_argument("--job-delay-spread", type=float, default=0.0, help="random extra seconds of up to this much per job")
+    parser.add_argument("--job-lifetime", type=float, default=JOB_LIFETIME.total_seconds(), help="seconds from submission until a job expires")
+    parser.add_argument("--seed", type=int, default=1, help="seed of the injected failures")
+    parser.add_argument("--rate-limit", type=float, default=0.0, help="API requests per second and access token before HTTP 429, 0 for no limit")
+    parser.add_argument("--reuse-jobs", action="store_true", help="answer repeated identical queries with the same job")
+    parser.add_argument("--ignore-range", action="store_true", help="answer range requests with the whole object and HTTP 200")
+    parser.add_argument("--token-lifetime", type=float, default=TOKEN_LIFETIME.total_seconds(),
+                        help=f"seconds until an access token expires, more than {MIN_TOKEN_LIFETIME.total_seconds():.0f}")
+    arguments = parser.parse_args(argv)
+    if arguments.token_lifetime <= MIN_TOKEN_LIFETIME.total_seconds():
+        parser.error(f"--token-lifetime must be more than {MIN_TOKEN_LIFETIME.total_seconds():.0f} seconds, the DAP client's renewal margin")
+    return arguments
+
+def create_server(arguments):
+    """Create the server described by the parsed command line options"""
+    return MockDAPServer([table.strip() for table in arguments.tables.split(",") if table.strip()], arguments.objects,
+                         arguments.rows_per_object, arguments.row_bytes, arguments.latency, arguments.failure_rate,
+                         arguments.truncate_rate, arguments.job_delay, arguments.job_delay_spread, arguments.seed,
+                         arguments.rate_limit, timedelta(seconds=arguments.token_lifetime), arguments.reuse_jobs,
+                         arguments.ignore_range, timedelta(seconds=arguments.job_lifetime))
+
+async def serve(arguments):
+    server = create_server(arguments)
+    runner = web.AppRunner(server.application(), access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, arguments.host, arguments.port)
+    await site.start()
+    port = runner.addresses[0][1]
+    # The benchmark suite reads this line to find the server
+    print(f"Mock DAP API listening on http://{arguments.host}:{port}", flush=True)
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
+
+if __name__ == "__main__":
+    try:
+        asyncio.run(serve(parse_arguments()))
+    except KeyboardInterrupt:
+        pass
@@ -0,0 +1,59 @@
+"""Measure the start-up cost of the headless CLI against the eager imports of the GUI script
+
+Usage: python benchmarks/startup_benchmark.py [--runs 10]
+
+"before" imports what dap-query-app-v4.py loaded at start-up before the export logic moved into
+dap_core (tkinter, tkcalendar, the DAP client, aiohttp and pyarrow); "after" runs the CLI itself.
+"""
+import argparse
+import importlib.util
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+REPOSITORY_DIRECTORY = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Modules imported at start-up by the GUI script before the split
+EAGER_MODULES = ["tkinter", "tkcalendar", "dap.api", "dap.dap_types", "aiohttp", "pyarrow.parquet"]
+
+def installed(module):
+    try:
+        return importlib.util.find_spec(module) is not None
+    except ModuleNotFoundError:
+        return False
+
+def time_command(command, runs):
+    """Run a command repeatedly and return its wall times in milliseconds"""
+    timings = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        subprocess.run(command, cwd=REPOSITORY_DIRECTORY, check=True, stdout=subprocess.DEVNULL)
+        timings.append((time.perf_counter() - started) * 1000)
+    return timings
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--runs", type=int, default=10)
+    arguments = parser.parse_args()
+
+    eager_modules = [module for module in EAGER_MODULES if installed(module)]
+    missing = sorted(set(EAGER_MODULES) - set(eager_modules))
+    if missing:
+        print(f"Not installed, left out of the 'before' measurement: {', '.join(missing)}")
+
+    commands = [
+        ("before: eager GUI imports", [sys.executable, "-c", "; ".join(f"import {module}" for module in eager_modules) or "pass"]),
+        ("after: import dap_core", [sys.executable, "-c", "import dap_core"]),
+        ("after: dap_core.py --help", [sys.executable, "dap_core.py", "--help"]),
+        ("interpreter only", [sys.executable, "-c", "pass"]),
+    ]
+
+    print(f"{'command':<30} {'min ms':>8} {'median ms':>10}")
+    for label, command in commands:
+        timings = time_command(command, arguments.runs)
+        print(f"{label:<30} {min(timings):>8.1f} {statistics.median(timings):>10.1f}")
+
+if __name__ == "__main__":
+    main()
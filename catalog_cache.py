@@ -0,0 +1,105 @@
+import hashlib
+import json
+import os
+import shutil
+from datetime import datetime, timedelta, timezone
+from urllib.parse import urlparse
+
+# Directory holding the cached table lists and schemas, one sub-directory per API and namespace
+DEFAULT_CACHE_DIRECTORY = os.getenv("DAP_CATALOG_DIRECTORY", os.path.join(os.path.expanduser("~"), ".dap_query_app", "catalog"))
+
+# How long cached table lists and schemas are used before they are fetched again
+DEFAULT_CACHE_TTL = timedelta(hours=24)
+
+# Version of the cache file layout; files written by another version are ignored
+CACHE_FORMAT_VERSION = 1
+
+# API URL that the DAP client uses when neither a base URL nor DAP_API_URL is given
+DEFAULT_API_URL = "https://api-gateway.instructure.com"
+
+def api_url(base_url):
+    """The API URL that the DAP client connects to for a base URL, which may be empty"""
+    return (base_url or os.getenv("DAP_API_URL") or DEFAULT_API_URL).rstrip("/")
+
+def api_key(base_url):
+    """Name of the cache directory of a DAP API URL, so catalogs of different hosts or instances never mix"""
+    base_url = api_url(base_url)
+    host = urlparse(base_url).hostname or "api"
+    return f"{host}-{hashlib.sha256(base_url.encode('utf-8')).hexdigest()[:12]}"
+
+class CatalogCache:
+    """Caches the table list and table schemas of each namespace on disk
+
+    The catalog of one DAP API is kept in a sub-directory of its own, see for_api. Entries are fetched from the DAP API when they are missing, older than the TTL, explicitly
+    invalidated, or (for schemas) when a query job reports a different schema version.
+    """
+
+    def __init__(self, cache_directory=DEFAULT_CACHE_DIRECTORY, ttl=DEFAULT_CACHE_TTL):
+        self.cache_directory = cache_directory
+        self.ttl = ttl
+
+    def for_api(self, base_url):
+        """Return the cache of the catalog served by a DAP API URL; None stands for the DAP client's default"""
+        return CatalogCache(os.path.join(self.cache_directory, api_key(base_url)), self.ttl)
+
+    def tables_path(self, namespace):
+        return os.path.join(self.cache_directory, namespace, "tables.json")
+
+    def schema_path(self, namespace, table):
+        return os.path.join(self.cache_directory, namespace, "schemas", f"{table}.json")
+
+    def read_entry(self, path, allow_stale=False):
+        """Return the content of a cache file, or None if it is missing, unreadable, outdated or stale"""
+        try:
+            with open(path) as cache_file:
+                entry = json.load(cache_file)
+        except (OSError, ValueError):
+            return None
+        if entry.get("cache_format_version") != CACHE_FORMAT_VERSION:
+            return None
+        fetched_at = datetime.fromisoformat(entry["fetched_at"])
+        if not allow_stale and datetime.now(timezone.utc) - fetched_at > self.ttl:
+            return None
+        return entry
+
+    def write_entry(self, path, content):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        entry = dict(content, cache_format_version=CACHE_FORMAT_VERSION, fetched_at=datetime.now(timezone.utc).isoformat())
+        temp_path = f"{path}.tmp"
+        with open(temp_path, "w") as cache_file:
+            json.dump(entry, cache_file)
+        os.replace(temp_path, path)
+
+    def cached_tables(self, namespace, allow_stale=False):
+        """Return the cached table names of a namespace without contacting the API, or None"""
+        entry = self.read_entry(self.tables_path(namespace), allow_stale)
+        return entry["tables"] if entry is not None else None
+
+    async def get_tables(self, dap_client, namespace):
+        """Return the table names of a namespace, fetching them from the API only when the cache is stale"""
+        tables = self.cached_tables(namespace)
+        if tables is None:
+            tables = sorted(await dap_client.get_tables(namespace))
+            self.write_entry(self.tables_path(namespace), {"tables": tables})
+        return tables
+
+    async def get_schema(self, dap_client, namespace, table, expected_version=None):
+        """Return the versioned schema of a table, fetching it only when the cache is stale or has another version"""
+        from dap.dap_types import VersionedSchema
+
+        entry = self.read_entry(self.schema_path(namespace, table))
+        if entry is not None and (expected_version is None or entry["version"] == expected_version):
+            return VersionedSchema(schema=entry["schema"], version=entry["version"])
+
+        versioned_schema = await dap_client.get_table_schema(namespace, table)
+        self.write_entry(self.schema_path(namespace, table), {"version": versioned_schema.version, "schema": versioned_schema.schema})
+        return versioned_schema
+
+    def invalidate(self, namespace, table=None):
+        """Drop the cached schema of a table, or the whole cached catalog of a namespace"""
+        if table is not None:
+            path = self.schema_path(namespace, table)
+            if os.path.exists(path):
+                os.remove(path)
+        else:
+            shutil.rmtree(os.path.join(self.cache_directory, namespace), ignore_errors=True)
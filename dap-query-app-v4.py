@@ -1,18 +1,65 @@
 import asyncio
-import os
-from datetime import datetime, timezone
+import itertools
+import multiprocessing
+import queue
+import threading
+from datetime import datetime
 import tkinter as tk
 from tkinter import ttk, filedialog, messagebox
-from tkcalendar import Calendar
 
-from dap.api import DAPClient
-from dap.dap_types import Format, IncrementalQuery, SnapshotQuery, Credentials
+# The export logic lives in dap_core, which can also be imported and run headless (python dap_core.py --help)
+import dap_core
+from dap_core import TABLE_NAMES, ExportProgress, catalog, parse_table_selection
+
+# Number of milliseconds between two checks of the progress queue by the GUI
+PROGRESS_POLL_MS = 200
+
+class ExportWorker:
+    """Runs export coroutines on a persistent event loop in a background thread"""
+
+    def __init__(self):
+        self.loop = asyncio.new_event_loop()
+        self.tasks = {}
+        self.thread = threading.Thread(target=self.run_loop, name="dap-export-worker", daemon=True)
+        self.thread.start()
+
+    def run_loop(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    def submit(self, job_id, coroutine):
+        """Queue a coroutine on the worker loop; safe to call from the GUI thread"""
+        return asyncio.run_coroutine_threadsafe(self.track(job_id, coroutine), self.loop)
+
+    async def track(self, job_id, coroutine):
+        self.tasks[job_id] = asyncio.current_task()
+        try:
+            return await coroutine
+        finally:
+            self.tasks.pop(job_id, None)
+
+    def cancel(self, job_id):
+        """Cancel a running job and its in-flight download tasks; safe to call from the GUI thread"""
+        def cancel_task():
+            task = self.tasks.get(job_id)
+            if task is not None:
+                task.cancel()
+        self.loop.call_soon_threadsafe(cancel_task)
+
+    def stop(self):
+        self.loop.call_soon_threadsafe(self.loop.stop)
 
 class DAPQueryApp:
     def __init__(self, master):
         self.master = master
         master.title("DAP Query App")
 
+        # Run exports on a background event loop and receive their progress through a queue
+        self.worker = ExportWorker()
+        self.progress_updates = queue.Queue()
+        self.job_ids = itertools.count(1)
+        self.job_rows = {}
+
         # Create input fields and labels
         self.create_input_fields()
 
@@ -25,15 +72,36 @@ class DAPQueryApp:
         # Create fields for since timestamp
         self.create_since_timestamp_field()
 
+        # Create fields for the until timestamp and window size of backfills
+        self.create_backfill_fields()
+
         # Create a dropdown for selecting the file format
         self.create_file_format_dropdown()
 
         # Create an entry field and button for selecting the output directory
         self.create_output_directory_field()
 
+        # Create an entry field for loading straight into a database instead of writing files
+        self.create_database_url_field()
+
+        # Create fields for converting the downloaded files into a partitioned Parquet dataset
+        self.create_parquet_conversion_fields()
+
+        # Create fields for filtering the rows and columns of the downloaded data
+        self.create_row_filter_fields()
+
         # Create a button to start the query process
         self.create_start_query_button()
 
+        # Create fields and a button for exporting several tables in one session
+        self.create_batch_fields()
+
+        # Create a panel listing running and finished jobs
+        self.create_jobs_panel()
+
+        master.protocol("WM_DELETE_WINDOW", self.on_close)
+        master.after(PROGRESS_POLL_MS, self.poll_progress)
+
     def create_input_fields(self):
         fields = [
             ("DAP API URL", "api_url_entry", "https://api-gateway.instructure.com"),
@@ -51,68 +119,196 @@ class DAPQueryApp:
 
     def create_table_dropdown(self):
         tk.Label(self.master, text="Table").grid(row=4, column=0, sticky="w")
-        table_names = [
-            "access_tokens", "account_users", "accounts", "assessment_question_banks",
-            "assessment_questions", "assignment_groups", "assignment_override_students",
-            "assignment_overrides", "assignments", "attachment_associations", "attachments",
-            "calendar_events", "canvadocs_annotation_contexts", "comment_bank_items",
-            "communication_channels", "content_migrations", "content_participation_counts",
-            "content_participations", "content_shares", "content_tags", "context_external_tools",
-            "context_module_progressions", "context_modules", "conversation_message_participants",
-            "conversation_messages", "conversation_participants", "conversations",
-            "course_account_associations", "course_sections", "courses",
-            "custom_gradebook_column_data", "custom_gradebook_columns",
-            "developer_key_account_bindings", "developer_keys", "discussion_entries",
-            "discussion_entry_participants", "discussion_topic_participants",
-            "discussion_topics", "enrollment_dates_overrides", "enrollment_states",
-            "enrollment_terms", "enrollments", "favorites", "folders", "grading_period_groups",
-            "grading_periods", "grading_standards", "group_categories", "group_memberships",
-            "groups", "late_policies", "learning_outcome_groups", "learning_outcome_question_results",
-            "learning_outcome_results", "learning_outcomes", "lti_line_items",
-            "lti_resource_links", "lti_results", "master_courses_child_content_tags",
-            "master_courses_child_subscriptions", "master_courses_master_content_tags",
-            "master_courses_master_migrations", "master_courses_master_templates",
-            "master_courses_migration_results", "originality_reports", "outcome_proficiencies",
-            "outcome_proficiency_ratings", "post_policies", "pseudonyms", "quiz_groups",
-            "quiz_questions", "quiz_submissions", "quizzes", "role_overrides", "roles",
-            "rubric_assessments", "rubric_associations", "rubrics", "score_statistics",
-            "scores", "submission_comments", "submission_versions", "submissions",
-            "user_account_associations", "user_notes", "users", "web_conference_participants",
-            "web_conferences", "wiki_pages", "wikis"
-        ]
-        self.table_dropdown = ttk.Combobox(self.master, values=table_names, state="readonly")
+        self.table_dropdown = ttk.Combobox(self.master, values=self.cached_table_names(), state="readonly")
         self.table_dropdown.current(0)  # Set the default selected item
         self.table_dropdown.grid(row=4, column=1)
+        tk.Button(self.master, text="Refresh Tables", command=self.refresh_tables).grid(row=4, column=2)
+
+    def cached_table_names(self):
+        """Table names of the namespace from the catalog cache, even if stale, or the built-in list"""
+        return catalog.for_api(self.api_url_entry.get()).cached_tables(self.namespace_entry.get(), allow_stale=True) or TABLE_NAMES
+
+    def reload_table_dropdown(self):
+        selected = self.table_dropdown.get()
+        table_names = self.cached_table_names()
+        self.table_dropdown.config(values=table_names)
+        if selected in table_names:
+            self.table_dropdown.set(selected)
+        else:
+            self.table_dropdown.current(0)
 
     def create_query_type_radio(self):
         tk.Label(self.master, text="Query Type").grid(row=5, column=0, sticky="w")
         self.query_type_var = tk.StringVar(value="snapshot")
         tk.Radiobutton(self.master, text="Snapshot", variable=self.query_type_var, value="snapshot").grid(row=5, column=1, sticky="w")
         tk.Radiobutton(self.master, text="Incremental", variable=self.query_type_var, value="incremental").grid(row=6, column=1, sticky="w")
+        tk.Radiobutton(self.master, text="Sync (since last run)", variable=self.query_type_var, value="sync").grid(row=5, column=2, sticky="w")
+        tk.Radiobutton(self.master, text="Backfill (windows)", variable=self.query_type_var, value="backfill").grid(row=6, column=2, sticky="w")
 
     def create_since_timestamp_field(self):
         tk.Label(self.master, text="Since Timestamp (Incremental)").grid(row=7, column=0, sticky="w")
         self.since_timestamp_var = tk.StringVar()
         self.since_timestamp_entry = tk.Entry(self.master, textvariable=self.since_timestamp_var, state="readonly")
         self.since_timestamp_entry.grid(row=7, column=1)
-        tk.Button(self.master, text="Select Date", command=self.select_since_timestamp).grid(row=7, column=2)
+        tk.Button(self.master, text="Select Date", command=lambda: self.select_timestamp(self.since_timestamp_var)).grid(row=7, column=2)
+
+    def create_backfill_fields(self):
+        tk.Label(self.master, text="Until Timestamp (Backfill)").grid(row=8, column=0, sticky="w")
+        self.until_timestamp_var = tk.StringVar()
+        tk.Entry(self.master, textvariable=self.until_timestamp_var, state="readonly").grid(row=8, column=1)
+        backfill_frame = ttk.Frame(self.master)
+        backfill_frame.grid(row=8, column=2, sticky="w")
+        tk.Button(backfill_frame, text="Select Date", command=lambda: self.select_timestamp(self.until_timestamp_var)).pack(side=tk.LEFT)
+        tk.Label(backfill_frame, text="Window").pack(side=tk.LEFT, padx=(10, 0))
+        self.window_var = tk.StringVar(value="day")
+        ttk.Combobox(backfill_frame, textvariable=self.window_var, values=list(dap_core.BACKFILL_WINDOWS), state="readonly", width=6).pack(side=tk.LEFT, padx=2)
+
+    def backfill_options(self):
+        """Backfill options from the form, or None unless the backfill query type is selected"""
+        if self.query_type_var.get() != "backfill":
+            return None
+        return dap_core.Backfill(self.until_timestamp_var.get(), self.window_var.get())
 
     def create_file_format_dropdown(self):
-        tk.Label(self.master, text="File Format").grid(row=8, column=0, sticky="w")
+        tk.Label(self.master, text="File Format").grid(row=9, column=0, sticky="w")
         file_formats = ["jsonl", "csv", "tsv", "parquet"]
         self.file_format_var = tk.StringVar(value=file_formats[0])
         self.file_format_dropdown = ttk.Combobox(self.master, values=file_formats, state="readonly", textvariable=self.file_format_var)
         self.file_format_dropdown.current(0)  # Set the default selected item
-        self.file_format_dropdown.grid(row=8, column=1)
+        self.file_format_dropdown.grid(row=9, column=1)
+
+        self.merge_var = tk.BooleanVar(value=False)
+        tk.Checkbutton(self.master, text="Merge into Parquet store", variable=self.merge_var).grid(row=9, column=2, sticky="w")
 
     def create_output_directory_field(self):
-        tk.Label(self.master, text="Output Directory").grid(row=9, column=0, sticky="w")
+        tk.Label(self.master, text="Output Directory").grid(row=10, column=0, sticky="w")
         self.output_dir_entry = tk.Entry(self.master, width=50)
-        self.output_dir_entry.grid(row=9, column=1)
-        tk.Button(self.master, text="Browse", command=self.browse_output_dir).grid(row=9, column=2)
+        self.output_dir_entry.grid(row=10, column=1)
+        tk.Button(self.master, text="Browse", command=self.browse_output_dir).grid(row=10, column=2)
+
+    def create_database_url_field(self):
+        tk.Label(self.master, text="Database URL (optional)").grid(row=11, column=0, sticky="w")
+        self.database_url_entry = tk.Entry(self.master, width=50)
+        self.database_url_entry.grid(row=11, column=1)
+        tk.Label(self.master, text="e.g. sqlite:///canvas.db").grid(row=11, column=2, sticky="w")
+
+    def create_parquet_conversion_fields(self):
+        self.convert_var = tk.BooleanVar(value=False)
+        tk.Checkbutton(self.master, text="Convert to partitioned Parquet", variable=self.convert_var).grid(row=12, column=0, sticky="w")
+        self.partition_by_entry = tk.Entry(self.master, width=50)
+        self.partition_by_entry.grid(row=12, column=1)
+        tk.Label(self.master, text="Partition by, e.g. updated_at:date").grid(row=12, column=2, sticky="w")
+
+        tk.Label(self.master, text="Keep Columns (optional)").grid(row=13, column=0, sticky="w")
+        self.columns_entry = tk.Entry(self.master, width=50)
+        self.columns_entry.grid(row=13, column=1)
+        tk.Label(self.master, text="comma separated").grid(row=13, column=2, sticky="w")
+
+    def create_row_filter_fields(self):
+        tk.Label(self.master, text="Row Filter (optional)").grid(row=14, column=0, sticky="w")
+        self.row_filter_entry = tk.Entry(self.master, width=50)
+        self.row_filter_entry.grid(row=14, column=1)
+        row_filter_frame = ttk.Frame(self.master)
+        row_filter_frame.grid(row=14, column=2, sticky="w")
+        tk.Label(row_filter_frame, text="Download Columns").pack(side=tk.LEFT)
+        self.select_columns_entry = tk.Entry(row_filter_frame, width=20)
+        self.select_columns_entry.pack(side=tk.LEFT, padx=2)
+
+    def row_filter(self):
+        """Row filter from the form, e.g. `account_id in 1,2; updated_at >= 2024-01-01T00:00:00Z`, or None when it is empty"""
+        predicates = dap_core.parse_predicate_list(self.row_filter_entry.get())
+        columns = dap_core.parse_column_list(self.select_columns_entry.get())
+        if not predicates and not columns:
+            return None
+        return dap_core.RowFilter(predicates, columns)
+
+    def parquet_conversion(self):
+        """Conversion options from the form, or None when conversion is not checked"""
+        if not self.convert_var.get():
+            return None
+        return dap_core.ParquetConversion(self.partition_by_entry.get().strip() or None, dap_core.parse_column_list(self.columns_entry.get()))
 
     def create_start_query_button(self):
-        tk.Button(self.master, text="Start Query", command=self.start_query).grid(row=10, columnspan=3, pady=10)
+        tk.Button(self.master, text="Start Query", command=self.start_query).grid(row=15, columnspan=3, pady=10)
+
+    def create_batch_fields(self):
+        tk.Label(self.master, text="Batch Tables (comma separated or \"all\")").grid(row=16, column=0, sticky="w")
+        self.batch_tables_entry = tk.Entry(self.master, width=50)
+        self.batch_tables_entry.insert(0, "all")
+        self.batch_tables_entry.grid(row=16, column=1)
+
+        tk.Label(self.master, text="Batch Concurrency (tables downloading)").grid(row=17, column=0, sticky="w")
+        batch_limits_frame = ttk.Frame(self.master)
+        batch_limits_frame.grid(row=17, column=1, sticky="w")
+        self.batch_concurrency_spinbox = ttk.Spinbox(batch_limits_frame, from_=1, to=32, width=5)
+        self.batch_concurrency_spinbox.set(dap_core.DEFAULT_BATCH_CONCURRENCY)
+        self.batch_concurrency_spinbox.pack(side=tk.LEFT)
+        tk.Label(batch_limits_frame, text="Jobs in Flight").pack(side=tk.LEFT, padx=(10, 0))
+        self.max_jobs_spinbox = ttk.Spinbox(batch_limits_frame, from_=1, to=64, width=5)
+        self.max_jobs_spinbox.set(dap_core.DEFAULT_MAX_JOBS)
+        self.max_jobs_spinbox.pack(side=tk.LEFT, padx=2)
+
+        download_workers_frame = ttk.Frame(self.master)
+        download_workers_frame.grid(row=17, column=2, sticky="w")
+        tk.Label(download_workers_frame, text="Download Workers").pack(side=tk.LEFT)
+        self.download_workers_spinbox = ttk.Spinbox(download_workers_frame, from_=1, to=32, width=5)
+        self.download_workers_spinbox.set(dap_core.DEFAULT_DOWNLOAD_WORKERS)
+        self.download_workers_spinbox.pack(side=tk.LEFT, padx=2)
+
+        tk.Button(self.master, text="Start Batch", command=self.start_batch).grid(row=18, columnspan=3, pady=10)
+
+    def create_jobs_panel(self):
+        self.jobs_frame = ttk.LabelFrame(self.master, text="Jobs")
+        self.jobs_frame.grid(row=19, columnspan=3, sticky="we", padx=5, pady=5)
+
+    def add_job_row(self, job_id, label):
+        """Add a status line and a Cancel button for a newly submitted job"""
+        status_var = tk.StringVar(value=f"{label}: queued")
+        tk.Label(self.jobs_frame, textvariable=status_var, anchor="w").grid(row=job_id, column=0, sticky="w")
+        cancel_button = tk.Button(self.jobs_frame, text="Cancel", command=lambda: self.worker.cancel(job_id))
+        cancel_button.grid(row=job_id, column=1, padx=5)
+        self.job_rows[job_id] = (status_var, cancel_button)
+
+    def poll_progress(self):
+        """Apply the progress updates queued by the worker thread to the jobs panel"""
+        while True:
+            try:
+                update = self.progress_updates.get_nowait()
+            except queue.Empty:
+                break
+
+            status_var, cancel_button = self.job_rows[update["job_id"]]
+            status_var.set(format_progress(update))
+            if update["done"]:
+                cancel_button.config(state="disabled")
+                # A finished job may have refreshed the cached table list
+                self.reload_table_dropdown()
+                if update["state"] == "completed":
+                    messagebox.showinfo("Query Completed", update["message"])
+                elif update["state"] == "failed":
+                    messagebox.showerror("Error", update["message"])
+
+        self.master.after(PROGRESS_POLL_MS, self.poll_progress)
+
+    def submit_export(self, label, export):
+        """Run an export coroutine function on the worker, passing it the job's progress tracker"""
+        job_id = next(self.job_ids)
+        progress = ExportProgress(job_id, label, self.progress_updates)
+        self.add_job_row(job_id, label)
+        self.worker.submit(job_id, self.run_export(progress, export))
+
+    async def run_export(self, progress, export):
+        try:
+            message = await export(progress)
+            progress.finish("completed", message)
+        except asyncio.CancelledError:
+            progress.finish("cancelled")
+        except Exception as e:
+            progress.finish("failed", f"An error occurred during the query process:\n{str(e)}")
+
+    def on_close(self):
+        self.worker.stop()
+        self.master.destroy()
 
     def browse_output_dir(self):
         """Open a file dialog to select the output directory"""
@@ -120,8 +316,8 @@ class DAPQueryApp:
         self.output_dir_entry.delete(0, 'end')
         self.output_dir_entry.insert(0, output_dir)
 
-    def select_since_timestamp(self):
-        """Open a calendar window to select the since timestamp for incremental queries"""
+    def select_timestamp(self, timestamp_var):
+        """Open a calendar window to select the since timestamp of incremental queries or the until timestamp of backfills"""
         def set_date():
             selected_date = cal.get_date()
             selected_time = f"{hour.get()}:{minute.get()}:{second.get()}"
@@ -131,7 +327,7 @@ class DAPQueryApp:
                 parsed_datetime = datetime.strptime(selected_datetime, "%Y-%m-%d %H:%M:%S")
                 # Format the datetime as required
                 formatted_datetime = parsed_datetime.strftime("%Y-%m-%dT%H:%M:%S+00:00")
-                self.since_timestamp_var.set(formatted_datetime)
+                timestamp_var.set(formatted_datetime)
                 top.destroy()
             except ValueError:
                 tk.messagebox.showerror("Invalid Date", "Please select a valid date and time.")
@@ -139,7 +335,8 @@ class DAPQueryApp:
         top = tk.Toplevel(self.master)
         top.title("Select Date and Time")
 
-        # Calendar
+        # Calendar; tkcalendar is only loaded once the date picker is opened
+        from tkcalendar import Calendar
         cal = Calendar(top, selectmode='day', date_pattern="yyyy-mm-dd")
         cal.pack(padx=10, pady=10)
 
@@ -167,6 +364,21 @@ class DAPQueryApp:
         top.grab_set()  # Make the window modal
         self.master.wait_window(top)  # Wait for the top-level window to be destroyed
 
+    def refresh_tables(self):
+        """Drop the cached catalog of the namespace and fetch the table list again in the background"""
+        base_url = self.api_url_entry.get()
+        client_id = self.client_id_entry.get()
+        client_secret = self.client_secret_entry.get()
+        namespace = self.namespace_entry.get()
+
+        catalog.for_api(base_url).invalidate(namespace)
+        self.submit_export(f"{namespace} table list", lambda progress: self.run_refresh_tables(base_url, client_id, client_secret, namespace, progress))
+
+    async def run_refresh_tables(self, base_url, client_id, client_secret, namespace, progress):
+        progress.set_state("fetching table list")
+        tables = await dap_core.fetch_table_names(base_url, client_id, client_secret, namespace)
+        return f"Found {len(tables)} tables in namespace {namespace}."
+
     def start_query(self):
         """Start the query process with the selected parameters"""
         base_url = self.api_url_entry.get()
@@ -178,68 +390,92 @@ class DAPQueryApp:
         since_timestamp = self.since_timestamp_var.get()
         file_format = self.file_format_var.get()
         output_directory = self.output_dir_entry.get()
+        options = self.checked_export_options()
+        if options is None:
+            return
 
-        asyncio.run(self.run_query(base_url, client_id, client_secret, namespace, table, query_type, since_timestamp, file_format, output_directory))
+        self.submit_export(table, lambda progress: self.run_query(base_url, client_id, client_secret, namespace, table, query_type, since_timestamp, file_format, output_directory, progress, **options))
 
-    async def run_query(self, base_url, client_id, client_secret, namespace, table, query_type, since_timestamp, file_format, output_directory):
-        """Run the query with the specified parameters"""
+    def start_batch(self):
+        """Start a batch export of several tables with the selected parameters"""
+        base_url = self.api_url_entry.get()
+        client_id = self.client_id_entry.get()
+        client_secret = self.client_secret_entry.get()
+        namespace = self.namespace_entry.get()
+        tables = parse_table_selection(self.batch_tables_entry.get())
+        query_type = self.query_type_var.get()
+        since_timestamp = self.since_timestamp_var.get()
+        file_format = self.file_format_var.get()
+        output_directory = self.output_dir_entry.get()
+        options = self.checked_export_options()
+        if options is None:
+            return
+        options["concurrency"] = int(self.batch_concurrency_spinbox.get())
+        options["max_jobs"] = int(self.max_jobs_spinbox.get())
+
+        self.submit_export("batch of all tables" if tables is None else f"batch of {len(tables)} tables", lambda progress: self.run_batch(base_url, client_id, client_secret, namespace, tables, query_type, since_timestamp, file_format, output_directory, progress, **options))
+
+    def checked_export_options(self):
+        """The export options of the window, or None after telling the user which of them is invalid"""
         try:
-            credentials = Credentials.create(client_id=client_id, client_secret=client_secret)
-            async with DAPClient(base_url=base_url, credentials=credentials) as dap_client:
-                # Get the table schema
-                schema = await dap_client.get_table_schema(namespace, table)
-                print(f"Table schema version: {schema.version}")
-
-                if query_type == "snapshot":
-                    # Perform a snapshot query
-                    snapshot_query = SnapshotQuery(format=Format[file_format.upper()], mode=None)
-                    snapshot_result = await dap_client.get_table_data(namespace, table, snapshot_query)
-                    print(f"Snapshot query completed. Job ID: {snapshot_result.job_id}")
-
-                    # Save snapshot data to the specified output directory
-                    snapshot_dir = os.path.join(output_directory, "snapshot")
-                    os.makedirs(snapshot_dir, exist_ok=True)
-                    download_result = await dap_client.download_table_data(namespace, table, snapshot_query, snapshot_dir, decompress=True)
-                    
-                    # Rename the downloaded files by appending the table name
-                    for file_path in download_result.downloaded_files:
-                        directory, filename = os.path.split(file_path)
-                        new_filename = f"{table}_{filename}"
-                        new_file_path = os.path.join(directory, new_filename)
-                        os.rename(file_path, new_file_path)
-                        print(f"Renamed file: {new_file_path}")
-                    
-                    print(f"Snapshot data downloaded and decompressed to: {snapshot_dir}")
-                else:
-                    # Convert the since_timestamp string to a datetime object with timezone
-                    since_datetime = datetime.strptime(since_timestamp, "%Y-%m-%dT%H:%M:%S%z").replace(tzinfo=timezone.utc)
-
-                    # Perform an incremental query
-                    incremental_query = IncrementalQuery(format=Format[file_format.upper()], mode=None, since=since_datetime, until=None)
-                    incremental_result = await dap_client.get_table_data(namespace, table, incremental_query)
-                    print(f"Incremental query completed. Job ID: {incremental_result.job_id}")
-
-                    # Save incremental data to the specified output directory
-                    incremental_dir = os.path.join(output_directory, "incremental")
-                    os.makedirs(incremental_dir, exist_ok=True)
-                    download_result = await dap_client.download_table_data(namespace, table, incremental_query, incremental_dir, decompress=True)
-                    
-                    # Rename the downloaded files by appending the table name
-                    for file_path in download_result.downloaded_files:
-                        directory, filename = os.path.split(file_path)
-                        new_filename = f"{table}_{filename}"
-                        new_file_path = os.path.join(directory, new_filename)
-                        os.rename(file_path, new_file_path)
-                        print(f"Renamed file: {new_file_path}")
-                    
-                    print(f"Incremental data downloaded and decompressed to: {incremental_dir}")
-
-            messagebox.showinfo("Query Completed", "Data query, download, and decompression completed successfully.")
-        except Exception as e:
-            messagebox.showerror("Error", f"An error occurred during the query process:\n{str(e)}")
+            return self.export_options()
+        except ValueError as e:
+            messagebox.showerror("Invalid Options", str(e))
+            return None
+
+    def export_options(self):
+        """The keyword options of dap_core.export_table selected in the window"""
+        return {
+            "merge": self.merge_var.get(),
+            "database_url": self.database_url_entry.get().strip() or None,
+            "download_workers": int(self.download_workers_spinbox.get()),
+            "convert": self.parquet_conversion(),
+            "backfill": self.backfill_options(),
+            "row_filter": self.row_filter(),
+        }
+
+    async def run_query(self, base_url, client_id, client_secret, namespace, table, query_type, since_timestamp, file_format, output_directory, progress, **options):
+        """Run the query with the specified parameters and the keyword options of dap_core.export_table"""
+        progress.metrics = dap_core.default_metrics(output_directory)
+        try:
+            async with dap_core.open_client(base_url, client_id, client_secret) as dap_client:
+                await dap_core.export_table(dap_client, namespace, table, query_type, since_timestamp, file_format, output_directory, base_url=base_url, progress=progress, **options)
+        finally:
+            await self.close_conversion(options)
 
-# Create the main window and start the application
-root = tk.Tk()
-app = DAPQueryApp(root)
-root.mainloop()
+        return "Data query, download, and decompression completed successfully."
+
+    async def run_batch(self, base_url, client_id, client_secret, namespace, tables, query_type, since_timestamp, file_format, output_directory, progress, **options):
+        """Run the query for several tables and report a per-table summary"""
+        progress.metrics = dap_core.default_metrics(output_directory)
+        try:
+            results = await dap_core.export_tables(base_url, client_id, client_secret, namespace, tables, query_type, since_timestamp, file_format, output_directory, progress=progress, **options)
+        finally:
+            await self.close_conversion(options)
+
+        summary = dap_core.format_batch_summary(results)
+        print(summary)
+        return summary
+
+    async def close_conversion(self, options):
+        """Stop the Parquet conversion workers that the tables of an export shared"""
+        if options.get("convert") is not None:
+            await asyncio.to_thread(options["convert"].close)
+
+def format_progress(update):
+    """Describe a progress update of a job on a single line"""
+    megabytes = update["bytes_downloaded"] / (1024 * 1024)
+    rate = update["throughput"] / (1024 * 1024)
+    return (f"{update['label']}: {update['state']} - "
+            f"{update['objects_done']}/{update['objects_total']} objects, "
+            f"{megabytes:.1f} MB, {rate:.1f} MB/s")
+
+if __name__ == "__main__":
+    # Lets the Parquet conversion worker processes start from a PyInstaller executable
+    multiprocessing.freeze_support()
+
+    # Create the main window and start the application
+    root = tk.Tk()
+    app = DAPQueryApp(root)
+    root.mainloop()
 
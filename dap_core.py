@@ -0,0 +1,592 @@
+import argparse
+import asyncio
+import os
+import shutil
+import sys
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+from catalog_cache import CatalogCache
+from export_metrics import METRICS_FILE, MetricsRecorder
+from job_scheduler import DEFAULT_MAX_JOBS, JobScheduler
+from object_store import DEFAULT_STORE_LIMIT, ObjectStore
+from row_filter import RowFilter
+from sync_state import SyncStateStore
+
+# The DAP client, aiohttp, pyarrow and the database drivers are imported where they are first needed,
+# so that importing this module or running `--help` stays fast on headless hosts.
+
+# Tables offered in the dropdown until the table list of the namespace has been cached
+TABLE_NAMES = [
+    "access_tokens", "account_users", "accounts", "assessment_question_banks",
+    "assessment_questions", "assignment_groups", "assignment_override_students",
+    "assignment_overrides", "assignments", "attachment_associations", "attachments",
+    "calendar_events", "canvadocs_annotation_contexts", "comment_bank_items",
+    "communication_channels", "content_migrations", "content_participation_counts",
+    "content_participations", "content_shares", "content_tags", "context_external_tools",
+    "context_module_progressions", "context_modules", "conversation_message_participants",
+    "conversation_messages", "conversation_participants", "conversations",
+    "course_account_associations", "course_sections", "courses",
+    "custom_gradebook_column_data", "custom_gradebook_columns",
+    "developer_key_account_bindings", "developer_keys", "discussion_entries",
+    "discussion_entry_participants", "discussion_topic_participants",
+    "discussion_topics", "enrollment_dates_overrides", "enrollment_states",
+    "enrollment_terms", "enrollments", "favorites", "folders", "grading_period_groups",
+    "grading_periods", "grading_standards", "group_categories", "group_memberships",
+    "groups", "late_policies", "learning_outcome_groups", "learning_outcome_question_results",
+    "learning_outcome_results", "learning_outcomes", "lti_line_items",
+    "lti_resource_links", "lti_results", "master_courses_child_content_tags",
+    "master_courses_child_subscriptions", "master_courses_master_content_tags",
+    "master_courses_master_migrations", "master_courses_master_templates",
+    "master_courses_migration_results", "originality_reports", "outcome_proficiencies",
+    "outcome_proficiency_ratings", "post_policies", "pseudonyms", "quiz_groups",
+    "quiz_questions", "quiz_submissions", "quizzes", "role_overrides", "roles",
+    "rubric_assessments", "rubric_associations", "rubrics", "score_statistics",
+    "scores", "submission_comments", "submission_versions", "submissions",
+    "user_account_associations", "user_notes", "users", "web_conference_participants",
+    "web_conferences", "wiki_pages", "wikis"
+]
+
+# On-disk cache of the table list and table schemas of each namespace
+catalog = CatalogCache()
+
+# Content-addressed store that downloads are linked from, when enabled with DAP_OBJECT_STORE or --object-store
+object_store = ObjectStore.from_environment()
+
+# Default number of tables downloading at the same time in batch mode
+DEFAULT_BATCH_CONCURRENCY = 4
+
+# Default number of objects of one job downloaded at the same time
+DEFAULT_DOWNLOAD_WORKERS = 4
+
+# Minimum number of seconds between two byte-count progress updates of a job
+PROGRESS_INTERVAL = 0.25
+
+# Length of the windows a backfill splits its since..until range into
+BACKFILL_WINDOWS = {"day": timedelta(days=1), "week": timedelta(weeks=1)}
+
+# Default number of windows of one table queried and downloaded at the same time in a backfill
+DEFAULT_WINDOW_CONCURRENCY = 4
+
+class ExportProgress:
+    """Tracks the progress of one export job and publishes snapshots to a thread-safe queue
+
+    The progress object also carries the MetricsRecorder that the phases of the export report to.
+    """
+
+    def __init__(self, job_id, label, updates=None, metrics=None):
+        self.job_id = job_id
+        self.label = label
+        self.updates = updates
+        self.metrics = metrics or MetricsRecorder()
+        self.state = "queued"
+        self.objects_done = 0
+        self.objects_total = 0
+        self.bytes_downloaded = 0
+        self.started = time.monotonic()
+        self.last_published = 0.0
+
+    def set_state(self, state):
+        self.state = state
+        self.publish(force=True)
+
+    def add_objects(self, count):
+        self.objects_total += count
+        self.publish(force=True)
+
+    def object_done(self):
+        self.objects_done += 1
+        self.publish(force=True)
+
+    def add_bytes(self, count):
+        self.bytes_downloaded += count
+        self.publish()
+
+    def finish(self, state, message=None):
+        self.state = state
+        self.publish(force=True, done=True, message=message)
+
+    def throughput(self):
+        """Average download rate of the job in bytes per second"""
+        elapsed = time.monotonic() - self.started
+        return self.bytes_downloaded / elapsed if elapsed > 0 else 0.0
+
+    def publish(self, force=False, done=False, message=None):
+        """Put a snapshot of the progress on the queue, rate limited unless forced"""
+        if self.updates is None:
+            return
+        now = time.monotonic()
+        if not force and now - self.last_published < PROGRESS_INTERVAL:
+            return
+        self.last_published = now
+        self.updates.put({
+            "job_id": self.job_id,
+            "label": self.label,
+            "state": self.state,
+            "objects_done": self.objects_done,
+            "objects_total": self.objects_total,
+            "bytes_downloaded": self.bytes_downloaded,
+            "throughput": self.throughput(),
+            "done": done,
+            "message": message,
+        })
+
+class ParquetConversion:
+    """Options of the post-download conversion into a partitioned Parquet dataset
+
+    Every table converted with the same options shares one pool of `workers` processes (one per CPU by
+    default), which is started on first use and stopped by close.
+    """
+
+    def __init__(self, partition_by=None, columns=None, workers=None):
+        self.partition_by = partition_by
+        self.columns = columns
+        self.workers = workers
+        self.executor = None
+        self.lock = threading.Lock()
+
+    def pool(self):
+        import parquet_converter
+
+        with self.lock:
+            if self.executor is None:
+                self.executor = parquet_converter.create_pool(self.workers)
+            return self.executor
+
+    def close(self):
+        with self.lock:
+            executor, self.executor = self.executor, None
+        if executor is not None:
+            executor.shutdown()
+
+class Backfill:
+    """Options of a backfill, which queries since..until as one incremental job per day or week window"""
+
+    def __init__(self, until, window="day", concurrency=DEFAULT_WINDOW_CONCURRENCY):
+        if window not in BACKFILL_WINDOWS:
+            raise ValueError(f"Unknown backfill window {window!r}; choose one of {', '.join(BACKFILL_WINDOWS)}.")
+        self.until = until
+        self.window = window
+        self.concurrency = concurrency
+
+def parse_timestamp(text):
+    """Parse a timestamp such as 2024-01-01T00:00:00+00:00 into a UTC datetime"""
+    return datetime.strptime(text, "%Y-%m-%dT%H:%M:%S%z").astimezone(timezone.utc)
+
+def split_windows(since, until, window):
+    """Split since..until into consecutive (start, end) windows
+
+    Windows end on UTC calendar boundaries, midnight for days and Monday midnight for weeks, so the
+    first and last windows may be shorter and the same range always splits into the same windows.
+    """
+    size = BACKFILL_WINDOWS[window]
+    boundary = since.replace(hour=0, minute=0, second=0, microsecond=0)
+    if window == "week":
+        boundary -= timedelta(days=boundary.weekday())
+
+    windows = []
+    start = since
+    while start < until:
+        boundary += size
+        end = min(boundary, until)
+        windows.append((start, end))
+        start = end
+    return windows
+
+def parse_predicate_list(text):
+    """Turn a semicolon separated list of row filter predicates into a list, e.g. `account_id in 1,2; active = true`"""
+    return [predicate.strip() for predicate in text.split(";") if predicate.strip()]
+
+def parse_column_list(text):
+    """Turn a comma separated column list into a list of names, or None when it is empty"""
+    columns = [column.strip() for column in text.split(",") if column.strip()]
+    return columns or None
+
+def parse_table_selection(selection):
+    """Turn a comma separated table list into a list of table names, or None for "all" tables"""
+    if selection.strip().lower() == "all":
+        return None
+    return [table.strip() for table in selection.split(",") if table.strip()]
+
+def format_batch_summary(results):
+    """Describe the outcome of a batch run, one line per table"""
+    succeeded = [table for table, error in results.items() if error is None]
+    lines = [f"{len(succeeded)} of {len(results)} tables exported successfully."]
+    for table, error in results.items():
+        lines.append(f"{table}: {'OK' if error is None else f'FAILED ({error})'}")
+    return "\n".join(lines)
+
+def open_client(base_url, client_id, client_secret):
+    """Create a DAPClient for the given credentials; use it with `async with` to get a session"""
+    from dap.api import DAPClient
+    from dap.dap_types import Credentials
+
+    credentials = Credentials.create(client_id=client_id, client_secret=client_secret)
+    return DAPClient(base_url=base_url, credentials=credentials)
+
+async def fetch_table_names(base_url, client_id, client_secret, namespace):
+    """Fetch the table list of a namespace into the catalog cache"""
+    async with open_client(base_url, client_id, client_secret) as dap_client:
+        return await catalog.for_api(base_url).get_tables(dap_client, namespace)
+
+async def export_tables(base_url, client_id, client_secret, namespace, tables, query_type, since_timestamp, file_format, output_directory, *, concurrency=DEFAULT_BATCH_CONCURRENCY, progress=None, max_jobs=DEFAULT_MAX_JOBS, **options):
+    """Export several tables over one authenticated session, pipelining their query jobs
+
+    The jobs of all tables are submitted up front (at most max_jobs in flight) and polled from one loop;
+    each table starts downloading as soon as its job completes, with at most `concurrency` tables
+    downloading at the same time. Passing None as tables exports every table of the namespace, as
+    listed by the catalog cache. The other keyword options are those of export_table. Returns a dict
+    mapping each table to None on success or the exception that stopped it.
+    """
+    progress = progress or ExportProgress(None, "batch", metrics=default_metrics(output_directory))
+
+    async with open_client(base_url, client_id, client_secret) as dap_client:
+        # Authenticate once up front so the concurrent exports share the same access token
+        with progress.metrics.phase(None, "authenticate"):
+            await dap_client.authenticate()
+
+        if tables is None:
+            tables = await catalog.for_api(base_url).get_tables(dap_client, namespace)
+
+        scheduler = JobScheduler(dap_client, max_jobs, concurrency)
+
+        async def export_one(table):
+            try:
+                await export_table(dap_client, namespace, table, query_type, since_timestamp, file_format, output_directory,
+                                   base_url=base_url, progress=progress, scheduler=scheduler, **options)
+                return table, None
+            except Exception as e:
+                print(f"Export of {table} failed: {e}")
+                return table, e
+
+        results = await asyncio.gather(*(export_one(table) for table in tables))
+
+    progress.metrics.write_prometheus()
+    return dict(results)
+
+def default_metrics(output_directory, prometheus_path=None):
+    """A MetricsRecorder appending to the metrics file of the output directory"""
+    return MetricsRecorder(os.path.join(output_directory, METRICS_FILE), prometheus_path)
+
+async def export_table(dap_client, namespace, table, query_type, since_timestamp, file_format, output_directory, *, base_url=None, progress=None, merge=False, database_url=None, download_workers=DEFAULT_DOWNLOAD_WORKERS, convert=None, scheduler=None, backfill=None, row_filter=None):
+    """Query and download a single table using an open DAP session
+
+    The options after output_directory are keyword-only, so that callers name every option they pass.
+    base_url is the API URL the session was opened with, which keys the catalog cache.
+    With merge enabled, snapshots rebuild and incremental results update the table's compacted Parquet
+    dataset in the `merged` directory. With a database URL, the objects are streamed straight into the
+    database and no data files are written. A ParquetConversion converts the downloaded files into a
+    partitioned dataset in `parquet/<table>/job_<id>`. The duration, bytes and row counts of every
+    phase are recorded with the MetricsRecorder of the progress object. Batch exports share one
+    JobScheduler, which polls their jobs together and limits the concurrent downloads. The backfill
+    query type splits since..until into the windows given by the Backfill options, see backfill_table.
+    A RowFilter drops the records and columns it does not select while the objects are decompressed
+    or streamed into the database, before anything is written; incremental results that are merged or
+    loaded into a database turn updates that no longer match into deletes instead.
+    """
+    if merge and file_format not in ("jsonl", "csv"):
+        raise ValueError("Merging into the Parquet store requires the jsonl or csv file format.")
+    if database_url and file_format not in ("jsonl", "csv"):
+        raise ValueError("Loading into a database requires the jsonl or csv file format.")
+    if database_url and merge:
+        raise ValueError("Choose either a database URL or merging into the Parquet store, not both.")
+    if convert and file_format not in ("jsonl", "csv"):
+        raise ValueError("Converting to partitioned Parquet requires the jsonl or csv file format.")
+    if convert and database_url:
+        raise ValueError("Converting to partitioned Parquet needs downloaded files; it cannot be combined with a database URL.")
+    if row_filter and file_format not in ("jsonl", "csv"):
+        raise ValueError("Filtering rows and columns requires the jsonl or csv file format.")
+    if query_type == "backfill" and backfill is None:
+        raise ValueError("A backfill needs the Backfill options with its until timestamp and window size.")
+    if query_type == "backfill" and (merge or database_url):
+        raise ValueError("A backfill writes each window to its own directory; it cannot be merged or loaded into a database.")
+
+    from dap.dap_types import Format, IncrementalQuery, SnapshotQuery
+
+    progress = progress or ExportProgress(None, table, metrics=default_metrics(output_directory))
+    scheduler = scheduler or JobScheduler(dap_client, max_downloads=backfill.concurrency if backfill else 1)
+    metrics = progress.metrics
+    export_started = time.monotonic()
+
+    # A no-op unless the access token is missing or about to expire
+    with metrics.phase(table, "authenticate"):
+        await dap_client.authenticate()
+
+    # Get the table schema from the catalog cache
+    progress.set_state(f"{table}: fetching schema")
+    with metrics.phase(table, "schema"):
+        schema = await catalog.for_api(base_url).get_schema(dap_client, namespace, table)
+    print(f"Table schema version: {schema.version}")
+
+    if query_type == "backfill":
+        await backfill_table(dap_client, namespace, table, schema, since_timestamp, file_format, output_directory, base_url=base_url, progress=progress,
+                             download_workers=download_workers, convert=convert, scheduler=scheduler, backfill=backfill, row_filter=row_filter)
+        metrics.table_summary(table, time.monotonic() - export_started)
+        return
+
+    # Snapshot and sync runs record the watermark returned by the API for the next sync
+    state_store = SyncStateStore.for_directory(output_directory)
+    record_watermark = query_type in ("snapshot", "sync")
+
+    if query_type == "sync":
+        # Continue from where the last sync of the table ended, or start with a snapshot
+        since_datetime = state_store.get_watermark(namespace, table)
+        if since_datetime is None:
+            log_timing(table, "no sync watermark recorded yet, falling back to a snapshot")
+            query_type = "snapshot"
+        else:
+            log_timing(table, f"syncing changes since {since_datetime.isoformat()}")
+            query_type = "incremental"
+    elif query_type == "incremental":
+        # Convert the since_timestamp string to a datetime object with timezone
+        since_datetime = parse_timestamp(since_timestamp)
+
+    snapshot = query_type == "snapshot"
+    if snapshot:
+        query = SnapshotQuery(format=Format[file_format.upper()], mode=None)
+    else:
+        query = IncrementalQuery(format=Format[file_format.upper()], mode=None, since=since_datetime, until=None)
+
+    started = time.monotonic()
+    log_timing(table, f"submitting {query_type} job")
+    progress.set_state(f"{table}: waiting for job")
+    table_data_result = await scheduler.run_job(namespace, table, query, progress)
+    log_timing(table, f"{query_type} job {table_data_result.job_id} completed with {len(table_data_result.objects)} objects", started)
+    print(f"{query_type.capitalize()} query completed. Job ID: {table_data_result.job_id}")
+    schema = await refresh_schema_for_job(dap_client, namespace, table, schema, table_data_result, base_url)
+    # Rows that an update moves out of the filter must also leave the merged dataset or the database table
+    record_filter = row_filter.bind(schema.schema, delete_mismatches=not snapshot and bool(merge or database_url)) if row_filter else None
+
+    # Downloads are limited separately from jobs, so a finished job never waits for queued ones
+    progress.set_state(f"{table}: waiting for a download slot")
+    async with scheduler.download_slots:
+        if database_url:
+            # Stream the objects of the completed job straight into the database
+            import sql_loader
+            progress.set_state(f"{table}: loading into database")
+            with metrics.phase(table, "database_load") as measurement:
+                measurement["rows"] = await sql_loader.load_job_objects(dap_client, table, table_data_result, schema, file_format, database_url, snapshot, progress, record_filter)
+            log_timing(table, f"loaded into {database_url}", started)
+        else:
+            # Save the data to the specified output directory, reusing the objects of the completed job
+            data_dir = os.path.join(output_directory, query_type)
+            os.makedirs(data_dir, exist_ok=True)
+            downloaded_files = await download_job_objects(dap_client, table, table_data_result, data_dir, decompress=file_format != "parquet", progress=progress,
+                                                          download_workers=download_workers, record_filter=record_filter, file_format=file_format)
+
+            if merge:
+                import merge_engine
+                progress.set_state(f"{table}: merging")
+                merge_store = os.path.join(output_directory, "merged")
+                merge_function = merge_engine.rebuild_from_snapshot if snapshot else merge_engine.apply_incremental
+                with metrics.phase(table, "merge") as measurement:
+                    measurement["rows"] = await asyncio.to_thread(merge_function, merge_store, table, schema, downloaded_files, file_format)
+
+            if convert:
+                dataset_directory = os.path.join(output_directory, "parquet", table, f"job_{table_data_result.job_id}")
+                await convert_job_files(table, dataset_directory, schema, downloaded_files, file_format, convert=convert, incremental=not snapshot,
+                                        progress=progress, row_filter=row_filter)
+
+            print(f"{query_type.capitalize()} data downloaded and decompressed to: {data_dir}")
+
+    if record_watermark:
+        state_store.set_watermark(namespace, table, table_data_result.timestamp, table_data_result.job_id)
+
+    metrics.table_summary(table, time.monotonic() - export_started)
+
+async def backfill_table(dap_client, namespace, table, schema, since_timestamp, file_format, output_directory, *, base_url=None, progress, download_workers, convert, scheduler, backfill, row_filter=None):
+    """Query the changes of since..until as one incremental job per window, each downloaded to its own partition
+
+    Window results go to `backfill/<table>/window=<start date>` (and `parquet/<table>/window=<start date>`
+    when converting). Up to backfill.concurrency windows run at the same time; each one is checkpointed
+    in the sync state store once its files are complete, so rerunning an interrupted or partly failed
+    backfill only queries the missing windows. The sync watermark of the table is left unchanged.
+    """
+    from dap.dap_types import Format, IncrementalQuery
+
+    state_store = SyncStateStore.for_directory(output_directory)
+    windows = split_windows(parse_timestamp(since_timestamp), parse_timestamp(backfill.until), backfill.window)
+    completed = state_store.completed_windows(namespace, table)
+    remaining = [window for window in windows if window not in completed]
+    log_timing(table, f"backfilling {len(windows)} {backfill.window} windows, {len(windows) - len(remaining)} already completed")
+    window_slots = asyncio.Semaphore(max(1, backfill.concurrency))
+
+    async def run_window(start, end):
+        partition = f"window={start:%Y-%m-%d}"
+        async with window_slots:
+            started = time.monotonic()
+            with progress.metrics.phase(table, "backfill_window", since=start.isoformat(), until=end.isoformat()):
+                query = IncrementalQuery(format=Format[file_format.upper()], mode=None, since=start, until=end)
+                table_data_result = await scheduler.run_job(namespace, table, query, progress)
+                window_schema = await refresh_schema_for_job(dap_client, namespace, table, schema, table_data_result, base_url)
+                record_filter = row_filter.bind(window_schema.schema) if row_filter else None
+
+                async with scheduler.download_slots:
+                    window_directory = os.path.join(output_directory, "backfill", table, partition)
+                    downloaded_files = await download_job_objects(dap_client, table, table_data_result, window_directory, decompress=file_format != "parquet", progress=progress,
+                                                                  download_workers=download_workers, record_filter=record_filter, file_format=file_format)
+                    if convert:
+                        dataset_directory = os.path.join(output_directory, "parquet", table, partition)
+                        await convert_job_files(table, dataset_directory, window_schema, downloaded_files, file_format, convert=convert, incremental=True,
+                                                progress=progress, row_filter=row_filter)
+
+                # Files of earlier, interrupted attempts at this window are superseded by the completed job
+                for entry in os.listdir(window_directory):
+                    if entry.startswith("job_") and entry != f"job_{table_data_result.job_id}":
+                        shutil.rmtree(os.path.join(window_directory, entry), ignore_errors=True)
+
+            state_store.mark_window_completed(namespace, table, start, end, table_data_result.job_id)
+            log_timing(table, f"{partition} ({start.isoformat()} to {end.isoformat()}) completed with {len(downloaded_files)} files", started)
+
+    results = await asyncio.gather(*(run_window(start, end) for start, end in remaining), return_exceptions=True)
+    errors = [result for result in results if isinstance(result, BaseException)]
+    if errors:
+        # The other windows were still completed and checkpointed; a rerun retries the failed ones
+        log_timing(table, f"{len(errors)} of {len(remaining)} backfill windows failed")
+        raise errors[0]
+    print(f"Backfill data downloaded to: {os.path.join(output_directory, 'backfill', table)}")
+
+async def refresh_schema_for_job(dap_client, namespace, table, schema, table_data_result, base_url=None):
+    """Refetch the table schema when the job reports a schema version other than the cached one"""
+    if table_data_result.schema_version == schema.version:
+        return schema
+    log_timing(table, f"job uses schema version {table_data_result.schema_version}, cached version is {schema.version}; refetching")
+    return await catalog.for_api(base_url).get_schema(dap_client, namespace, table, expected_version=table_data_result.schema_version)
+
+async def download_job_objects(dap_client, table, table_data_result, output_directory, *, decompress=True, progress=None, download_workers=DEFAULT_DOWNLOAD_WORKERS, record_filter=None, file_format=None):
+    """Download the objects of an already completed job without submitting the query again
+
+    Files are named `{table}_{filename}` inside the job directory; rerunning the same job resumes
+    partial objects and skips the completed ones. Parquet objects are not gzip compressed, so callers
+    pass decompress=False for that format. A RecordFilter bound to the table schema, together with
+    the jsonl or csv file format, filters the records while they are decompressed. Objects held by
+    the object store are linked from it instead of being downloaded again.
+    """
+    import download_engine
+
+    progress = progress or ExportProgress(None, table, metrics=default_metrics(output_directory))
+    started = time.monotonic()
+    job_directory = os.path.join(output_directory, f"job_{table_data_result.job_id}")
+
+    progress.set_state(f"{table}: downloading")
+    with progress.metrics.phase(table, "download_job", job_id=table_data_result.job_id, objects=len(table_data_result.objects)):
+        downloaded_files = await download_engine.download_objects(dap_client, table, table_data_result.objects, job_directory, decompress, progress, download_workers, record_filter, file_format, object_store)
+    log_timing(table, f"downloaded {len(downloaded_files)} files to {job_directory}", started)
+    return downloaded_files
+
+async def convert_job_files(table, dataset_directory, schema, downloaded_files, file_format, *, convert, incremental, progress, row_filter=None):
+    """Convert the downloaded files of a job into a partitioned Parquet dataset on a process pool
+
+    Without columns of its own, the dataset keeps the columns selected by the row filter.
+    """
+    import parquet_converter
+
+    started = time.monotonic()
+    progress.set_state(f"{table}: converting to Parquet")
+    columns = convert.columns or (row_filter.columns if row_filter else None)
+    with progress.metrics.phase(table, "convert") as measurement:
+        measurement["rows"] = await asyncio.to_thread(parquet_converter.convert_to_parquet, dataset_directory, table, schema, downloaded_files, file_format,
+                                                      convert.partition_by, columns, incremental, executor=convert.pool())
+    log_timing(table, f"converted to Parquet in {dataset_directory}", started)
+
+def log_timing(table, message, started=None):
+    """Print a timestamped progress line for a table, with the elapsed time since started if given"""
+    timestamp = datetime.now().strftime("%H:%M:%S")
+    elapsed = f" ({time.monotonic() - started:.1f}s)" if started is not None else ""
+    print(f"[{timestamp}] {table}: {message}{elapsed}")
+
+def parse_arguments(argv):
+    parser = argparse.ArgumentParser(description="Export tables from the DAP API without the GUI.")
+    parser.add_argument("--base-url", default=os.getenv("DAP_API_URL", "https://api-gateway.instructure.com"), help="DAP API URL")
+    parser.add_argument("--client-id", default=os.getenv("DAP_CLIENT_ID"), help="client ID (default: $DAP_CLIENT_ID)")
+    parser.add_argument("--client-secret", default=os.getenv("DAP_CLIENT_SECRET"), help="client secret (default: $DAP_CLIENT_SECRET)")
+    parser.add_argument("--namespace", default="canvas", help="namespace such as canvas")
+    parser.add_argument("--tables", default="all", help='comma separated table names, or "all" (default)')
+    parser.add_argument("--query-type", choices=["snapshot", "incremental", "sync", "backfill"], default="sync")
+    parser.add_argument("--since", default="", help="since timestamp of incremental queries and backfills, e.g. 2024-01-01T00:00:00+00:00")
+    parser.add_argument("--until", default="", help="until timestamp of backfills, e.g. 2024-07-01T00:00:00+00:00")
+    parser.add_argument("--window", choices=list(BACKFILL_WINDOWS), default="day", help="window size of backfills")
+    parser.add_argument("--window-concurrency", type=int, default=DEFAULT_WINDOW_CONCURRENCY, help="backfill windows of one table running at the same time")
+    parser.add_argument("--format", dest="file_format", choices=["jsonl", "csv", "tsv", "parquet"], default="jsonl")
+    parser.add_argument("--output-directory", required=True, help="directory for the downloaded files and sync state")
+    parser.add_argument("--concurrency", type=int, default=DEFAULT_BATCH_CONCURRENCY, help="tables downloading at the same time")
+    parser.add_argument("--max-jobs", type=int, default=DEFAULT_MAX_JOBS, help="query jobs in flight at the same time")
+    parser.add_argument("--download-workers", type=int, default=DEFAULT_DOWNLOAD_WORKERS, help="objects of one table downloaded at the same time")
+    parser.add_argument("--merge", action="store_true", help="merge the results into the Parquet store in <output>/merged")
+    parser.add_argument("--database-url", help="load into a database such as sqlite:///canvas.db instead of writing files")
+    parser.add_argument("--convert-parquet", action="store_true", help="convert the downloaded files into a Parquet dataset in <output>/parquet")
+    parser.add_argument("--partition-by", help="partition column of the Parquet dataset, e.g. account_id or updated_at:date")
+    parser.add_argument("--columns", default="", help="comma separated columns to keep in the Parquet dataset (key columns are always kept)")
+    parser.add_argument("--metrics-file", help=f"JSON Lines file for the phase metrics (default: <output>/{METRICS_FILE})")
+    parser.add_argument("--prometheus-textfile", help="also write the metrics in the Prometheus text format to this file")
+    parser.add_argument("--convert-workers", type=int, help="processes converting files to Parquet (default: number of CPUs)")
+    parser.add_argument("--where", action="append", default=[], help="row filter such as `account_id in 1,2,3` or `updated_at >= 2024-01-01T00:00:00Z`; repeat to combine")
+    parser.add_argument("--select", default="", help="comma separated value columns to download (key columns are always kept)")
+    parser.add_argument("--object-store", default=os.getenv("DAP_OBJECT_STORE"), help="directory of a local store that downloaded objects are reused from (default: $DAP_OBJECT_STORE)")
+    parser.add_argument("--object-store-size", type=float, default=float(os.getenv("DAP_OBJECT_STORE_SIZE") or DEFAULT_STORE_LIMIT / 1024 ** 3),
+                        help="size limit of the object store in GB (default: $DAP_OBJECT_STORE_SIZE or 50)")
+    parser.add_argument("--targets", help="JSON file listing credentials, namespaces and tables to export together; replaces --client-id, --client-secret, --namespace and --tables")
+    parser.add_argument("--request-rate", type=float, help="API requests per second and credential of a --targets run (default: 5)")
+    arguments = parser.parse_args(argv)
+
+    if not arguments.targets and (not arguments.client_id or not arguments.client_secret):
+        parser.error("a client ID and secret are required, through the options or DAP_CLIENT_ID and DAP_CLIENT_SECRET")
+    if arguments.query_type == "incremental" and not arguments.since:
+        parser.error("--since is required for incremental queries")
+    if arguments.query_type == "backfill" and not (arguments.since and arguments.until):
+        parser.error("--since and --until are required for backfills")
+    arguments.row_filter = None
+    if arguments.where or arguments.select:
+        try:
+            arguments.row_filter = RowFilter(arguments.where, parse_column_list(arguments.select))
+        except ValueError as e:
+            parser.error(f"--where: {e}")
+    return arguments
+
+def main(argv=None):
+    """Command line entry point; returns 0 when every table was exported successfully"""
+    arguments = parse_arguments(sys.argv[1:] if argv is None else argv)
+    convert = None
+    if arguments.convert_parquet:
+        convert = ParquetConversion(arguments.partition_by, parse_column_list(arguments.columns), arguments.convert_workers)
+    global object_store
+    if arguments.object_store:
+        object_store = ObjectStore(arguments.object_store, int(arguments.object_store_size * 1024 ** 3))
+    backfill = None
+    if arguments.query_type == "backfill":
+        backfill = Backfill(arguments.until, arguments.window, arguments.window_concurrency)
+    metrics_file = arguments.metrics_file or os.path.join(arguments.output_directory, METRICS_FILE)
+    progress = ExportProgress(None, "batch", metrics=MetricsRecorder(metrics_file, arguments.prometheus_textfile))
+
+    # Options of export_table, shared by both kinds of run
+    options = {
+        "merge": arguments.merge,
+        "database_url": arguments.database_url,
+        "download_workers": arguments.download_workers,
+        "convert": convert,
+        "backfill": backfill,
+        "row_filter": arguments.row_filter,
+    }
+
+    try:
+        if arguments.targets:
+            import orchestrator
+            results = asyncio.run(orchestrator.export_targets(
+                arguments.base_url, orchestrator.load_targets(arguments.targets), arguments.query_type, arguments.since,
+                arguments.file_format, arguments.output_directory, concurrency=arguments.concurrency, progress=progress,
+                max_jobs=arguments.max_jobs, request_rate=arguments.request_rate or orchestrator.DEFAULT_REQUEST_RATE, **options))
+        else:
+            results = asyncio.run(export_tables(
+                arguments.base_url, arguments.client_id, arguments.client_secret, arguments.namespace,
+                parse_table_selection(arguments.tables), arguments.query_type, arguments.since, arguments.file_format,
+                arguments.output_directory, concurrency=arguments.concurrency, progress=progress, max_jobs=arguments.max_jobs, **options))
+    finally:
+        if convert is not None:
+            convert.close()
+
+    print(format_batch_summary(results))
+    return 0 if all(error is None for error in results.values()) else 1
+
+if __name__ == "__main__":
+    sys.exit(main())
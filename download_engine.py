@@ -0,0 +1,400 @@
+import asyncio
+import csv
+import gzip
+import json
+import os
+import random
+import re
+import zlib
+from urllib.parse import urlparse
+
+import aiohttp
+
+from row_filter import DELETE
+from table_schema import CSV_NULL, DELETE_ACTION, GzipStream, parse_csv_record
+
+# Number of attempts made for one object before the download is given up
+DOWNLOAD_MAX_ATTEMPTS = 6
+
+# Base and maximum delay in seconds of the jittered exponential backoff between attempts
+DOWNLOAD_BACKOFF_BASE = 1.0
+DOWNLOAD_BACKOFF_CAP = 60.0
+
+# Size of the chunks read from the network and from partial files
+DOWNLOAD_CHUNK_SIZE = 64 * 1024
+
+# Name of the file that records the completely downloaded objects of a job directory
+MANIFEST_FILE = "_download_manifest.json"
+
+# Statuses worth retrying with the same URL
+RETRY_STATUSES = {408, 429, 500, 502, 503, 504}
+
+# Statuses returned by object storage for an expired presigned URL
+EXPIRED_URL_STATUSES = {400, 401, 403}
+
+class DownloadError(RuntimeError):
+    pass
+
+class RetryableDownloadError(Exception):
+    def __init__(self, message, refresh_url=False):
+        super().__init__(message)
+        self.refresh_url = refresh_url
+
+class DownloadManifest:
+    """Records which objects of a job directory have been downloaded, verified and renamed into place"""
+
+    def __init__(self, directory):
+        self.path = os.path.join(directory, MANIFEST_FILE)
+        self.entries = {}
+        if os.path.exists(self.path):
+            with open(self.path) as manifest_file:
+                self.entries = json.load(manifest_file)
+
+    def completed_file(self, object_id):
+        """Return the final path of an object from an earlier run, if it is still complete on disk"""
+        entry = self.entries.get(object_id)
+        if entry is None:
+            return None
+        file_path = os.path.join(os.path.dirname(self.path), entry["file"])
+        if os.path.exists(file_path) and os.path.getsize(file_path) == entry["size"]:
+            return file_path
+        return None
+
+    def mark_completed(self, object_id, file_path):
+        self.entries[object_id] = {"file": os.path.basename(file_path), "size": os.path.getsize(file_path)}
+        temp_path = f"{self.path}.tmp"
+        with open(temp_path, "w") as manifest_file:
+            json.dump(self.entries, manifest_file, indent=4)
+        os.replace(temp_path, self.path)
+
+def backoff_delay(attempt):
+    """Exponential backoff with full jitter, so parallel workers do not retry in lockstep"""
+    return random.uniform(0, min(DOWNLOAD_BACKOFF_CAP, DOWNLOAD_BACKOFF_BASE * 2 ** attempt))
+
+def content_range_total(content_range):
+    """Return the total size from a Content-Range header such as `bytes 100-199/200` or `bytes */200`"""
+    match = re.search(r"/(\d+)$", content_range or "")
+    return int(match.group(1)) if match else None
+
+def open_session():
+    """An HTTP session for object downloads, which may stream for a long time but not stall"""
+    return aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=None, sock_connect=30, sock_read=300))
+
+async def run_tasks(coroutines):
+    """Run coroutines as the tasks of one TaskGroup and return their results in order
+
+    When one task fails, the others are cancelled and awaited before its exception is raised, so no
+    task is left running on a session or connection that the caller closes next.
+    """
+    try:
+        async with asyncio.TaskGroup() as task_group:
+            tasks = [task_group.create_task(coroutine) for coroutine in coroutines]
+    except ExceptionGroup as group:
+        # Raise the first failure itself, as asyncio.gather does, so callers see the original error
+        raise group.exceptions[0]
+    return [task.result() for task in tasks]
+
+async def download_objects(dap_client, table, objects, output_directory, decompress, progress, workers, record_filter=None, file_format=None, object_store=None):
+    """Download the objects of a completed job in parallel into `{table}_{filename}` files
+
+    Objects recorded as complete by an earlier run are skipped, partial objects are resumed with HTTP
+    range requests, and failed attempts are retried with backoff, refreshing the presigned URL when it
+    has expired. With a RecordFilter, only the matching records and selected columns of the jsonl or
+    csv objects are written while they are decompressed. With an ObjectStore, objects it already holds
+    are linked from the store instead of downloaded, and new ones are added to it. Returns the final
+    file paths in the order of the objects.
+    """
+    os.makedirs(output_directory, exist_ok=True)
+    manifest = DownloadManifest(output_directory)
+    progress.add_objects(len(objects))
+
+    file_paths = {}
+    pending = []
+    for dap_object in objects:
+        file_path = manifest.completed_file(dap_object.id)
+        if file_path is None:
+            pending.append(dap_object)
+        else:
+            file_paths[dap_object.id] = file_path
+            progress.object_done()
+    if file_paths:
+        print(f"Skipping {len(file_paths)} objects of {table} that are already downloaded")
+
+    if pending:
+        # Resolve the object IDs to presigned URLs in a single request
+        resources = await dap_client.get_resources(pending)
+        semaphore = asyncio.Semaphore(max(1, workers))
+        async with open_session() as session:
+            async def download_one(dap_object):
+                async with semaphore:
+                    file_path = await download_object(session, dap_client, table, dap_object, resources[dap_object.id],
+                                                      output_directory, decompress, progress, record_filter, file_format, object_store)
+                    manifest.mark_completed(dap_object.id, file_path)
+                    file_paths[dap_object.id] = file_path
+                    progress.object_done()
+
+            await run_tasks(download_one(dap_object) for dap_object in pending)
+
+    return [file_paths[dap_object.id] for dap_object in objects]
+
+async def download_object(session, dap_client, table, dap_object, resource, output_directory, decompress, progress, record_filter=None, file_format=None, object_store=None):
+    """Download one object into a partial file with retries, verify it and move it into its final path
+
+    The store lookup, download (per attempt), decompress (or filter) and finalize phases of the object
+    are recorded with the metrics recorder of the progress object.
+    """
+    file_name = os.path.basename(urlparse(str(resource.url)).path)
+    part_path = os.path.join(output_directory, f"{table}_{file_name}.part")
+    if decompress:
+        file_name = file_name.removesuffix(".gz")
+    final_path = os.path.join(output_directory, f"{table}_{file_name}")
+    temp_path = f"{final_path}.tmp"
+    metrics = progress.metrics
+
+    etag = None
+    if object_store is not None:
+        variant = object_variant(decompress, record_filter)
+        with metrics.phase(table, "store_lookup", object_id=dap_object.id) as measurement:
+            stored_path = await asyncio.to_thread(object_store.lookup, dap_object.id, variant)
+            if stored_path is None:
+                # Another job may have produced an object with the same content
+                etag = await probe_etag(session, str(resource.url))
+                if etag is not None:
+                    stored_path = await asyncio.to_thread(object_store.lookup, dap_object.id, variant, etag)
+            measurement["hit"] = stored_path is not None
+            if stored_path is not None:
+                measurement["link"] = await asyncio.to_thread(object_store.materialize, stored_path, final_path)
+                measurement["bytes_out"] = os.path.getsize(final_path)
+        if stored_path is not None:
+            return final_path
+
+    for attempt in range(1, DOWNLOAD_MAX_ATTEMPTS + 1):
+        try:
+            with metrics.phase(table, "download", object_id=dap_object.id, attempt=attempt) as measurement:
+                await fetch_to_part(session, str(resource.url), part_path, progress)
+                measurement["bytes"] = os.path.getsize(part_path)
+            if decompress and record_filter is not None:
+                with metrics.phase(table, "filter", object_id=dap_object.id) as measurement:
+                    measurement["bytes"] = os.path.getsize(part_path)
+                    measurement["bytes_out"], measurement["lines"], measurement["rows"] = await asyncio.to_thread(
+                        filter_part, part_path, temp_path, record_filter, file_format)
+            elif decompress:
+                with metrics.phase(table, "decompress", object_id=dap_object.id) as measurement:
+                    measurement["bytes"] = os.path.getsize(part_path)
+                    measurement["bytes_out"], measurement["lines"] = await asyncio.to_thread(decompress_part, part_path, temp_path)
+            with metrics.phase(table, "finalize", object_id=dap_object.id):
+                await asyncio.to_thread(finalize_part, part_path, temp_path, final_path, decompress)
+            if object_store is not None:
+                with metrics.phase(table, "store_add", object_id=dap_object.id) as measurement:
+                    measurement["link"] = await asyncio.to_thread(object_store.add, final_path, dap_object.id, variant, etag)
+            return final_path
+        except RetryableDownloadError as e:
+            resource = await prepare_retry(dap_client, table, dap_object, resource, attempt, e)
+
+async def prepare_retry(dap_client, table, dap_object, resource, attempt, error):
+    """Wait out the backoff after a failed attempt and return the resource to retry with
+
+    Raises DownloadError once the attempts are used up, and fetches a new presigned URL when the
+    error says the old one has expired.
+    """
+    if attempt == DOWNLOAD_MAX_ATTEMPTS:
+        raise DownloadError(f"Giving up on object {dap_object.id} of {table} after {attempt} attempts: {error}") from error
+    if error.refresh_url:
+        resource = (await dap_client.get_resources([dap_object]))[dap_object.id]
+    delay = backoff_delay(attempt)
+    print(f"Download of {table} object {dap_object.id} failed ({error}), retrying in {delay:.1f}s")
+    await asyncio.sleep(delay)
+    return resource
+
+async def stream_object(session, dap_client, table, dap_object, resource, progress):
+    """Yield the bytes of an object as they arrive, retrying failed attempts like download_object
+
+    An interrupted transfer is resumed with a range request from the first byte not yet yielded, so
+    the consumer receives every byte exactly once however often the connection drops.
+    """
+    offset = 0
+    for attempt in range(1, DOWNLOAD_MAX_ATTEMPTS + 1):
+        try:
+            headers = {"Range": f"bytes={offset}-"} if offset else {}
+            try:
+                async with session.get(str(resource.url), headers=headers) as response:
+                    if response.status == 416 and content_range_total(response.headers.get("Content-Range")) == offset:
+                        return
+                    check_response(response)
+                    if response.status == 206:
+                        expected_size = content_range_total(response.headers.get("Content-Range"))
+                        skip = 0
+                    else:
+                        # The server sent the whole object again; drop the bytes that were already yielded
+                        expected_size = response.content_length
+                        skip = offset
+                    async for chunk in response.content.iter_chunked(DOWNLOAD_CHUNK_SIZE):
+                        if skip:
+                            dropped = min(skip, len(chunk))
+                            chunk = chunk[dropped:]
+                            skip -= dropped
+                            if not chunk:
+                                continue
+                        offset += len(chunk)
+                        progress.add_bytes(len(chunk))
+                        yield chunk
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                raise RetryableDownloadError(str(e) or type(e).__name__) from e
+            if expected_size is not None and offset != expected_size:
+                raise RetryableDownloadError(f"expected {expected_size} bytes but have {offset}")
+            return
+        except RetryableDownloadError as e:
+            resource = await prepare_retry(dap_client, table, dap_object, resource, attempt, e)
+
+def object_variant(decompress, record_filter):
+    """Name of the form in which an object's output file holds its data"""
+    if not decompress:
+        return "gzip"
+    if record_filter is None:
+        return "decompressed"
+    return f"filtered-{record_filter.fingerprint}"
+
+async def probe_etag(session, url):
+    """Fetch the ETag of an object with a one-byte range request, or None when the server sends none
+
+    Presigned URLs are only valid for GET, so a HEAD request cannot be used.
+    """
+    try:
+        async with session.get(url, headers={"Range": "bytes=0-0"}) as response:
+            if response.status in (200, 206):
+                return response.headers.get("ETag")
+    except (aiohttp.ClientError, asyncio.TimeoutError):
+        pass
+    return None
+
+async def fetch_to_part(session, url, part_path, progress):
+    """Fetch the remaining bytes of an object into its partial file and check the size against the server's"""
+    offset = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+    headers = {"Range": f"bytes={offset}-"} if offset else {}
+
+    try:
+        async with session.get(url, headers=headers) as response:
+            if response.status == 416:
+                if content_range_total(response.headers.get("Content-Range")) == offset:
+                    return  # The partial file already holds the whole object
+                os.remove(part_path)
+                raise RetryableDownloadError("partial file does not match the remote object")
+            check_response(response)
+
+            if response.status == 206:
+                expected_size = content_range_total(response.headers.get("Content-Range"))
+            else:
+                # The server sent the whole object, either because no range was asked for or it was ignored
+                offset = 0
+                expected_size = response.content_length
+
+            with open(part_path, "r+b" if offset else "wb") as part_file:
+                part_file.seek(offset)
+                part_file.truncate()
+                async for chunk in response.content.iter_chunked(DOWNLOAD_CHUNK_SIZE):
+                    part_file.write(chunk)
+                    progress.add_bytes(len(chunk))
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        raise RetryableDownloadError(str(e) or type(e).__name__) from e
+
+    size = os.path.getsize(part_path)
+    if expected_size is not None and size != expected_size:
+        raise RetryableDownloadError(f"expected {expected_size} bytes but have {size}")
+
+def check_response(response):
+    """Raise the error that matches an unsuccessful response to an object request"""
+    if response.status in EXPIRED_URL_STATUSES:
+        raise RetryableDownloadError(f"HTTP status {response.status}", refresh_url=True)
+    if response.status in RETRY_STATUSES:
+        raise RetryableDownloadError(f"HTTP status {response.status}")
+    if response.status not in (200, 206):
+        raise DownloadError(f"Request failed with HTTP status code: {response.status}")
+
+def decompress_part(part_path, temp_path):
+    """Decompress a verified partial file into a temporary file; returns the bytes and lines written"""
+    gzip_stream = GzipStream()
+    bytes_written = 0
+    lines = 0
+    try:
+        with open(part_path, "rb") as part_file, open(temp_path, "wb") as output_file:
+            while chunk := part_file.read(DOWNLOAD_CHUNK_SIZE):
+                data = gzip_stream.decompress(chunk)
+                output_file.write(data)
+                bytes_written += len(data)
+                lines += data.count(b"\n")
+            data = gzip_stream.flush()
+            output_file.write(data)
+            bytes_written += len(data)
+            lines += data.count(b"\n")
+    except zlib.error as e:
+        # The bytes on disk are corrupt; drop them so the next attempt downloads the object again
+        os.remove(part_path)
+        os.remove(temp_path)
+        raise RetryableDownloadError(f"corrupt gzip data: {e}") from e
+    return bytes_written, lines
+
+def filter_part(part_path, temp_path, record_filter, file_format):
+    """Decompress a verified partial file, writing only the records and columns the filter keeps
+
+    Records are parsed as they are decompressed, so nothing but the kept data reaches the disk. Records
+    the filter turns into deletes are written without values and with the delete action. Returns the
+    bytes written, the records read and the records kept.
+    """
+    records_read = 0
+    records_kept = 0
+    try:
+        with gzip.open(part_path, "rt", encoding="utf-8", newline="") as input_file, \
+                open(temp_path, "w", encoding="utf-8", newline="") as output_file:
+            if file_format == "jsonl":
+                for line in input_file:
+                    if not line.strip():
+                        continue
+                    records_read += 1
+                    record = json.loads(line)
+                    outcome = record_filter.decide(record.get("key", {}), record.get("value", {}), record.get("meta", {}).get("action"))
+                    if outcome is None:
+                        continue
+                    records_kept += 1
+                    if outcome == DELETE:
+                        record = {"key": record.get("key", {}), "meta": {**record.get("meta", {}), "action": DELETE_ACTION}}
+                        output_file.write(json.dumps(record) + "\n")
+                        continue
+                    if record_filter.value_columns is None:
+                        # Without a projection the record is written exactly as it was received
+                        output_file.write(line if line.endswith("\n") else line + "\n")
+                        continue
+                    if "value" in record:
+                        record["value"] = record_filter.project(record["value"])
+                    output_file.write(json.dumps(record) + "\n")
+            else:
+                reader = csv.reader(input_file)
+                writer = csv.writer(output_file, lineterminator="\n")
+                header = next(reader, None)
+                if header is not None:
+                    kept_indexes = [index for index, field in enumerate(header) if record_filter.keeps_field(field)]
+                    writer.writerow([header[index] for index in kept_indexes])
+                    for fields in reader:
+                        records_read += 1
+                        outcome = record_filter.decide(*parse_csv_record(header, fields))
+                        if outcome is None:
+                            continue
+                        records_kept += 1
+                        if outcome == DELETE:
+                            fields = [DELETE_ACTION if field == "meta.action" else CSV_NULL if field.startswith("value.") else field_value
+                                      for field, field_value in zip(header, fields)]
+                        writer.writerow([fields[index] for index in kept_indexes])
+    except (zlib.error, gzip.BadGzipFile, EOFError) as e:
+        # The bytes on disk are corrupt; drop them so the next attempt downloads the object again
+        os.remove(part_path)
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise RetryableDownloadError(f"corrupt gzip data: {e}") from e
+    return os.path.getsize(temp_path), records_read, records_kept
+
+def finalize_part(part_path, temp_path, final_path, decompress):
+    """Atomically rename the decompressed temporary file, or the partial file itself, into its final path"""
+    if not decompress:
+        os.replace(part_path, final_path)
+        return
+    os.replace(temp_path, final_path)
+    os.remove(part_path)
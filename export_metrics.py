@@ -0,0 +1,93 @@
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+# Name of the JSON Lines file that exports append their measurements to, inside the output directory
+METRICS_FILE = "dap_export_metrics.jsonl"
+
+# Fields of a measurement that are summed per table and phase
+COUNTER_FIELDS = ("bytes", "bytes_out", "lines", "rows")
+
+class MetricsRecorder:
+    """Records the duration, bytes and row counts of each phase of an export
+
+    Every measurement is appended to a JSON Lines file as soon as it is taken, and summed per table and
+    phase for the per-table summary and the optional Prometheus textfile. Measurements are taken from
+    the event loop and from worker threads, so recording is serialized with a lock.
+    """
+
+    def __init__(self, path=None, prometheus_path=None):
+        self.path = path
+        self.prometheus_path = prometheus_path
+        self.lock = threading.Lock()
+        self.totals = {}
+
+    @contextmanager
+    def phase(self, table, phase, **fields):
+        """Time the enclosed block; the caller may add counters such as bytes or rows to the yielded dict"""
+        measurement = dict(fields)
+        started = time.monotonic()
+        try:
+            yield measurement
+        except BaseException as e:
+            measurement["error"] = str(e) or type(e).__name__
+            raise
+        finally:
+            self.record(table, phase, time.monotonic() - started, **measurement)
+
+    def record(self, table, phase, seconds, **fields):
+        event = {"time": datetime.now(timezone.utc).isoformat(), "table": table, "phase": phase, "seconds": round(seconds, 6)}
+        event.update(fields)
+        with self.lock:
+            totals = self.totals.setdefault((table, phase), dict.fromkeys(("count", "errors", "seconds") + COUNTER_FIELDS, 0))
+            totals["count"] += 1
+            totals["errors"] += "error" in fields
+            totals["seconds"] += seconds
+            for field in COUNTER_FIELDS:
+                totals[field] += fields.get(field) or 0
+            if self.path is not None:
+                os.makedirs(os.path.dirname(os.path.abspath(self.path)), exist_ok=True)
+                with open(self.path, "a") as metrics_file:
+                    metrics_file.write(json.dumps(event, default=str) + "\n")
+
+    def table_summary(self, table, seconds):
+        """Record the total time of a table export together with the summed counters of each of its phases"""
+        with self.lock:
+            phases = {phase: dict(totals) for (phase_table, phase), totals in self.totals.items() if phase_table == table}
+        self.record(table, "total", seconds, phases=phases)
+
+    def write_prometheus(self):
+        """Write the summed measurements in the Prometheus text format for the node exporter's textfile collector"""
+        if self.prometheus_path is None:
+            return
+        metrics = [
+            ("dap_export_phase_seconds_total", "counter", "Time spent in each phase of DAP exports", "seconds"),
+            ("dap_export_phase_runs_total", "counter", "Number of times each phase of DAP exports ran", "count"),
+            ("dap_export_phase_errors_total", "counter", "Number of failed runs of each phase of DAP exports", "errors"),
+            ("dap_export_bytes_total", "counter", "Bytes read by each phase of DAP exports", "bytes"),
+            ("dap_export_output_bytes_total", "counter", "Bytes written by each phase of DAP exports", "bytes_out"),
+            ("dap_export_lines_total", "counter", "Lines decompressed by each phase of DAP exports", "lines"),
+            ("dap_export_rows_total", "counter", "Rows processed by each phase of DAP exports", "rows"),
+        ]
+        with self.lock:
+            totals = sorted(self.totals.items(), key=lambda item: (str(item[0][0]), item[0][1]))
+
+        lines = []
+        for name, metric_type, description, field in metrics:
+            lines.append(f"# HELP {name} {description}")
+            lines.append(f"# TYPE {name} {metric_type}")
+            for (table, phase), values in totals:
+                if phase != "total":
+                    lines.append(f'{name}{{table="{table or ""}",phase="{phase}"}} {values[field]}')
+        lines.append("# HELP dap_export_last_run_timestamp_seconds Time the metrics of the last DAP export were written")
+        lines.append("# TYPE dap_export_last_run_timestamp_seconds gauge")
+        lines.append(f"dap_export_last_run_timestamp_seconds {time.time():.3f}")
+
+        # The collector may read the file at any time, so it is replaced atomically
+        temp_path = f"{self.prometheus_path}.tmp"
+        with open(temp_path, "w") as prometheus_file:
+            prometheus_file.write("\n".join(lines) + "\n")
+        os.replace(temp_path, self.prometheus_path)
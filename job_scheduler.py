@@ -0,0 +1,135 @@
+import asyncio
+import time
+from datetime import datetime, timezone
+
+# Seconds before the first status check of a newly submitted job
+JOB_POLL_INITIAL = 1.0
+
+# Factor by which the poll interval of a job grows after every check that finds it still running
+JOB_POLL_BACKOFF = 1.5
+
+# Longest interval between two status checks of the same job
+JOB_POLL_MAX = 30.0
+
+# Default number of query jobs submitted and not yet finished at the same time
+DEFAULT_MAX_JOBS = 8
+
+# A completed job that the API hands out again for a repeated query is not used when it expires within
+# this many seconds, since its object URLs could stop working while they are downloaded
+JOB_EXPIRY_MARGIN = 300
+
+# Seconds waited past the expiry of such a job before the query is submitted again
+JOB_EXPIRY_GRACE = 5
+
+class PendingJob:
+    def __init__(self, job, future):
+        self.job = job
+        self.future = future
+        self.interval = JOB_POLL_INITIAL
+        self.next_poll = time.monotonic() + JOB_POLL_INITIAL
+
+class JobScheduler:
+    """Submits query jobs and waits for all of them from a single polling loop
+
+    Each job is checked on its own schedule, starting after JOB_POLL_INITIAL seconds and backing off
+    towards JOB_POLL_MAX while it keeps running, so short jobs are picked up quickly and long ones do not
+    flood the API. At most `max_jobs` jobs are in flight; `download_slots` separately limits how many
+    finished jobs are downloading at the same time, so a table can start its download the moment its
+    job completes while other jobs are still queued at the server. Schedulers of several sessions can
+    share one download semaphore to limit the downloads of the whole run.
+    """
+
+    def __init__(self, dap_client, max_jobs=DEFAULT_MAX_JOBS, max_downloads=1, download_slots=None):
+        self.dap_client = dap_client
+        self.job_slots = asyncio.Semaphore(max(1, max_jobs))
+        self.download_slots = download_slots or asyncio.Semaphore(max(1, max_downloads))
+        self.pending = {}
+        self.wake_up = asyncio.Event()
+        self.poll_task = None
+
+    async def run_job(self, namespace, table, query, progress):
+        """Submit a query job and wait until it completes
+
+        Returns the same result as DAPSession.get_table_data, using the objects listed by the completed job.
+        Like DAPSession.execute_job, a reused completed job that is about to expire is waited out and
+        the query submitted again, here with JOB_EXPIRY_MARGIN to leave time for the download.
+        """
+        from dap.api import DAPClientError
+        from dap.dap_types import CompleteSnapshotJob, GetTableDataResult, JobStatus, SnapshotQuery
+
+        async with self.job_slots:
+            while True:
+                with progress.metrics.phase(table, "job_submit"):
+                    if isinstance(query, SnapshotQuery):
+                        job = await self.dap_client.query_snapshot(namespace, table, query)
+                    else:
+                        job = await self.dap_client.query_incremental(namespace, table, query)
+                remaining = expires_in(job)
+                if job.status is not JobStatus.Complete or remaining is None or remaining >= JOB_EXPIRY_MARGIN:
+                    break
+                # The same completed job is returned until it expires, so wait for that and submit the query again
+                with progress.metrics.phase(table, "job_expiry_wait", job_id=job.id):
+                    await asyncio.sleep(max(0.0, remaining) + JOB_EXPIRY_GRACE)
+
+            with progress.metrics.phase(table, "job_wait", job_id=job.id) as measurement:
+                if not job.status.isTerminal():
+                    job = await self.wait_for(job)
+                measurement["status"] = job.status.value
+
+        if job.status is not JobStatus.Complete:
+            raise DAPClientError(f"Query job {job.id} of {table} ended with status: {job.status.value}")
+        timestamp = job.at if isinstance(job, CompleteSnapshotJob) else job.until
+        return GetTableDataResult(job.schema_version, timestamp, job.id, job.objects)
+
+    async def wait_for(self, job):
+        future = asyncio.get_running_loop().create_future()
+        self.pending[job.id] = PendingJob(job, future)
+        if self.poll_task is None or self.poll_task.done():
+            self.poll_task = asyncio.create_task(self.poll_jobs())
+        self.wake_up.set()
+        try:
+            return await future
+        finally:
+            # A cancelled export stops polling its job
+            self.pending.pop(job.id, None)
+
+    async def poll_jobs(self):
+        """Check every pending job whose poll time has come, until no jobs are pending"""
+        while self.pending:
+            now = time.monotonic()
+            due = [pending for pending in self.pending.values() if pending.next_poll <= now]
+            if due:
+                await asyncio.gather(*(self.poll(pending) for pending in due))
+                continue
+
+            next_poll = min(pending.next_poll for pending in self.pending.values())
+            self.wake_up.clear()
+            try:
+                # Newly submitted jobs wake the loop up so their first check is not delayed
+                await asyncio.wait_for(self.wake_up.wait(), timeout=max(0.0, next_poll - now))
+            except asyncio.TimeoutError:
+                pass
+
+    async def poll(self, pending):
+        try:
+            job = await self.dap_client.get_job(pending.job.id)
+        except Exception as e:
+            self.pending.pop(pending.job.id, None)
+            if not pending.future.done():
+                pending.future.set_exception(e)
+            return
+
+        if job.status.isTerminal():
+            self.pending.pop(job.id, None)
+            if not pending.future.done():
+                pending.future.set_result(job)
+            return
+
+        pending.interval = min(JOB_POLL_MAX, pending.interval * JOB_POLL_BACKOFF)
+        pending.next_poll = time.monotonic() + pending.interval
+
+def expires_in(job):
+    """Seconds until a job expires, or None when the API did not say"""
+    if job.expires_at is None:
+        return None
+    return (job.expires_at - datetime.now(timezone.utc)).total_seconds()
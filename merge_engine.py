@@ -0,0 +1,218 @@
+import heapq
+import itertools
+import json
+import os
+import pickle
+import shutil
+import tempfile
+from datetime import datetime, timezone
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
+from table_schema import column_types, is_delete, key_columns, read_records, record_row
+
+# Number of delta records sorted in memory before they are spilled to a sorted run on disk
+MERGE_SORT_BUFFER_ROWS = 200_000
+
+# Number of rows written to each Parquet part file of a merged table
+MERGE_ROWS_PER_FILE = 1_000_000
+
+# Number of rows buffered before they are written as one Parquet row group
+MERGE_ROW_GROUP_SIZE = 50_000
+
+# Name of the file describing the merged dataset of a table
+MERGE_STATE_FILE = "_merge_state.json"
+
+ARROW_TYPES = {
+    "integer": "int64",
+    "number": "float64",
+    "boolean": "bool_",
+    "string": "string",
+    "json": "string",
+    "null": "string",
+}
+
+class MergeError(RuntimeError):
+    pass
+
+def merged_table_directory(store_directory, table):
+    return os.path.join(store_directory, table)
+
+def has_base_snapshot(store_directory, table):
+    """Check whether a merged dataset exists for the table that deltas can be applied onto"""
+    recover_directory(merged_table_directory(store_directory, table))
+    return os.path.exists(os.path.join(merged_table_directory(store_directory, table), MERGE_STATE_FILE))
+
+def rebuild_from_snapshot(store_directory, table, versioned_schema, snapshot_files, file_format):
+    """Replace the merged dataset of a table with the content of freshly downloaded snapshot files"""
+    return merge_table(store_directory, table, versioned_schema, snapshot_files, file_format, base=False)
+
+def apply_incremental(store_directory, table, versioned_schema, incremental_files, file_format):
+    """Apply the upserts and deletes of downloaded incremental files onto the merged dataset of a table"""
+    if not has_base_snapshot(store_directory, table):
+        raise MergeError(f"No merged snapshot of {table} exists yet; run a snapshot query with merging enabled first.")
+    return merge_table(store_directory, table, versioned_schema, incremental_files, file_format, base=True)
+
+def merge_table(store_directory, table, versioned_schema, delta_files, file_format, base):
+    """Sort-merge delta records by primary key onto the existing dataset and write a new compacted dataset
+
+    Memory stays bounded: deltas are sorted in fixed-size runs spilled to disk, the existing dataset is
+    already stored in key order, and the output is written in row groups while the inputs are streamed.
+    Returns the number of rows in the merged dataset.
+    """
+    if pa is None:
+        raise MergeError("Merging into a Parquet store requires pyarrow. Install it with: pip install pyarrow")
+
+    keys = key_columns(versioned_schema.schema)
+    types = column_types(versioned_schema.schema)
+    arrow_schema = pa.schema([(column, getattr(pa, ARROW_TYPES[column_type])()) for column, column_type in types.items()])
+
+    table_directory = merged_table_directory(store_directory, table)
+    os.makedirs(store_directory, exist_ok=True)
+    work_directory = tempfile.mkdtemp(prefix=f".{table}-merge-", dir=store_directory)
+    try:
+        runs = spill_sorted_runs(delta_files, file_format, keys, types, work_directory)
+        delta_stream = heapq.merge(*(read_run(run) for run in runs), key=lambda entry: entry[:3])
+        base_stream = read_base(table_directory, keys) if base else iter(())
+
+        output_directory = os.path.join(work_directory, "output")
+        row_count = write_parts(output_directory, arrow_schema, merge_streams(base_stream, delta_stream))
+
+        write_merge_state(output_directory, table, versioned_schema.version, keys, row_count)
+        replace_directory(output_directory, table_directory)
+    finally:
+        shutil.rmtree(work_directory, ignore_errors=True)
+
+    print(f"Merged {table}: {row_count} rows in {table_directory}")
+    return row_count
+
+def spill_sorted_runs(delta_files, file_format, keys, types, work_directory):
+    """Read delta records in bounded chunks, sort each chunk by key and write it to a run file
+
+    Each entry is (key, 1, sequence, action, row); later records for the same key get a higher sequence,
+    so the last entry of a key group is the most recent change.
+    """
+    runs = []
+    buffer = []
+    sequence = itertools.count()
+    for file_path in sorted(delta_files):
+        for key, value, action in read_records(file_path, file_format):
+            row = record_row(key, value, types)
+            buffer.append((tuple(row[column] for column in keys), 1, next(sequence), action, row))
+            if len(buffer) >= MERGE_SORT_BUFFER_ROWS:
+                runs.append(write_run(buffer, work_directory, len(runs)))
+                buffer = []
+    if buffer:
+        runs.append(write_run(buffer, work_directory, len(runs)))
+    return runs
+
+def write_run(entries, work_directory, index):
+    entries.sort(key=lambda entry: entry[:3])
+    run_path = os.path.join(work_directory, f"run-{index:05d}.pickle")
+    with open(run_path, "wb") as run_file:
+        for entry in entries:
+            pickle.dump(entry, run_file, protocol=pickle.HIGHEST_PROTOCOL)
+    return run_path
+
+def read_run(run_path):
+    with open(run_path, "rb") as run_file:
+        while True:
+            try:
+                yield pickle.load(run_file)
+            except EOFError:
+                return
+
+def read_base(table_directory, keys):
+    """Stream the rows of the existing merged dataset, which is stored in key order across its part files"""
+    part_files = sorted(name for name in os.listdir(table_directory) if name.endswith(".parquet"))
+    sequence = itertools.count()
+    for name in part_files:
+        for batch in pq.ParquetFile(os.path.join(table_directory, name)).iter_batches(batch_size=MERGE_ROW_GROUP_SIZE):
+            for row in batch.to_pylist():
+                yield tuple(row[column] for column in keys), 0, next(sequence), None, row
+
+def merge_streams(base_stream, delta_stream):
+    """Yield the current version of every row: the latest change per key wins and deletes drop the row"""
+    # Entries compare on (key, source, sequence) only, since the sequence numbers are unique per source
+    combined = heapq.merge(base_stream, delta_stream, key=lambda entry: entry[:3])
+    for _, group in itertools.groupby(combined, key=lambda entry: entry[0]):
+        *_, latest = group
+        _, _, _, action, row = latest
+        if not is_delete(action):
+            yield row
+
+def write_parts(output_directory, arrow_schema, rows):
+    """Write rows into key-ordered Parquet part files of at most MERGE_ROWS_PER_FILE rows"""
+    os.makedirs(output_directory)
+    row_count = 0
+    part_index = 0
+    part_rows = 0
+    writer = None
+    batch = []
+
+    def flush():
+        nonlocal writer, part_index, part_rows
+        if not batch:
+            return
+        if writer is None:
+            writer = pq.ParquetWriter(os.path.join(output_directory, f"part-{part_index:05d}.parquet"), arrow_schema)
+        writer.write_table(pa.Table.from_pylist(batch, schema=arrow_schema))
+        part_rows += len(batch)
+        batch.clear()
+        if part_rows >= MERGE_ROWS_PER_FILE:
+            writer.close()
+            writer = None
+            part_index += 1
+            part_rows = 0
+
+    for row in rows:
+        batch.append(row)
+        row_count += 1
+        if len(batch) >= MERGE_ROW_GROUP_SIZE:
+            flush()
+    flush()
+    if writer is not None:
+        writer.close()
+    return row_count
+
+def write_merge_state(output_directory, table, schema_version, keys, row_count):
+    state = {
+        "table": table,
+        "schema_version": schema_version,
+        "key_columns": keys,
+        "row_count": row_count,
+        "merged_at": datetime.now(timezone.utc).isoformat(),
+    }
+    with open(os.path.join(output_directory, MERGE_STATE_FILE), "w") as state_file:
+        json.dump(state, state_file, indent=4)
+
+def replace_directory(new_directory, table_directory):
+    """Move a freshly written dataset into place, so readers never see a half-written table
+
+    The old dataset is renamed aside before the new one is renamed into its place. The two renames are
+    not one atomic step: a crash between them leaves only `<table>.old`, which recover_directory puts
+    back on the next access, and a reader may briefly find the directory missing.
+    """
+    recover_directory(table_directory)
+    old_directory = None
+    if os.path.exists(table_directory):
+        old_directory = f"{table_directory}.old"
+        os.rename(table_directory, old_directory)
+    os.rename(new_directory, table_directory)
+    if old_directory is not None:
+        shutil.rmtree(old_directory, ignore_errors=True)
+
+def recover_directory(table_directory):
+    """Finish a replace_directory that was interrupted between its renames or while removing the old dataset"""
+    old_directory = f"{table_directory}.old"
+    if not os.path.exists(old_directory):
+        return
+    if os.path.exists(table_directory):
+        shutil.rmtree(old_directory, ignore_errors=True)
+    else:
+        os.rename(old_directory, table_directory)
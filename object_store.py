@@ -0,0 +1,179 @@
+import hashlib
+import os
+import shutil
+import sqlite3
+import time
+from contextlib import contextmanager
+
+# Name of the SQLite index kept inside the store directory
+STORE_INDEX_FILE = "index.db"
+
+# Default size limit of the store; beyond it the least recently used files are evicted
+DEFAULT_STORE_LIMIT = 50 * 1024 ** 3
+
+# Size of the chunks read while hashing a file
+HASH_CHUNK_SIZE = 1024 * 1024
+
+# Linux ioctl that shares the extents of a file on copy-on-write filesystems such as Btrfs and XFS
+FICLONE = 0x40049409
+
+def link_file(source, target):
+    """Hardlink a file, reflink it where hardlinks are not possible, and copy it as a last resort"""
+    try:
+        os.link(source, target)
+        return "hardlink"
+    except OSError:
+        pass
+    try:
+        import fcntl
+        with open(source, "rb") as source_file, open(target, "wb") as target_file:
+            fcntl.ioctl(target_file.fileno(), FICLONE, source_file.fileno())
+        return "reflink"
+    except (ImportError, OSError):
+        shutil.copyfile(source, target)
+        return "copy"
+
+def file_hash(file_path):
+    digest = hashlib.sha256()
+    with open(file_path, "rb") as input_file:
+        while chunk := input_file.read(HASH_CHUNK_SIZE):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+class ObjectStore:
+    """Content-addressed store of downloaded objects, shared by every export on the machine
+
+    Each file is kept once under the SHA-256 of its content and indexed by its DAP object ID and by
+    the ETag object storage sent with it, together with the variant (gzip, decompressed or filtered)
+    that the file holds. Exports that meet an object again, in the same job or in another job with
+    identical content, link their output to the stored file instead of downloading it. Outputs are
+    hardlinks of the stored files where the filesystem allows, so the store takes little extra space;
+    as an output edited in place changes the stored file too, every lookup checks the file against its
+    hash. The least recently used files are evicted once the store grows beyond its size limit.
+    """
+
+    def __init__(self, directory, limit=DEFAULT_STORE_LIMIT):
+        self.directory = directory
+        self.limit = limit
+        os.makedirs(directory, exist_ok=True)
+        with self.connect() as connection:
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS blobs ("
+                " content_hash TEXT PRIMARY KEY,"
+                " size INTEGER NOT NULL,"
+                " last_used REAL NOT NULL)"
+            )
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS objects ("
+                " object_id TEXT NOT NULL,"
+                " variant TEXT NOT NULL,"
+                " etag TEXT,"
+                " content_hash TEXT NOT NULL,"
+                " PRIMARY KEY (object_id, variant))"
+            )
+            connection.execute("CREATE INDEX IF NOT EXISTS objects_by_etag ON objects (etag, variant)")
+        # A lowered limit takes effect right away
+        self.evict()
+
+    @classmethod
+    def from_environment(cls):
+        """The store configured by DAP_OBJECT_STORE (a directory) and DAP_OBJECT_STORE_SIZE (in GB), or None"""
+        directory = os.getenv("DAP_OBJECT_STORE")
+        if not directory:
+            return None
+        size = os.getenv("DAP_OBJECT_STORE_SIZE")
+        return cls(directory, int(float(size) * 1024 ** 3) if size else DEFAULT_STORE_LIMIT)
+
+    @contextmanager
+    def connect(self):
+        """Open a short-lived connection, so that threads and concurrent exports can share the index"""
+        connection = sqlite3.connect(os.path.join(self.directory, STORE_INDEX_FILE), timeout=30)
+        try:
+            with connection:
+                yield connection
+        finally:
+            connection.close()
+
+    def blob_path(self, content_hash):
+        return os.path.join(self.directory, content_hash[:2], content_hash)
+
+    def lookup(self, object_id, variant, etag=None):
+        """Return the stored file for an object ID, or for an ETag of identical content, if it is still intact"""
+        with self.connect() as connection:
+            row = connection.execute(
+                "SELECT blobs.content_hash, blobs.size FROM objects JOIN blobs USING (content_hash)"
+                " WHERE variant = ? AND (object_id = ? OR (etag IS NOT NULL AND etag = ?)) LIMIT 1",
+                (variant, object_id, etag),
+            ).fetchone()
+        if row is None:
+            return None
+        content_hash, size = row
+        blob_path = self.blob_path(content_hash)
+        # Hashed without holding the index, which other exports keep using meanwhile
+        intact = os.path.exists(blob_path) and os.path.getsize(blob_path) == size and file_hash(blob_path) == content_hash
+
+        with self.connect() as connection:
+            if not intact:
+                # Removed, or altered through an output linked to it
+                self.forget(connection, content_hash)
+                return None
+            connection.execute("UPDATE blobs SET last_used = ? WHERE content_hash = ?", (time.time(), content_hash))
+            connection.execute(
+                "INSERT OR IGNORE INTO objects (object_id, variant, etag, content_hash) VALUES (?, ?, ?, ?)",
+                (object_id, variant, etag, content_hash),
+            )
+        return blob_path
+
+    def add(self, file_path, object_id, variant, etag=None):
+        """Store a finished output file under its content hash and index it; returns how it was linked"""
+        content_hash = file_hash(file_path)
+        blob_path = self.blob_path(content_hash)
+        method = "existing"
+        if not os.path.exists(blob_path) or file_hash(blob_path) != content_hash:
+            os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+            temp_path = f"{blob_path}.{os.getpid()}.tmp"
+            method = link_file(file_path, temp_path)
+            os.replace(temp_path, blob_path)
+
+        with self.connect() as connection:
+            connection.execute(
+                "INSERT INTO blobs (content_hash, size, last_used) VALUES (?, ?, ?)"
+                " ON CONFLICT (content_hash) DO UPDATE SET last_used = excluded.last_used",
+                (content_hash, os.path.getsize(blob_path), time.time()),
+            )
+            connection.execute(
+                "INSERT OR REPLACE INTO objects (object_id, variant, etag, content_hash) VALUES (?, ?, ?, ?)",
+                (object_id, variant, etag, content_hash),
+            )
+        self.evict()
+        return method
+
+    def materialize(self, blob_path, final_path):
+        """Create an output file from a stored file, atomically replacing whatever is at its path"""
+        temp_path = f"{final_path}.tmp"
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        method = link_file(blob_path, temp_path)
+        os.replace(temp_path, final_path)
+        return method
+
+    def evict(self):
+        """Remove the least recently used files until the store is within its size limit"""
+        with self.connect() as connection:
+            total = connection.execute("SELECT COALESCE(SUM(size), 0) FROM blobs").fetchone()[0]
+            if total <= self.limit:
+                return
+            for content_hash, size in connection.execute("SELECT content_hash, size FROM blobs ORDER BY last_used").fetchall():
+                if total <= self.limit:
+                    break
+                self.forget(connection, content_hash)
+                total -= size
+
+    def forget(self, connection, content_hash):
+        # Outputs hardlinked to the file keep their own link to the data
+        try:
+            os.remove(self.blob_path(content_hash))
+        except FileNotFoundError:
+            pass
+        connection.execute("DELETE FROM objects WHERE content_hash = ?", (content_hash,))
+        connection.execute("DELETE FROM blobs WHERE content_hash = ?", (content_hash,))
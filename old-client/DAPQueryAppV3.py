@@ -5,7 +5,6 @@ import os
 from datetime import datetime, timezone
 from tkinter import Tk, Label, Entry, Button, filedialog, messagebox, Radiobutton, StringVar
 from tkinter.ttk import Combobox
-from tkcalendar import Calendar
 
 from dap.api import DAPClient
 from dap.dap_types import Format, IncrementalQuery, SnapshotQuery, Credentials
@@ -107,6 +106,8 @@ class DAPQueryApp:
 
     def select_since_timestamp(self):
         """Open a calendar window to select the since timestamp for incremental queries"""
+        from tkcalendar import Calendar  # Only needed once the date picker is opened
+
         calendar_window = Tk()
         calendar_window.title("Select Date")
         calendar = Calendar(calendar_window, date_pattern="yyyy-mm-dd")
@@ -192,7 +193,8 @@ class DAPQueryApp:
         except Exception as e:
             messagebox.showerror("Error", f"An error occurred during the query process:\n{str(e)}")
 
-# Create the main window and start the application
-root = Tk()
-app = DAPQueryApp(root)
-root.mainloop()
+if __name__ == "__main__":
+    # Create the main window and start the application
+    root = Tk()
+    app = DAPQueryApp(root)
+    root.mainloop()
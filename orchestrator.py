@@ -0,0 +1,303 @@
+import asyncio
+import inspect
+import itertools
+import json
+import os
+import random
+import time
+
+import aiohttp
+
+import dap_core
+from catalog_cache import api_url
+from export_metrics import MetricsRecorder
+from job_scheduler import DEFAULT_MAX_JOBS, JobScheduler
+
+# Default number of API requests per second sent with one credential
+DEFAULT_REQUEST_RATE = 5.0
+
+# Lowest request rate that throttling backs a credential off to
+MIN_REQUEST_RATE = 0.2
+
+# Factor applied to the request rate of a credential after a throttled request
+THROTTLE_DECREASE = 0.5
+
+# Fraction of the configured request rate regained after every successful request
+RATE_INCREASE = 0.05
+
+# Pause of all requests of a credential after a throttled request, doubled for each further attempt
+THROTTLE_BACKOFF_INITIAL = 2.0
+
+# Longest pause after a throttled request
+THROTTLE_BACKOFF_MAX = 60.0
+
+# Attempts of an API call that keeps being throttled, on top of the DAP client's own retries
+THROTTLE_ATTEMPTS = 5
+
+# Statuses of API responses that mean the credential is throttled or the API is overloaded
+THROTTLE_STATUSES = frozenset((429, 502, 503, 504))
+
+# Timeouts of the HTTP session of a credential, the same as the DAP client's own sessions
+SESSION_TIMEOUT = 30 * 60
+SESSION_CONNECT_TIMEOUT = 30
+
+# Session calls that go to the API and wait for the rate limiter; objects are downloaded from presigned
+# URLs, which are not limited
+RATE_LIMITED_CALLS = frozenset((
+    "get_tables", "get_table_schema", "query_snapshot", "query_incremental",
+    "get_job", "get_job_status", "get_objects", "get_resources",
+))
+
+class TokenBucket:
+    """Limits the request rate of one credential and backs off when the API throttles it
+
+    The rate halves on every throttled request, which also pauses all requests of the credential,
+    and creeps back towards the configured rate with every successful one (additive increase,
+    multiplicative decrease), so a run settles just below the rate the API accepts.
+    """
+
+    def __init__(self, rate, burst=None):
+        self.max_rate = max(MIN_REQUEST_RATE, rate)
+        self.rate = self.max_rate
+        self.capacity = burst or max(1.0, self.max_rate)
+        self.available = self.capacity
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.lock = asyncio.Lock()
+
+    async def acquire(self):
+        """Wait until the next request may be sent; waiting requests are served in order"""
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                if now < self.paused_until:
+                    await asyncio.sleep(self.paused_until - now)
+                    continue
+                self.available = min(self.capacity, self.available + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.available >= 1:
+                    self.available -= 1
+                    return
+                await asyncio.sleep((1 - self.available) / self.rate)
+
+    def succeeded(self):
+        self.rate = min(self.max_rate, self.rate + self.max_rate * RATE_INCREASE)
+
+    def throttled(self, attempt):
+        """Slow down after a throttled request and return the pause before the next request"""
+        self.rate = max(MIN_REQUEST_RATE, self.rate * THROTTLE_DECREASE)
+        delay = min(THROTTLE_BACKOFF_MAX, THROTTLE_BACKOFF_INITIAL * 2 ** (attempt - 1)) * random.uniform(0.5, 1.0)
+        self.paused_until = max(self.paused_until, time.monotonic() + delay)
+        # No burst of saved up requests once the pause is over
+        self.available = 0.0
+        self.updated = self.paused_until
+        return delay
+
+def is_throttling_error(error):
+    """Whether an API error means the server is throttling or overloaded, rather than rejecting the request"""
+    from dap.dap_error import GatewayTimeoutError, ServerError
+
+    if isinstance(error, (ServerError, GatewayTimeoutError)):
+        return True
+    if getattr(error, "status", None) in (429, 502, 503, 504):
+        return True
+    text = str(error).lower()
+    return "too many requests" in text or "rate limit" in text
+
+class CredentialSession:
+    """A DAP session shared by every export that uses the same credential
+
+    The DAP client renews its access token from whichever request notices that the token expires
+    within five minutes. Every call of the session first checks the token under one lock, so a single
+    caller logs in while the others wait for the new token instead of each logging in on their own.
+    API calls go through the credential's TokenBucket. Other attributes are passed through to the DAP
+    session, so the object can be used wherever dap_core expects one.
+
+    The DAP client retries throttled requests by itself, honoring Retry-After, so its calls rarely
+    fail with a throttling error. The session is therefore opened on an HTTP session with a trace
+    hook that sees every response, including the retried ones: each 429 or 5xx gateway response
+    slows the TokenBucket down and is recorded as a `throttled` line in the metrics.
+    """
+
+    def __init__(self, base_url, client_id, client_secret, name, request_rate=DEFAULT_REQUEST_RATE, metrics=None):
+        self.base_url = api_url(base_url)
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self.name = name
+        self.limiter = TokenBucket(request_rate)
+        self.metrics = metrics or MetricsRecorder()
+        self.session = None
+        self.token_lock = asyncio.Lock()
+        # Throttled responses since the last successful one, which lengthen the pause of the limiter
+        self.throttle_streak = 0
+
+    async def __aenter__(self):
+        from dap.api import DAPSession
+        from dap.commands.global_options import read_dap_tracking_env_var
+        from dap.dap_types import Credentials
+        from dap.tracking import TrackingData
+
+        credentials = Credentials.create(client_id=self.client_id, client_secret=self.client_secret)
+        http_session = aiohttp.ClientSession(
+            timeout=aiohttp.ClientTimeout(total=SESSION_TIMEOUT, connect=SESSION_CONNECT_TIMEOUT),
+            trace_configs=[self.trace_config()])
+        tracking_data = TrackingData(client_id=credentials.client_id) if read_dap_tracking_env_var() else None
+        self.session = DAPSession(http_session, self.base_url, credentials, tracking_data)
+        try:
+            await self.limiter.acquire()
+            with self.metrics.phase(None, "authenticate", credential=self.name):
+                await self.authenticate()
+        except BaseException:
+            await self.session.close()
+            raise
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        from dap.tracking import send_tracking_data
+
+        try:
+            if self.session.tracking_data is not None:
+                await send_tracking_data(self.session.tracking_data)
+        finally:
+            await self.session.close()
+
+    def trace_config(self):
+        trace_config = aiohttp.TraceConfig()
+        trace_config.on_request_end.append(self.on_request_end)
+        return trace_config
+
+    async def on_request_end(self, http_session, context, params):
+        """Slow the credential down on a throttled response and speed it up again on a successful one"""
+        status = params.response.status
+        if status in THROTTLE_STATUSES:
+            self.throttle_streak += 1
+            delay = self.limiter.throttled(self.throttle_streak)
+            self.metrics.record(None, "throttled", delay, credential=self.name, method=params.method, path=params.url.path,
+                                status=status, rate=round(self.limiter.rate, 3))
+            dap_core.log_timing(self.name, f"{params.method} {params.url.path} throttled with HTTP {status}, "
+                                           f"pausing {delay:.1f}s at {self.limiter.rate:.2f} requests/s")
+        elif status < 400:
+            self.throttle_streak = 0
+            self.limiter.succeeded()
+
+    def __getattr__(self, name):
+        attribute = getattr(self.session, name)
+        if not inspect.iscoroutinefunction(attribute):
+            return attribute
+
+        if name in RATE_LIMITED_CALLS:
+            async def limited_call(*args, **kwargs):
+                return await self.call(attribute, *args, **kwargs)
+            return limited_call
+
+        async def authenticated_call(*args, **kwargs):
+            await self.authenticate()
+            return await attribute(*args, **kwargs)
+        return authenticated_call
+
+    async def authenticate(self):
+        """Log in if the token is missing or about to expire, with one login at a time for the credential"""
+        async with self.token_lock:
+            await self.session.authenticate()
+
+    async def call(self, function, *args, **kwargs):
+        """Call a session method once the rate limiter allows it, retrying calls that stay throttled
+
+        The throttled responses have already paused the limiter, so the retry waits for that pause.
+        """
+        for attempt in itertools.count(1):
+            await self.limiter.acquire()
+            # Right before the call, so the call itself finds a fresh token and does not log in again
+            await self.authenticate()
+            try:
+                return await function(*args, **kwargs)
+            except Exception as e:
+                if attempt >= THROTTLE_ATTEMPTS or not is_throttling_error(e):
+                    raise
+                dap_core.log_timing(self.name, f"{function.__name__} failed after the DAP client's retries ({e}), retrying")
+
+class ExportTarget:
+    """Tables of one namespace exported with one credential, into `<output>/<name>/<namespace>`"""
+
+    def __init__(self, client_id, client_secret, namespace, tables=None, name=None):
+        self.client_id = client_id
+        self.client_secret = client_secret
+        self.namespace = namespace
+        self.tables = tables
+        # Client IDs look like `us-east-1#<uuid>`; the part after the region is safe as a directory name
+        self.name = name or client_id.split("#")[-1]
+
+    def output_directory(self, output_directory):
+        return os.path.join(output_directory, self.name, self.namespace)
+
+def load_targets(path):
+    """Read export targets from a JSON file
+
+    The file holds a list of objects with `client_id`, `client_secret` or `client_secret_env` (the
+    name of an environment variable holding the secret), `namespace`, `tables` ("all", a comma
+    separated string or a list) and optionally `name`, the output subdirectory of the credential.
+    """
+    with open(path) as targets_file:
+        entries = json.load(targets_file)
+
+    targets = []
+    for entry in entries:
+        client_secret = entry.get("client_secret") or os.getenv(entry.get("client_secret_env", ""))
+        if not entry.get("client_id") or not client_secret:
+            raise ValueError(f"Target {entry.get('name') or entry.get('client_id')} needs a client_id and a client_secret or client_secret_env.")
+        tables = entry.get("tables", "all")
+        if isinstance(tables, str):
+            tables = dap_core.parse_table_selection(tables)
+        targets.append(ExportTarget(entry["client_id"], client_secret, entry.get("namespace", "canvas"), tables, entry.get("name")))
+    return targets
+
+async def export_targets(base_url, targets, query_type, since_timestamp, file_format, output_directory, *, concurrency=dap_core.DEFAULT_BATCH_CONCURRENCY, progress=None, max_jobs=DEFAULT_MAX_JOBS, request_rate=DEFAULT_REQUEST_RATE, **options):
+    """Export the tables of many (credential, namespace) targets at the same time
+
+    Targets with the same credential share one CredentialSession and JobScheduler, so every credential
+    logs in once, keeps to its own request rate and has at most max_jobs query jobs in flight, while
+    `concurrency` limits the tables downloading at the same time across the whole run. The other
+    keyword options are those of dap_core.export_table. Returns a dict mapping `name/namespace/table`
+    to None on success or the exception that stopped it.
+    """
+    if options.get("database_url") and len({target.namespace for target in targets}) < len({(target.name, target.namespace) for target in targets}):
+        raise ValueError("Several credentials export the same namespace; load them into separate databases.")
+
+    progress = progress or dap_core.ExportProgress(None, "orchestrator", metrics=dap_core.default_metrics(output_directory))
+    download_slots = asyncio.Semaphore(max(1, concurrency))
+    credentials = {}
+    for target in targets:
+        credentials.setdefault((target.client_id, target.client_secret), []).append(target)
+
+    async def export_one(session, scheduler, target, table):
+        try:
+            await dap_core.export_table(session, target.namespace, table, query_type, since_timestamp, file_format, target.output_directory(output_directory),
+                                        base_url=base_url, progress=progress, scheduler=scheduler, **options)
+            return f"{target.name}/{target.namespace}/{table}", None
+        except Exception as e:
+            print(f"Export of {table} for {target.name}/{target.namespace} failed: {e}")
+            return f"{target.name}/{target.namespace}/{table}", e
+
+    async def export_target(session, scheduler, target):
+        try:
+            tables = target.tables or await dap_core.catalog.for_api(base_url).get_tables(session, target.namespace)
+        except Exception as e:
+            print(f"Listing the tables of {target.name}/{target.namespace} failed: {e}")
+            return [(f"{target.name}/{target.namespace}/*", e)]
+        return await asyncio.gather(*(export_one(session, scheduler, target, table) for table in tables))
+
+    async def export_credential(client_id, client_secret, credential_targets):
+        name = credential_targets[0].name
+        try:
+            async with CredentialSession(base_url, client_id, client_secret, name, request_rate, progress.metrics) as session:
+                scheduler = JobScheduler(session, max_jobs, download_slots=download_slots)
+                results = await asyncio.gather(*(export_target(session, scheduler, target) for target in credential_targets))
+        except Exception as e:
+            print(f"Authentication of {name} failed: {e}")
+            return [(f"{target.name}/{target.namespace}/*", e) for target in credential_targets]
+        return [result for target_results in results for result in target_results]
+
+    results = await asyncio.gather(*(export_credential(client_id, client_secret, credential_targets)
+                                     for (client_id, client_secret), credential_targets in credentials.items()))
+    progress.metrics.write_prometheus()
+    return dict(result for credential_results in results for result in credential_results)
@@ -0,0 +1,189 @@
+import json
+import multiprocessing
+import os
+import shutil
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
+from datetime import datetime, timezone
+from urllib.parse import quote
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:
+    pa = None
+    pq = None
+
+from merge_engine import ARROW_TYPES, replace_directory
+from table_schema import column_types, is_delete, key_columns, read_records, record_row
+
+# Number of rows buffered for one partition before they are written as one Parquet row group
+CONVERT_ROW_GROUP_SIZE = 50_000
+
+# Number of rows buffered across all partitions of one input file before every buffer is flushed
+CONVERT_BUFFER_ROWS = 200_000
+
+# Name of the file describing a converted dataset
+DATASET_STATE_FILE = "_dataset.json"
+
+# Column added to datasets converted from incremental files, holding the `meta.action` of each record
+ACTION_COLUMN = "_dap_action"
+
+# Directory name used by Hive-style readers for rows whose partition value is NULL
+NULL_PARTITION = "__HIVE_DEFAULT_PARTITION__"
+
+# Transformations that can be applied to the partition column, e.g. "updated_at:date"
+PARTITION_TRANSFORMS = {
+    "date": lambda value: str(value)[:10],
+    "month": lambda value: str(value)[:7],
+    "year": lambda value: str(value)[:4],
+}
+
+# Workers are started fresh rather than forked, since a fork of the exporter would copy its event
+# loop and the locks held by its other threads into every worker
+WORKER_START_METHOD = "spawn"
+
+class ConversionError(RuntimeError):
+    pass
+
+def create_pool(workers=None):
+    """Create a process pool of conversion workers, one per CPU unless workers is given"""
+    return ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context(WORKER_START_METHOD))
+
+def parse_partition_spec(partition_by, types):
+    """Split a partition spec such as `account_id` or `updated_at:date` into (column, transform, directory name)
+
+    A plain column is written Hive style as `column=value` directories and dropped from the data files;
+    a transformed column stays in the data files and is partitioned as `column_date=YYYY-MM-DD`.
+    """
+    if not partition_by:
+        return None
+    column, _, transform = partition_by.partition(":")
+    if column not in types:
+        raise ConversionError(f"Partition column {column} is not a column of the table")
+    if transform and transform not in PARTITION_TRANSFORMS:
+        raise ConversionError(f"Unknown partition transform {transform}; use one of {', '.join(PARTITION_TRANSFORMS)}")
+    return column, transform or None, f"{column}_{transform}" if transform else column
+
+def projected_columns(types, keys, columns):
+    """Return the columns to keep in the dataset; key columns are always kept"""
+    if not columns:
+        return list(types)
+    unknown = [column for column in columns if column not in types]
+    if unknown:
+        raise ConversionError(f"Unknown columns: {', '.join(unknown)}")
+    return [column for column in types if column in keys or column in columns]
+
+def convert_to_parquet(dataset_directory, table, versioned_schema, input_files, file_format, partition_by=None, columns=None, incremental=False, workers=None, executor=None):
+    """Convert downloaded JSONL or CSV files into a partitioned Parquet dataset using a process pool
+
+    Every input file is converted by a worker process into one Parquet file per partition, with the
+    column types taken from the table schema. The files are converted on the given executor, which
+    batch exports share between tables, or else on a pool of `workers` processes created for the
+    call. The finished dataset only replaces `dataset_directory` once it is complete, see
+    replace_directory. Returns the number of rows converted.
+    """
+    if pa is None:
+        raise ConversionError("Converting to Parquet requires pyarrow. Install it with: pip install pyarrow")
+    if file_format not in ("jsonl", "csv"):
+        raise ConversionError(f"Converting to Parquet is only supported for jsonl and csv files, not {file_format}")
+
+    types = column_types(versioned_schema.schema)
+    keys = key_columns(versioned_schema.schema)
+    partition = parse_partition_spec(partition_by, types)
+    output_columns = projected_columns(types, keys, columns)
+
+    parent_directory = os.path.dirname(os.path.abspath(dataset_directory))
+    os.makedirs(parent_directory, exist_ok=True)
+    work_directory = tempfile.mkdtemp(prefix=f".{table}-convert-", dir=parent_directory)
+    try:
+        output_directory = os.path.join(work_directory, "output")
+        os.makedirs(output_directory)
+        with nullcontext(executor) if executor is not None else create_pool(workers) as pool:
+            futures = [pool.submit(convert_file, input_file, file_format, types, output_columns, partition, incremental, output_directory)
+                       for input_file in input_files]
+            row_count = sum(future.result() for future in futures)
+
+        write_dataset_state(output_directory, table, versioned_schema.version, partition_by, output_columns, incremental, row_count)
+        replace_directory(output_directory, dataset_directory)
+    finally:
+        shutil.rmtree(work_directory, ignore_errors=True)
+
+    print(f"Converted {len(input_files)} files of {table} into {row_count} Parquet rows in {dataset_directory}")
+    return row_count
+
+def arrow_schema_for(types, output_columns, partition, incremental):
+    fields = [(column, getattr(pa, ARROW_TYPES[types[column]])()) for column in output_columns
+              if partition is None or partition[1] is not None or column != partition[0]]
+    if incremental:
+        fields.append((ACTION_COLUMN, pa.string()))
+    return pa.schema(fields)
+
+def partition_directory(partition, row):
+    column, transform, directory_name = partition
+    value = row[column]
+    if value is None:
+        return f"{directory_name}={NULL_PARTITION}"
+    if transform is not None:
+        value = PARTITION_TRANSFORMS[transform](value)
+    return f"{directory_name}={quote(str(value), safe='')}"
+
+def convert_file(input_file, file_format, types, output_columns, partition, incremental, output_directory):
+    """Convert one input file; runs in a worker process and returns the number of rows written"""
+    arrow_schema = arrow_schema_for(types, output_columns, partition, incremental)
+    file_name = os.path.basename(input_file).rsplit(".", 1)[0] + ".parquet"
+    writers = {}
+    buffers = {}
+    buffered_rows = 0
+    row_count = 0
+
+    def flush(directory_name):
+        rows = buffers.pop(directory_name, None)
+        if not rows:
+            return
+        if directory_name not in writers:
+            directory = os.path.join(output_directory, directory_name)
+            os.makedirs(directory, exist_ok=True)
+            writers[directory_name] = pq.ParquetWriter(os.path.join(directory, file_name), arrow_schema)
+        writers[directory_name].write_table(pa.Table.from_pylist(rows, schema=arrow_schema))
+
+    try:
+        for key, value, action in read_records(input_file, file_format):
+            row = record_row(key, value, types)
+            directory_name = partition_directory(partition, row) if partition is not None else ""
+            output_row = {column: row[column] for column in arrow_schema.names if column != ACTION_COLUMN}
+            if incremental:
+                output_row[ACTION_COLUMN] = "D" if is_delete(action) else action
+            buffers.setdefault(directory_name, []).append(output_row)
+            buffered_rows += 1
+            row_count += 1
+
+            if len(buffers[directory_name]) >= CONVERT_ROW_GROUP_SIZE:
+                buffered_rows -= len(buffers[directory_name])
+                flush(directory_name)
+            elif buffered_rows >= CONVERT_BUFFER_ROWS:
+                # Many partitions with a few rows each; write them all out to keep memory bounded
+                for name in list(buffers):
+                    flush(name)
+                buffered_rows = 0
+
+        for name in list(buffers):
+            flush(name)
+    finally:
+        for writer in writers.values():
+            writer.close()
+    return row_count
+
+def write_dataset_state(output_directory, table, schema_version, partition_by, output_columns, incremental, row_count):
+    state = {
+        "table": table,
+        "schema_version": schema_version,
+        "partition_by": partition_by,
+        "columns": output_columns,
+        "incremental": incremental,
+        "row_count": row_count,
+        "converted_at": datetime.now(timezone.utc).isoformat(),
+    }
+    with open(os.path.join(output_directory, DATASET_STATE_FILE), "w") as state_file:
+        json.dump(state, state_file, indent=4)
@@ -0,0 +1,140 @@
+import hashlib
+import json
+import re
+from datetime import datetime, timezone
+
+from table_schema import coerce_value, column_types, is_delete, key_columns
+
+# Outcomes of RecordFilter.decide: write the record as it is, or write it as a delete of its key
+KEEP = "keep"
+DELETE = "delete"
+
+# A predicate with one of the operators =, !=, <, <=, >, >= or in (which takes a comma separated list), such as `account_id = 12`, `value.workflow_state in active,invited` or `updated_at >= 2024-01-01T00:00:00Z`
+PREDICATE_PATTERN = re.compile(r"^\s*([A-Za-z_][\w.]*)\s*(\bin\b|!=|>=|<=|=|>|<)\s*(.*?)\s*$", re.IGNORECASE)
+
+class RowFilter:
+    """Options of the streaming row filter and column projection applied while objects are decompressed
+
+    `predicates` are strings such as `account_id in 1,2,3`, all of which a record must satisfy, and
+    `columns` the value columns to keep (key columns are always kept); None keeps every column.
+    """
+
+    def __init__(self, predicates=(), columns=None):
+        self.predicates = [parse_predicate(predicate) for predicate in predicates]
+        self.columns = columns
+
+    def bind(self, schema, delete_mismatches=False):
+        """Check the predicates and columns against a table schema and return the filter for its records
+
+        Incremental results that update a merged dataset or a database table pass delete_mismatches,
+        see RecordFilter.decide.
+        """
+        return RecordFilter(schema, self.predicates, self.columns, delete_mismatches)
+
+def parse_predicate(text):
+    """Split a predicate into its column, operator and operand, which is a list for `in`"""
+    match = PREDICATE_PATTERN.match(text)
+    if match is None or not match.group(3):
+        raise ValueError(f"Cannot parse the row filter {text!r}; use e.g. `account_id = 12`, `id in 1,2,3` or `updated_at >= 2024-01-01T00:00:00Z`.")
+    column, operator, operand = match.groups()
+    column = column.removeprefix("key.").removeprefix("value.")
+    operator = operator.lower()
+    if operator == "in":
+        return column, operator, [item.strip() for item in operand.split(",") if item.strip()]
+    return column, operator, operand.strip("'\"")
+
+def parse_timestamp(text):
+    """Parse an ISO timestamp as written by DAP, treating timestamps without offset as UTC"""
+    timestamp = datetime.fromisoformat(text.replace("Z", "+00:00"))
+    return timestamp if timestamp.tzinfo else timestamp.replace(tzinfo=timezone.utc)
+
+def is_timestamp(text):
+    try:
+        parse_timestamp(text)
+        return True
+    except ValueError:
+        return False
+
+class RecordFilter:
+    """Decides which records of a table to keep and which value columns to write
+
+    Values are compared after coercion to the column type, and range operators on string columns
+    compare them as timestamps when the operand is one. Delete records of incremental queries carry
+    no value, so they are only tested against the predicates on key columns and are otherwise kept,
+    which keeps merges and database loads from missing the removal of a matching row. For the same
+    reason, with delete_mismatches an update that no longer satisfies the predicates on value columns
+    becomes a delete of its key, since the row may have matched before the update.
+    """
+
+    def __init__(self, schema, predicates, columns, delete_mismatches=False):
+        all_types = column_types(schema)
+        self.keys = key_columns(schema)
+        unknown = [column for column in [predicate[0] for predicate in predicates] + list(columns or []) if column not in all_types]
+        if unknown:
+            raise ValueError(f"Unknown columns in the row filter: {', '.join(unknown)}")
+
+        self.value_columns = None if columns is None else set(columns) - set(self.keys)
+        self.delete_mismatches = delete_mismatches
+        # Identifies the filtered output of an object, e.g. in the object store
+        self.fingerprint = hashlib.sha256(json.dumps([predicates, sorted(self.value_columns or []), delete_mismatches]).encode()).hexdigest()[:16]
+        self.types = {column: column_type for column, column_type in all_types.items() if self.keeps_column(column)}
+        self.conditions = [(column, column in self.keys, self.condition(operator, operand, all_types[column]))
+                           for column, operator, operand in predicates]
+
+    def keeps_column(self, column):
+        return self.value_columns is None or column in self.keys or column in self.value_columns
+
+    def keeps_field(self, field):
+        """Whether a CSV header field such as `value.name` or `meta.action` is written"""
+        part, _, column = field.partition(".")
+        return part != "value" or self.keeps_column(column)
+
+    @staticmethod
+    def condition(operator, operand, column_type):
+        """Return a test of the raw JSON or CSV value of a column"""
+        if operator == "in":
+            accepted = {coerce_value(item, column_type) for item in operand}
+            return lambda raw: coerce_value(raw, column_type) in accepted
+
+        if column_type == "string" and operator not in ("=", "!=") and is_timestamp(operand):
+            convert, operand = parse_timestamp, parse_timestamp(operand)
+        else:
+            convert, operand = (lambda raw: coerce_value(raw, column_type)), coerce_value(operand, column_type)
+        compare = {
+            "=": lambda value: value == operand,
+            "!=": lambda value: value != operand,
+            ">": lambda value: value > operand,
+            ">=": lambda value: value >= operand,
+            "<": lambda value: value < operand,
+            "<=": lambda value: value <= operand,
+        }[operator]
+        return lambda raw: compare(convert(raw))
+
+    def decide(self, key, value, action):
+        """Return KEEP to write a record as it is, DELETE to write it as a delete of its key, or None to drop it"""
+        if self.matches(key, value, action):
+            return KEEP
+        if self.delete_mismatches and not is_delete(action) and self.matches(key, value, action, keys_only=True):
+            return DELETE
+        return None
+
+    def matches(self, key, value, action, keys_only=False):
+        keys_only = keys_only or is_delete(action)
+        for column, is_key, test in self.conditions:
+            if keys_only and not is_key:
+                continue
+            raw = (key if is_key else value).get(column)
+            if raw is None:
+                return False
+            try:
+                if not test(raw):
+                    return False
+            except (TypeError, ValueError):
+                # Values that cannot be compared, such as malformed timestamps, do not match
+                return False
+        return True
+
+    def project(self, value):
+        if self.value_columns is None:
+            return value
+        return {column: column_value for column, column_value in value.items() if column in self.value_columns}
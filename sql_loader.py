@@ -0,0 +1,344 @@
+import asyncio
+import codecs
+import csv
+import sqlite3
+import time
+
+from download_engine import open_session, run_tasks, stream_object
+from row_filter import DELETE, KEEP
+from table_schema import (GzipStream, coerce_value, column_types, is_delete, key_columns, parse_csv_record,
+                          parse_jsonl_record, record_row)
+
+# Number of rows sent to the database in one bulk insert or delete
+SQL_BATCH_ROWS = 10_000
+
+# Number of objects of one job streamed into the database at the same time
+SQL_LOAD_CONCURRENCY = 4
+
+SQLITE_TYPES = {
+    "integer": "INTEGER",
+    "number": "REAL",
+    "boolean": "INTEGER",
+    "string": "TEXT",
+    "json": "TEXT",
+    "null": "TEXT",
+}
+
+POSTGRES_TYPES = {
+    "integer": "BIGINT",
+    "number": "DOUBLE PRECISION",
+    "boolean": "BOOLEAN",
+    "string": "TEXT",
+    "json": "JSONB",
+    "null": "TEXT",
+}
+
+def quote_identifier(name):
+    return '"' + name.replace('"', '""') + '"'
+
+def create_table_sql(table, types, keys, sql_types):
+    """Build a CREATE TABLE statement for a DAP table from its column types and primary key"""
+    columns = [f"{quote_identifier(column)} {sql_types[column_type]}" for column, column_type in types.items()]
+    primary_key = ", ".join(quote_identifier(column) for column in keys)
+    return f"CREATE TABLE IF NOT EXISTS {quote_identifier(table)} ({', '.join(columns)}, PRIMARY KEY ({primary_key}))"
+
+class TableSchemaError(RuntimeError):
+    pass
+
+def missing_columns(table, existing_types, existing_keys, types, keys, sql_types):
+    """Return the columns of the schema that an existing table lacks, so they can be added to it
+
+    Raises TableSchemaError when a column changed type or the primary key changed, since such a
+    table has to be dropped or migrated by hand before rows of the new schema can be loaded into it.
+    """
+    if list(existing_keys) != list(keys):
+        raise TableSchemaError(f"Table {table} has primary key ({', '.join(existing_keys)}) but the schema has "
+                               f"({', '.join(keys)}); drop or migrate the table before loading it")
+    changed = [f"{column} is {existing_types[column]} instead of {sql_types[column_type]}"
+               for column, column_type in types.items()
+               if column in existing_types and existing_types[column].lower() != sql_types[column_type].lower()]
+    if changed:
+        raise TableSchemaError(f"Columns of table {table} changed type: {'; '.join(changed)}; "
+                               f"drop or migrate the table before loading it")
+    return [column for column in types if column not in existing_types]
+
+def add_columns_sql(table, columns, types, sql_types):
+    return [f"ALTER TABLE {quote_identifier(table)} ADD COLUMN {quote_identifier(column)} {sql_types[types[column]]}"
+            for column in columns]
+
+class SQLiteTarget:
+    """Writes rows into a SQLite database with batched executemany statements
+
+    Writes after create_table form one transaction, which only takes effect on commit.
+    """
+
+    def __init__(self, path):
+        # Batches are written from worker threads, one at a time under the loader's lock
+        self.connection = sqlite3.connect(path, timeout=600, check_same_thread=False)
+
+    def create_table(self, table, types, keys):
+        """Create the table, or add the columns that a newer schema or column selection needs"""
+        with self.connection:
+            self.connection.execute(create_table_sql(table, types, keys, SQLITE_TYPES))
+            info = self.connection.execute(f"PRAGMA table_info({quote_identifier(table)})").fetchall()
+            existing_types = {name: declared_type for _, name, declared_type, _, _, _ in info}
+            # The pk field is the position of the column in the primary key, or 0
+            existing_keys = [column[1] for column in sorted(info, key=lambda column: column[5]) if column[5]]
+            for statement in add_columns_sql(table, missing_columns(table, existing_types, existing_keys, types, keys, SQLITE_TYPES), types, SQLITE_TYPES):
+                self.connection.execute(statement)
+
+    def clear_table(self, table):
+        self.connection.execute(f"DELETE FROM {quote_identifier(table)}")
+
+    def upsert_rows(self, table, columns, keys, rows):
+        column_list = ", ".join(quote_identifier(column) for column in columns)
+        placeholders = ", ".join("?" for _ in columns)
+        self.connection.executemany(
+            f"INSERT OR REPLACE INTO {quote_identifier(table)} ({column_list}) VALUES ({placeholders})", rows)
+
+    def delete_rows(self, table, keys, key_rows):
+        condition = " AND ".join(f"{quote_identifier(column)} = ?" for column in keys)
+        self.connection.executemany(f"DELETE FROM {quote_identifier(table)} WHERE {condition}", key_rows)
+
+    def commit(self):
+        self.connection.commit()
+
+    def rollback(self):
+        self.connection.rollback()
+
+    def close(self):
+        self.connection.close()
+
+class PostgresTarget:
+    """Writes rows into PostgreSQL through the COPY protocol, staging upserts in a temporary table
+
+    Writes after create_table form one transaction, which only takes effect on commit.
+    """
+
+    def __init__(self, url):
+        try:
+            import psycopg
+        except ImportError:
+            raise RuntimeError("Loading into PostgreSQL requires psycopg. Install it with: pip install psycopg")
+        self.connection = psycopg.connect(url)
+
+    def create_table(self, table, types, keys):
+        """Create the table, or add the columns that a newer schema or column selection needs"""
+        with self.connection.cursor() as cursor:
+            cursor.execute(create_table_sql(table, types, keys, POSTGRES_TYPES))
+            cursor.execute("SELECT column_name, data_type FROM information_schema.columns"
+                           " WHERE table_schema = current_schema() AND table_name = %s", (table,))
+            existing_types = dict(cursor.fetchall())
+            cursor.execute("SELECT usage.column_name FROM information_schema.table_constraints AS constraints"
+                           " JOIN information_schema.key_column_usage AS usage"
+                           " ON usage.constraint_schema = constraints.constraint_schema"
+                           " AND usage.constraint_name = constraints.constraint_name"
+                           " WHERE constraints.constraint_type = 'PRIMARY KEY'"
+                           " AND constraints.table_schema = current_schema() AND constraints.table_name = %s"
+                           " ORDER BY usage.ordinal_position", (table,))
+            existing_keys = [row[0] for row in cursor.fetchall()]
+            for statement in add_columns_sql(table, missing_columns(table, existing_types, existing_keys, types, keys, POSTGRES_TYPES), types, POSTGRES_TYPES):
+                cursor.execute(statement)
+        self.connection.commit()
+
+    def clear_table(self, table):
+        # Unlike TRUNCATE, DELETE lets other sessions keep reading the old rows until the load commits
+        with self.connection.cursor() as cursor:
+            cursor.execute(f"DELETE FROM {quote_identifier(table)}")
+
+    def upsert_rows(self, table, columns, keys, rows):
+        target = quote_identifier(table)
+        stage = quote_identifier(f"_stage_{table}")
+        column_list = ", ".join(quote_identifier(column) for column in columns)
+        key_list = ", ".join(quote_identifier(column) for column in keys)
+        updates = ", ".join(f"{quote_identifier(column)} = EXCLUDED.{quote_identifier(column)}"
+                            for column in columns if column not in keys)
+        conflict_action = f"DO UPDATE SET {updates}" if updates else "DO NOTHING"
+
+        with self.connection.cursor() as cursor:
+            cursor.execute(f"CREATE TEMP TABLE IF NOT EXISTS {stage} (LIKE {target}) ON COMMIT DELETE ROWS")
+            with cursor.copy(f"COPY {stage} ({column_list}) FROM STDIN") as copy:
+                for row in rows:
+                    copy.write_row(row)
+            cursor.execute(f"INSERT INTO {target} ({column_list}) SELECT {column_list} FROM {stage} "
+                           f"ON CONFLICT ({key_list}) {conflict_action}")
+            cursor.execute(f"TRUNCATE {stage}")
+
+    def delete_rows(self, table, keys, key_rows):
+        condition = " AND ".join(f"{quote_identifier(column)} = %s" for column in keys)
+        with self.connection.cursor() as cursor:
+            cursor.executemany(f"DELETE FROM {quote_identifier(table)} WHERE {condition}", key_rows)
+
+    def commit(self):
+        self.connection.commit()
+
+    def rollback(self):
+        self.connection.rollback()
+
+    def close(self):
+        self.connection.close()
+
+def open_target(database_url):
+    """Open a database target from a URL such as sqlite:///path/to/file.db or postgresql://user@host/db"""
+    if database_url.startswith("sqlite:///"):
+        return SQLiteTarget(database_url[len("sqlite:///"):])
+    if database_url.startswith(("postgresql://", "postgres://")):
+        return PostgresTarget(database_url)
+    raise ValueError(f"Unsupported database URL: {database_url}. Use sqlite:///<path> or postgresql://...")
+
+class RecordSplitter:
+    """Turns decompressed text arriving in arbitrary chunks into complete JSONL or CSV records"""
+
+    def __init__(self, file_format):
+        if file_format not in ("jsonl", "csv"):
+            raise ValueError(f"Streaming into a database is only supported for jsonl and csv, not {file_format}")
+        self.file_format = file_format
+        self.pending = ""
+        self.record_lines = []
+        self.quotes = 0
+        self.header = None
+
+    def feed(self, text, final=False):
+        """Return the (key, value, action) records completed by this chunk of text"""
+        self.pending += text
+        lines = self.pending.split("\n")
+        self.pending = "" if final else lines.pop()
+
+        records = []
+        for line in lines:
+            if self.file_format == "jsonl":
+                if line.strip():
+                    records.append(parse_jsonl_record(line))
+                continue
+
+            # A CSV record continues on the next line while a quoted field is still open
+            self.record_lines.append(line.rstrip("\r"))
+            self.quotes += line.count('"')
+            if self.quotes % 2:
+                continue
+            record_text = "\n".join(self.record_lines)
+            self.record_lines = []
+            self.quotes = 0
+            if not record_text:
+                continue
+            fields = next(csv.reader([record_text]))
+            if self.header is None:
+                self.header = fields
+            else:
+                records.append(parse_csv_record(self.header, fields))
+        return records
+
+async def stream_records(session, dap_client, table, dap_object, resource, file_format, progress):
+    """Yield the records of a remote gzip object while it downloads, without touching the disk
+
+    Interrupted transfers are retried and resumed by the download engine, so every record is yielded once.
+    """
+    gzip_stream = GzipStream()
+    decoder = codecs.getincrementaldecoder("utf-8")()
+    splitter = RecordSplitter(file_format)
+
+    async for chunk in stream_object(session, dap_client, table, dap_object, resource, progress):
+        for record in splitter.feed(decoder.decode(gzip_stream.decompress(chunk))):
+            yield record
+
+    for record in splitter.feed(decoder.decode(gzip_stream.flush(), final=True), final=True):
+        yield record
+
+async def run_in_thread(function, *args):
+    """Run a blocking database call in a worker thread
+
+    A cancelled caller still waits for the call to return, so the connection is never closed while a
+    batch is being written to it.
+    """
+    call = asyncio.ensure_future(asyncio.to_thread(function, *args))
+    try:
+        return await asyncio.shield(call)
+    except asyncio.CancelledError:
+        await asyncio.wait([call])
+        raise
+
+def latest_per_key(rows, key_indexes):
+    """Keep only the last row of each key in a batch, since a bulk upsert may touch a key only once"""
+    latest = {}
+    for row in rows:
+        latest[tuple(row[index] for index in key_indexes)] = row
+    return list(latest.values())
+
+async def load_job_objects(dap_client, table, table_data_result, versioned_schema, file_format, database_url, snapshot, progress, record_filter=None):
+    """Stream every object of a completed job into a database table created from the table schema
+
+    Snapshots replace the content of the table; incremental results upsert changed rows and delete
+    removed ones. Rows are written in batches of SQL_BATCH_ROWS, so memory stays constant, and the
+    whole load is one transaction that is only committed once every object has been loaded, so a
+    failed load leaves the table as it was and the sync watermark still matches its content. A
+    RecordFilter skips the records it does not match, or deletes them, and limits the table to its
+    selected columns. Returns the number of records loaded.
+    """
+    types = record_filter.types if record_filter else column_types(versioned_schema.schema)
+    keys = key_columns(versioned_schema.schema)
+    columns = list(types)
+    key_indexes = [columns.index(column) for column in keys]
+
+    target = await asyncio.to_thread(open_target, database_url)
+    try:
+        await run_in_thread(target.create_table, table, types, keys)
+        if snapshot:
+            await run_in_thread(target.clear_table, table)
+
+        if not table_data_result.objects:
+            await run_in_thread(target.commit)
+            print(f"Loaded 0 records of {table} into {database_url}")
+            return 0
+
+        resources = await dap_client.get_resources(table_data_result.objects)
+        progress.add_objects(len(resources))
+
+        # Batches of concurrently streamed objects are written one at a time
+        write_lock = asyncio.Lock()
+        semaphore = asyncio.Semaphore(SQL_LOAD_CONCURRENCY)
+
+        async def write_batch(kind, rows):
+            async with write_lock:
+                if kind == "delete":
+                    await run_in_thread(target.delete_rows, table, keys, rows)
+                else:
+                    await run_in_thread(target.upsert_rows, table, columns, keys, latest_per_key(rows, key_indexes))
+
+        async def load_one(dap_object):
+            async with semaphore:
+                started = time.monotonic()
+                record_count = 0
+                kind, rows = None, []
+                async for key, value, action in stream_records(session, dap_client, table, dap_object, resources[dap_object.id], file_format, progress):
+                    outcome = record_filter.decide(key, value, action) if record_filter is not None else KEEP
+                    if outcome is None:
+                        continue
+                    record_kind = "delete" if outcome == DELETE or is_delete(action) else "upsert"
+                    # Flush whenever the action changes so upserts and deletes are applied in order
+                    if rows and (record_kind != kind or len(rows) >= SQL_BATCH_ROWS):
+                        await write_batch(kind, rows)
+                        rows = []
+                    kind = record_kind
+                    if record_kind == "delete":
+                        rows.append(tuple(coerce_value(key.get(column), types[column]) for column in keys))
+                    else:
+                        row = record_row(key, value, types)
+                        rows.append(tuple(row[column] for column in columns))
+                    record_count += 1
+                if rows:
+                    await write_batch(kind, rows)
+                progress.metrics.record(table, "stream_object", time.monotonic() - started, object_id=dap_object.id, rows=record_count)
+                progress.object_done()
+                return record_count
+
+        async with open_session() as session:
+            record_counts = await run_tasks(load_one(dap_object) for dap_object in table_data_result.objects)
+        await run_in_thread(target.commit)
+    except BaseException:
+        await asyncio.to_thread(target.rollback)
+        raise
+    finally:
+        await asyncio.to_thread(target.close)
+
+    print(f"Loaded {sum(record_counts)} records of {table} into {database_url}")
+    return sum(record_counts)
@@ -0,0 +1,105 @@
+import os
+import sqlite3
+from contextlib import contextmanager
+from datetime import datetime, timezone
+
+# Name of the SQLite file that keeps the sync state inside the output directory
+SYNC_STATE_FILE = "dap_sync_state.db"
+
+class SyncStateStore:
+    """Records the watermark returned by the DAP API for each namespace/table in a local SQLite file
+
+    The watermark is the `at` timestamp of a snapshot or the `until` timestamp of an incremental
+    query, and is the `since` value to use for the next incremental query of the table. The store
+    also checkpoints the completed windows of backfills, so an interrupted backfill can resume.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        with self.connect() as connection:
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS watermarks ("
+                " namespace TEXT NOT NULL,"
+                " table_name TEXT NOT NULL,"
+                " watermark TEXT NOT NULL,"
+                " job_id TEXT,"
+                " updated_at TEXT NOT NULL,"
+                " PRIMARY KEY (namespace, table_name))"
+            )
+            connection.execute(
+                "CREATE TABLE IF NOT EXISTS backfill_windows ("
+                " namespace TEXT NOT NULL,"
+                " table_name TEXT NOT NULL,"
+                " window_start TEXT NOT NULL,"
+                " window_end TEXT NOT NULL,"
+                " job_id TEXT,"
+                " completed_at TEXT NOT NULL,"
+                " PRIMARY KEY (namespace, table_name, window_start, window_end))"
+            )
+
+    @classmethod
+    def for_directory(cls, output_directory):
+        """Open the sync state store kept in the given output directory"""
+        os.makedirs(output_directory, exist_ok=True)
+        return cls(os.path.join(output_directory, SYNC_STATE_FILE))
+
+    @contextmanager
+    def connect(self):
+        """Open a short-lived connection, so the store can be used from any thread, and commit on success"""
+        connection = sqlite3.connect(self.path, timeout=30)
+        try:
+            with connection:
+                yield connection
+        finally:
+            connection.close()
+
+    def get_watermark(self, namespace, table):
+        """Return the last recorded watermark of a table as a UTC datetime, or None if it was never synced"""
+        with self.connect() as connection:
+            row = connection.execute(
+                "SELECT watermark FROM watermarks WHERE namespace = ? AND table_name = ?",
+                (namespace, table),
+            ).fetchone()
+        if row is None:
+            return None
+        return datetime.fromisoformat(row[0]).astimezone(timezone.utc)
+
+    def set_watermark(self, namespace, table, watermark, job_id=None):
+        """Record the watermark of a table after its data has been downloaded successfully"""
+        with self.connect() as connection:
+            connection.execute(
+                "INSERT INTO watermarks (namespace, table_name, watermark, job_id, updated_at)"
+                " VALUES (?, ?, ?, ?, ?)"
+                " ON CONFLICT (namespace, table_name) DO UPDATE SET"
+                " watermark = excluded.watermark, job_id = excluded.job_id, updated_at = excluded.updated_at",
+                (namespace, table, watermark.astimezone(timezone.utc).isoformat(), job_id,
+                 datetime.now(timezone.utc).isoformat()),
+            )
+
+    def clear_watermark(self, namespace, table):
+        """Forget the watermark of a table so that the next sync starts over with a snapshot"""
+        with self.connect() as connection:
+            connection.execute(
+                "DELETE FROM watermarks WHERE namespace = ? AND table_name = ?",
+                (namespace, table),
+            )
+
+    def completed_windows(self, namespace, table):
+        """Return the (start, end) UTC datetimes of the backfill windows of a table that completed"""
+        with self.connect() as connection:
+            rows = connection.execute(
+                "SELECT window_start, window_end FROM backfill_windows WHERE namespace = ? AND table_name = ?",
+                (namespace, table),
+            ).fetchall()
+        return {(datetime.fromisoformat(start).astimezone(timezone.utc), datetime.fromisoformat(end).astimezone(timezone.utc))
+                for start, end in rows}
+
+    def mark_window_completed(self, namespace, table, start, end, job_id=None):
+        """Checkpoint a backfill window after its data has been downloaded successfully"""
+        with self.connect() as connection:
+            connection.execute(
+                "INSERT OR REPLACE INTO backfill_windows (namespace, table_name, window_start, window_end, job_id, completed_at)"
+                " VALUES (?, ?, ?, ?, ?, ?)",
+                (namespace, table, start.astimezone(timezone.utc).isoformat(), end.astimezone(timezone.utc).isoformat(),
+                 job_id, datetime.now(timezone.utc).isoformat()),
+            )
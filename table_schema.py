@@ -0,0 +1,138 @@
+import csv
+import json
+import zlib
+
+# Actions recorded in the `meta.action` field of incremental records that remove a row
+DELETE_ACTIONS = ("D", "delete")
+
+# Action written for records that are turned into deletes, as DAP writes it
+DELETE_ACTION = "D"
+
+# Literal used by DAP for NULL values in CSV output
+CSV_NULL = "NULL"
+
+def key_columns(schema):
+    """Return the primary key column names of a table from the JSON schema returned by get_table_schema"""
+    return list(schema["properties"]["key"]["properties"].keys())
+
+def column_types(schema):
+    """Return an ordered mapping of every key and value column to a simple logical type
+
+    The logical types are "integer", "number", "boolean", "string" and "json"; the latter is used for
+    nested objects and arrays, which are stored as JSON text.
+    """
+    types = {}
+    for part in ("key", "value"):
+        part_schema = resolve_ref(schema, schema["properties"].get(part, {}))
+        for column, column_schema in part_schema.get("properties", {}).items():
+            types[column] = logical_type(schema, column_schema)
+    return types
+
+def resolve_ref(schema, property_schema):
+    """Follow a local `$ref` such as `#/definitions/Name` to the referenced sub-schema"""
+    ref = property_schema.get("$ref")
+    if ref is None:
+        return property_schema
+    target = schema
+    for part in ref.lstrip("#/").split("/"):
+        target = target[part]
+    return resolve_ref(schema, target)
+
+def logical_type(schema, property_schema):
+    property_schema = resolve_ref(schema, property_schema)
+    json_type = property_schema.get("type")
+    if json_type is None:
+        # Enumerations and unions without an explicit type
+        for option in property_schema.get("oneOf", property_schema.get("anyOf", [])):
+            option_type = logical_type(schema, option)
+            if option_type != "null":
+                return option_type
+        return "string" if "enum" in property_schema else "json"
+    if isinstance(json_type, list):
+        json_type = next((t for t in json_type if t != "null"), "null")
+    if json_type in ("integer", "number", "boolean", "string", "null"):
+        return json_type
+    return "json"
+
+def coerce_value(value, column_type):
+    """Convert a decoded JSON or CSV value to the Python type of its logical column type"""
+    if value is None:
+        return None
+    if value == "" and column_type in ("integer", "number", "boolean", "json"):
+        # CSV output has no way to tell a missing value apart from an empty one
+        return None
+    if column_type == "integer":
+        return int(value)
+    if column_type == "number":
+        return float(value)
+    if column_type == "boolean":
+        return value if isinstance(value, bool) else value.lower() == "true"
+    if column_type in ("string", "json") and not isinstance(value, str):
+        return json.dumps(value)
+    return value
+
+class GzipStream:
+    """Incrementally decompresses gzip data, including objects made of several gzip members"""
+
+    def __init__(self):
+        self.decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+
+    def decompress(self, data):
+        output = []
+        while data:
+            output.append(self.decompressor.decompress(data))
+            if self.decompressor.eof:
+                data = self.decompressor.unused_data
+                self.decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+            else:
+                data = b""
+        return b"".join(output)
+
+    def flush(self):
+        return self.decompressor.flush()
+
+def read_records(file_path, file_format):
+    """Yield the records of a downloaded JSONL or CSV file as (key, value, action) tuples
+
+    `key` and `value` are dicts of column name to the raw decoded value; `action` is the value of
+    `meta.action`, or None for snapshot records.
+    """
+    if file_format == "jsonl":
+        with open(file_path, encoding="utf-8") as input_file:
+            for line in input_file:
+                if line.strip():
+                    yield parse_jsonl_record(line)
+    elif file_format == "csv":
+        with open(file_path, encoding="utf-8", newline="") as input_file:
+            reader = csv.reader(input_file)
+            header = next(reader, None)
+            for fields in reader:
+                yield parse_csv_record(header, fields)
+    else:
+        raise ValueError(f"Reading records is only supported for jsonl and csv files, not {file_format}")
+
+def parse_jsonl_record(line):
+    """Split one JSON Lines record into its key, value and meta.action parts"""
+    record = json.loads(line)
+    return record.get("key", {}), record.get("value", {}), record.get("meta", {}).get("action")
+
+def parse_csv_record(header, fields):
+    """Split one CSV row with `key.`, `value.` and `meta.` prefixed header names into key, value and action"""
+    key, value, action = {}, {}, None
+    for field, field_value in zip(header, fields):
+        field_value = None if field_value == CSV_NULL else field_value
+        part, _, column = field.partition(".")
+        if part == "key":
+            key[column] = field_value
+        elif part == "value":
+            value[column] = field_value
+        elif field == "meta.action":
+            action = field_value
+    return key, value, action
+
+def record_row(key, value, types):
+    """Build a flat row of every key and value column, coerced to the column types"""
+    return {column: coerce_value(value.get(column, key.get(column)), column_type) for column, column_type in types.items()}
+
+def is_delete(action):
+    return action in DELETE_ACTIONS
@@ -0,0 +1,35 @@
+import asyncio
+import threading
+
+import pytest
+
+@pytest.fixture
+def mock_api(monkeypatch):
+    """Start the mock DAP API of the benchmarks on a background event loop
+
+    Returns a function that takes the server's command line options and returns its base URL and the
+    MockDAPServer, whose stats the test can inspect. The servers are stopped after the test. As in the
+    benchmark, the DAP client's usage tracking is turned off.
+    """
+    monkeypatch.setenv("DAP_TRACKING", "false")
+    web = pytest.importorskip("aiohttp.web")
+    mock_dap_server = pytest.importorskip("mock_dap_server")
+    started = []
+
+    def start(*options):
+        server = mock_dap_server.create_server(mock_dap_server.parse_arguments(["--port", "0", *options]))
+        loop = asyncio.new_event_loop()
+        runner = web.AppRunner(server.application(), access_log=None)
+        loop.run_until_complete(runner.setup())
+        loop.run_until_complete(web.TCPSite(runner, "127.0.0.1", 0).start())
+        thread = threading.Thread(target=loop.run_forever, daemon=True)
+        thread.start()
+        started.append((loop, runner, thread))
+        return f"http://127.0.0.1:{runner.addresses[0][1]}", server
+
+    yield start
+    for loop, runner, thread in started:
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join()
+        loop.run_until_complete(runner.cleanup())
+        loop.close()
@@ -0,0 +1,30 @@
+from datetime import datetime, timezone
+
+import pytest
+
+from dap_core import Backfill, split_windows
+
+def utc(*args):
+    return datetime(*args, tzinfo=timezone.utc)
+
+def test_split_windows_aligns_days_on_midnight():
+    assert split_windows(utc(2024, 1, 1, 12), utc(2024, 1, 3, 6), "day") == [
+        (utc(2024, 1, 1, 12), utc(2024, 1, 2)),
+        (utc(2024, 1, 2), utc(2024, 1, 3)),
+        (utc(2024, 1, 3), utc(2024, 1, 3, 6)),
+    ]
+
+def test_split_windows_aligns_weeks_on_monday():
+    # 2024-01-03 is a Wednesday
+    assert split_windows(utc(2024, 1, 3), utc(2024, 1, 16), "week") == [
+        (utc(2024, 1, 3), utc(2024, 1, 8)),
+        (utc(2024, 1, 8), utc(2024, 1, 15)),
+        (utc(2024, 1, 15), utc(2024, 1, 16)),
+    ]
+
+def test_split_windows_empty_range():
+    assert split_windows(utc(2024, 1, 2), utc(2024, 1, 2), "day") == []
+
+def test_backfill_rejects_unknown_window():
+    with pytest.raises(ValueError, match="Unknown backfill window"):
+        Backfill("2024-02-01T00:00:00+00:00", window="month")
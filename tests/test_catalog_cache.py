@@ -0,0 +1,86 @@
+import asyncio
+import json
+from datetime import datetime, timedelta, timezone
+from types import SimpleNamespace
+
+import pytest
+
+from catalog_cache import DEFAULT_API_URL, CatalogCache, api_key
+
+class CatalogClient:
+    """Answers catalog requests with fixed tables and counts them"""
+
+    def __init__(self, tables, version=1):
+        self.tables = tables
+        self.version = version
+        self.requests = 0
+
+    async def get_tables(self, namespace):
+        self.requests += 1
+        return list(self.tables)
+
+    async def get_table_schema(self, namespace, table):
+        self.requests += 1
+        return SimpleNamespace(schema={"table": table}, version=self.version)
+
+def age_entry(path, age):
+    with open(path) as cache_file:
+        entry = json.load(cache_file)
+    entry["fetched_at"] = (datetime.now(timezone.utc) - age).isoformat()
+    with open(path, "w") as cache_file:
+        json.dump(entry, cache_file)
+
+def test_tables_are_fetched_again_after_the_ttl(tmp_path):
+    cache = CatalogCache(str(tmp_path), ttl=timedelta(hours=1)).for_api("https://api.example.com")
+    dap_client = CatalogClient(["users", "accounts"])
+
+    assert asyncio.run(cache.get_tables(dap_client, "canvas")) == ["accounts", "users"]
+    assert asyncio.run(cache.get_tables(dap_client, "canvas")) == ["accounts", "users"]
+    assert dap_client.requests == 1
+
+    age_entry(cache.tables_path("canvas"), timedelta(hours=2))
+    assert cache.cached_tables("canvas") is None
+    assert cache.cached_tables("canvas", allow_stale=True) == ["accounts", "users"]
+    dap_client.tables = ["courses"]
+    assert asyncio.run(cache.get_tables(dap_client, "canvas")) == ["courses"]
+    assert dap_client.requests == 2
+
+def test_catalogs_of_different_apis_are_kept_apart(tmp_path, monkeypatch):
+    monkeypatch.delenv("DAP_API_URL", raising=False)
+    cache = CatalogCache(str(tmp_path))
+    production = cache.for_api("https://api-gateway.instructure.com")
+    beta = cache.for_api("https://beta.example.com/")
+
+    asyncio.run(production.get_tables(CatalogClient(["accounts"]), "canvas"))
+    asyncio.run(beta.get_tables(CatalogClient(["beta_only"]), "canvas"))
+
+    assert production.cached_tables("canvas") == ["accounts"]
+    assert beta.cached_tables("canvas") == ["beta_only"]
+    assert production.tables_path("canvas") != beta.tables_path("canvas")
+    # The same API is found again whatever trailing slash or default its URL was given with
+    assert cache.for_api("https://beta.example.com").cached_tables("canvas") == ["beta_only"]
+    assert api_key(None) == api_key(DEFAULT_API_URL + "/")
+
+def test_invalidate_only_drops_the_catalog_of_one_api(tmp_path):
+    cache = CatalogCache(str(tmp_path))
+    first, second = cache.for_api("https://one.example.com"), cache.for_api("https://two.example.com")
+    asyncio.run(first.get_tables(CatalogClient(["accounts"]), "canvas"))
+    asyncio.run(second.get_tables(CatalogClient(["accounts"]), "canvas"))
+
+    first.invalidate("canvas")
+
+    assert first.cached_tables("canvas") is None
+    assert second.cached_tables("canvas") == ["accounts"]
+
+def test_schema_is_fetched_again_for_another_version(tmp_path):
+    pytest.importorskip("dap.dap_types")
+    cache = CatalogCache(str(tmp_path)).for_api("https://api.example.com")
+    dap_client = CatalogClient([])
+
+    assert asyncio.run(cache.get_schema(dap_client, "canvas", "accounts")).version == 1
+    assert asyncio.run(cache.get_schema(dap_client, "canvas", "accounts", expected_version=1)).version == 1
+    assert dap_client.requests == 1
+
+    dap_client.version = 2
+    assert asyncio.run(cache.get_schema(dap_client, "canvas", "accounts", expected_version=2)).version == 2
+    assert dap_client.requests == 2
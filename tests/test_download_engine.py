@@ -0,0 +1,155 @@
+import asyncio
+import gzip
+import json
+import os
+from types import SimpleNamespace
+
+import pytest
+
+aiohttp = pytest.importorskip("aiohttp")
+
+import download_engine
+from dap_core import ExportProgress
+from download_engine import MANIFEST_FILE, download_objects, open_session, stream_object
+
+TABLE = "bench_table"
+
+class MockObjectClient:
+    """Submits query jobs to the mock DAP API and resolves their objects, in place of a DAPClient"""
+
+    def __init__(self, base_url):
+        self.base_url = base_url
+
+    async def submit(self, file_format="jsonl"):
+        async with aiohttp.ClientSession() as session:
+            async with session.post(f"{self.base_url}/dap/query/canvas/table/{TABLE}/data", json={"format": file_format}) as response:
+                job = await response.json()
+        return [SimpleNamespace(id=dap_object["id"]) for dap_object in job["objects"]]
+
+    async def get_resources(self, objects):
+        async with aiohttp.ClientSession() as session:
+            async with session.post(f"{self.base_url}/dap/object/url", json=[{"id": dap_object.id} for dap_object in objects]) as response:
+                urls = (await response.json())["urls"]
+        return {object_id: SimpleNamespace(url=resource["url"]) for object_id, resource in urls.items()}
+
+@pytest.fixture(autouse=True)
+def fast_retries(monkeypatch):
+    monkeypatch.setattr(download_engine, "DOWNLOAD_BACKOFF_BASE", 0.01)
+
+def download(dap_client, objects, output_directory, decompress=True):
+    return asyncio.run(download_objects(dap_client, TABLE, objects, str(output_directory), decompress,
+                                        ExportProgress("test", TABLE), workers=4))
+
+def submit(base_url, file_format="jsonl"):
+    dap_client = MockObjectClient(base_url)
+    return dap_client, asyncio.run(dap_client.submit(file_format))
+
+def assert_outputs_match(server, objects, paths, decompress=True):
+    for dap_object, path in zip(objects, paths):
+        with open(path, "rb") as output_file:
+            content = output_file.read()
+        payload = server.payload(dap_object.id)
+        assert content == (gzip.decompress(payload) if decompress else payload)
+
+def test_truncated_downloads_resume_where_they_stopped(mock_api, tmp_path):
+    base_url, server = mock_api("--objects", "4", "--rows-per-object", "3000", "--truncate-rate", "0.5", "--seed", "3")
+    dap_client, objects = submit(base_url)
+
+    paths = download(dap_client, objects, tmp_path)
+
+    assert server.stats["injected_truncations"] > 0
+    assert_outputs_match(server, objects, paths)
+    # Resumed transfers only fetch the missing bytes, so every byte is sent about once
+    payload_bytes = sum(len(server.payload(dap_object.id)) for dap_object in objects)
+    assert server.stats["bytes_served"] == payload_bytes
+    assert not [name for name in os.listdir(tmp_path) if name.endswith((".part", ".tmp"))]
+
+def test_failed_downloads_are_retried(mock_api, tmp_path):
+    base_url, server = mock_api("--objects", "4", "--rows-per-object", "500", "--failure-rate", "0.5", "--seed", "5")
+    dap_client, objects = submit(base_url, "csv")
+
+    paths = download(dap_client, objects, tmp_path, decompress=False)
+
+    assert server.stats["injected_failures"] > 0
+    assert_outputs_match(server, objects, paths, decompress=False)
+
+def test_server_ignoring_range_restarts_the_object(mock_api, tmp_path):
+    base_url, server = mock_api("--objects", "4", "--rows-per-object", "3000", "--truncate-rate", "0.5",
+                                "--ignore-range", "--seed", "3")
+    dap_client, objects = submit(base_url)
+
+    paths = download(dap_client, objects, tmp_path)
+
+    assert server.stats["injected_truncations"] > 0
+    assert_outputs_match(server, objects, paths)
+
+@pytest.mark.parametrize("options", [(), ("--ignore-range",)])
+def test_streamed_objects_yield_every_byte_once(mock_api, options):
+    base_url, server = mock_api("--objects", "2", "--rows-per-object", "3000", "--truncate-rate", "0.5", "--seed", "3", *options)
+    dap_client, objects = submit(base_url)
+
+    async def stream_all():
+        resources = await dap_client.get_resources(objects)
+        async with open_session() as session:
+            return [b"".join([chunk async for chunk in stream_object(session, dap_client, TABLE, dap_object, resources[dap_object.id],
+                                                                     ExportProgress("test", TABLE))])
+                    for dap_object in objects]
+
+    contents = asyncio.run(stream_all())
+
+    assert server.stats["injected_truncations"] > 0
+    assert contents == [server.payload(dap_object.id) for dap_object in objects]
+
+def part_path(directory, dap_object, server):
+    return directory / f"{TABLE}_part-{server.object_specs[dap_object.id][1]:05d}.jsonl.gz.part"
+
+def test_complete_partial_file_is_finished_without_downloading(mock_api, tmp_path):
+    base_url, server = mock_api("--objects", "1", "--rows-per-object", "500")
+    dap_client, objects = submit(base_url)
+    part_path(tmp_path, objects[0], server).write_bytes(server.payload(objects[0].id))
+    server.reset()
+
+    paths = download(dap_client, objects, tmp_path)
+
+    # The range request past the end is answered with 416 and the size of the object
+    assert server.stats["bytes_served"] == 0
+    assert_outputs_match(server, objects, paths)
+
+def test_partial_file_longer_than_the_object_is_downloaded_again(mock_api, tmp_path):
+    base_url, server = mock_api("--objects", "1", "--rows-per-object", "500")
+    dap_client, objects = submit(base_url)
+    part_path(tmp_path, objects[0], server).write_bytes(server.payload(objects[0].id) + b"stale")
+
+    paths = download(dap_client, objects, tmp_path)
+
+    assert_outputs_match(server, objects, paths)
+
+def test_corrupt_gzip_is_downloaded_again(mock_api, tmp_path):
+    base_url, server = mock_api("--objects", "1", "--rows-per-object", "500")
+    dap_client, objects = submit(base_url)
+    payload = bytearray(server.payload(objects[0].id))
+    payload[len(payload) // 2:len(payload) // 2 + 64] = bytes(64)
+    part_path(tmp_path, objects[0], server).write_bytes(bytes(payload))
+    server.reset()
+
+    paths = download(dap_client, objects, tmp_path)
+
+    assert server.stats["objects_served"] == 1
+    assert_outputs_match(server, objects, paths)
+    records = [json.loads(line) for line in open(paths[0])]
+    assert len({record["key"]["id"] for record in records}) == len(records) == 500
+
+def test_manifest_skips_completed_objects(mock_api, tmp_path):
+    base_url, server = mock_api("--objects", "3", "--rows-per-object", "500")
+    dap_client, objects = submit(base_url)
+    first_paths = download(dap_client, objects, tmp_path)
+    assert (tmp_path / MANIFEST_FILE).exists()
+
+    # An output file that no longer matches the manifest is downloaded again
+    os.remove(first_paths[1])
+    server.reset()
+    second_paths = download(dap_client, objects, tmp_path)
+
+    assert second_paths == first_paths
+    assert server.stats["objects_served"] == 1
+    assert_outputs_match(server, objects, second_paths)
@@ -0,0 +1,121 @@
+import asyncio
+import time
+
+import pytest
+
+pytest.importorskip("dap.api")
+
+import job_scheduler
+from dap.dap_types import Format, SnapshotQuery
+from dap_core import ExportProgress, open_client
+from job_scheduler import JobScheduler
+
+TABLES = [f"table_{index}" for index in range(6)]
+
+class CountingScheduler(JobScheduler):
+    """Counts the polling loops started and the status checks made"""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.poll_loops = 0
+        self.polls = 0
+
+    async def poll_jobs(self):
+        self.poll_loops += 1
+        await super().poll_jobs()
+
+    async def poll(self, pending):
+        self.polls += 1
+        await super().poll(pending)
+
+def snapshot_query():
+    return SnapshotQuery(format=Format.JSONL, mode=None)
+
+def test_jobs_are_polled_from_one_loop_and_returned_as_they_complete(mock_api):
+    base_url, server = mock_api("--tables", ",".join(TABLES), "--objects", "1", "--job-delay", "0.5",
+                                "--job-delay-spread", "3", "--seed", "7")
+    finished = {}
+
+    async def run():
+        async with open_client(base_url, "client", "secret") as session:
+            scheduler = CountingScheduler(session, max_jobs=len(TABLES))
+
+            async def run_one(table):
+                result = await scheduler.run_job("canvas", table, snapshot_query(), ExportProgress(table, table))
+                finished[table] = time.monotonic()
+                return result
+
+            results = await asyncio.gather(*(run_one(table) for table in TABLES))
+            return scheduler, results
+
+    started = time.monotonic()
+    scheduler, results = asyncio.run(run())
+    elapsed = time.monotonic() - started
+
+    assert scheduler.poll_loops == 1
+    assert [server.jobs[result.job_id]["table"] for result in results] == TABLES
+    # Every job is checked a few times with a growing interval rather than on a fixed tick
+    assert scheduler.polls <= 4 * len(TABLES)
+    # The jobs wait at the server side by side, so the run takes about as long as the slowest job
+    completes = {job["table"]: job["completes"] for job in server.jobs.values()}
+    durations = [completes[table] - started for table in TABLES]
+    assert elapsed < max(durations) + job_scheduler.JOB_POLL_MAX
+    assert elapsed < sum(durations)
+    # Each table gets its result soon after its own job completes, before the slowest one is done
+    first, last = min(TABLES, key=completes.get), max(TABLES, key=completes.get)
+    assert finished[first] < completes[last]
+
+def test_jobs_in_flight_are_limited(mock_api):
+    base_url, server = mock_api("--tables", ",".join(TABLES), "--objects", "1", "--job-delay", "1")
+
+    async def run():
+        async with open_client(base_url, "client", "secret") as session:
+            scheduler = JobScheduler(session, max_jobs=2)
+            started = time.monotonic()
+            await asyncio.gather(*(scheduler.run_job("canvas", table, snapshot_query(), ExportProgress(table, table))
+                                   for table in TABLES))
+            return time.monotonic() - started
+
+    elapsed = asyncio.run(run())
+
+    completes = sorted(job["completes"] for job in server.jobs.values())
+    # The third job is only submitted once one of the first two has completed
+    assert completes[2] - completes[0] >= 1.0
+    assert elapsed >= len(TABLES) / 2
+
+def test_reused_job_that_expires_soon_is_waited_out(mock_api, monkeypatch):
+    monkeypatch.setattr(job_scheduler, "JOB_EXPIRY_GRACE", 0.2)
+    base_url, server = mock_api("--objects", "1", "--job-delay", "0.5", "--reuse-jobs", "--job-lifetime", "3")
+    progress = ExportProgress("bench_table", "bench_table")
+
+    async def run():
+        async with open_client(base_url, "client", "secret") as session:
+            scheduler = JobScheduler(session)
+            first = await scheduler.run_job("canvas", "bench_table", snapshot_query(), progress)
+            started = time.monotonic()
+            second = await scheduler.run_job("canvas", "bench_table", snapshot_query(), progress)
+            return first, second, time.monotonic() - started
+
+    first, second, elapsed = asyncio.run(run())
+
+    # The first job is handed out again with less than JOB_EXPIRY_MARGIN left, so a new one is submitted once it expired
+    assert first.job_id != second.job_id
+    assert len(server.jobs) == 2
+    assert elapsed >= 2.0
+    assert progress.metrics.totals[("bench_table", "job_expiry_wait")]["count"] == 1
+
+def test_reused_job_with_time_left_is_used(mock_api):
+    base_url, server = mock_api("--objects", "1", "--reuse-jobs")
+    progress = ExportProgress("bench_table", "bench_table")
+
+    async def run():
+        async with open_client(base_url, "client", "secret") as session:
+            scheduler = JobScheduler(session)
+            first = await scheduler.run_job("canvas", "bench_table", snapshot_query(), progress)
+            second = await scheduler.run_job("canvas", "bench_table", snapshot_query(), progress)
+            return first, second
+
+    first, second = asyncio.run(run())
+
+    assert first.job_id == second.job_id
+    assert ("bench_table", "job_expiry_wait") not in progress.metrics.totals
@@ -0,0 +1,50 @@
+import os
+
+from merge_engine import merge_streams, recover_directory, replace_directory
+
+def base_entry(key, sequence, row):
+    return (key,), 0, sequence, None, row
+
+def delta_entry(key, sequence, action, row):
+    return (key,), 1, sequence, action, row
+
+def test_merge_keeps_latest_change_per_key():
+    deltas = [
+        delta_entry(1, 0, "U", {"id": 1, "name": "first"}),
+        delta_entry(1, 1, "U", {"id": 1, "name": "second"}),
+        delta_entry(2, 2, "U", {"id": 2, "name": "only"}),
+    ]
+    assert list(merge_streams(iter(()), iter(deltas))) == [{"id": 1, "name": "second"}, {"id": 2, "name": "only"}]
+
+def test_merge_delta_wins_over_base():
+    base = [base_entry(1, 0, {"id": 1, "name": "base"}), base_entry(2, 1, {"id": 2, "name": "kept"})]
+    deltas = [delta_entry(1, 0, "U", {"id": 1, "name": "changed"})]
+    assert list(merge_streams(iter(base), iter(deltas))) == [{"id": 1, "name": "changed"}, {"id": 2, "name": "kept"}]
+
+def test_merge_delete_drops_row():
+    base = [base_entry(1, 0, {"id": 1}), base_entry(2, 1, {"id": 2})]
+    deltas = [delta_entry(1, 0, "D", {"id": 1})]
+    assert list(merge_streams(iter(base), iter(deltas))) == [{"id": 2}]
+
+def test_merge_upsert_after_delete_restores_row():
+    deltas = [delta_entry(1, 0, "D", {"id": 1}), delta_entry(1, 1, "U", {"id": 1, "name": "back"})]
+    assert list(merge_streams(iter([base_entry(1, 0, {"id": 1})]), iter(deltas))) == [{"id": 1, "name": "back"}]
+
+def test_recover_directory_restores_interrupted_swap(tmp_path):
+    table_directory = tmp_path / "table"
+    (tmp_path / "table.old").mkdir()
+    (tmp_path / "table.old" / "part-00000.parquet").write_text("old")
+    recover_directory(str(table_directory))
+    assert (table_directory / "part-00000.parquet").read_text() == "old"
+    assert not (tmp_path / "table.old").exists()
+
+def test_replace_directory_removes_old_dataset(tmp_path):
+    table_directory = tmp_path / "table"
+    table_directory.mkdir()
+    (tmp_path / "table.old").mkdir()
+    new_directory = tmp_path / "new"
+    new_directory.mkdir()
+    (new_directory / "part-00000.parquet").write_text("new")
+    replace_directory(str(new_directory), str(table_directory))
+    assert os.listdir(tmp_path) == ["table"]
+    assert (table_directory / "part-00000.parquet").read_text() == "new"
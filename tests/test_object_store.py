@@ -0,0 +1,76 @@
+import os
+
+from object_store import ObjectStore
+
+def write_file(path, content):
+    path.write_bytes(content)
+    return str(path)
+
+def test_object_with_known_etag_is_reused(tmp_path):
+    store = ObjectStore(str(tmp_path / "store"))
+    store.add(write_file(tmp_path / "a.jsonl", b"rows\n"), "object-a", "decompressed", etag='"abc"')
+
+    # Another job returns the same content under a new object ID
+    assert store.lookup("object-b", "decompressed") is None
+    stored_path = store.lookup("object-b", "decompressed", etag='"abc"')
+    assert stored_path is not None
+    assert store.lookup("object-b", "decompressed") == stored_path
+    assert store.lookup("object-b", "gzip", etag='"abc"') is None
+
+    output_path = str(tmp_path / "b.jsonl")
+    assert store.materialize(stored_path, output_path) == "hardlink"
+    with open(output_path, "rb") as output_file:
+        assert output_file.read() == b"rows\n"
+
+def test_least_recently_used_files_are_evicted(tmp_path):
+    store = ObjectStore(str(tmp_path / "store"), limit=250)
+    store.add(write_file(tmp_path / "a", b"a" * 100), "object-a", "gzip")
+    store.add(write_file(tmp_path / "b", b"b" * 100), "object-b", "gzip")
+    assert store.lookup("object-a", "gzip") is not None
+
+    store.add(write_file(tmp_path / "c", b"c" * 100), "object-c", "gzip")
+
+    assert store.lookup("object-b", "gzip") is None
+    assert store.lookup("object-a", "gzip") is not None
+    assert store.lookup("object-c", "gzip") is not None
+    # Outputs linked to an evicted file keep their data
+    assert (tmp_path / "b").read_bytes() == b"b" * 100
+
+def test_lowered_limit_evicts_when_the_store_is_opened(tmp_path):
+    store = ObjectStore(str(tmp_path / "store"))
+    store.add(write_file(tmp_path / "a", b"a" * 100), "object-a", "gzip")
+    store.add(write_file(tmp_path / "b", b"b" * 100), "object-b", "gzip")
+
+    smaller = ObjectStore(str(tmp_path / "store"), limit=150)
+
+    assert smaller.lookup("object-a", "gzip") is None
+    assert smaller.lookup("object-b", "gzip") is not None
+
+def test_output_edited_in_place_is_not_reused(tmp_path):
+    store = ObjectStore(str(tmp_path / "store"))
+    output_path = write_file(tmp_path / "a.jsonl", b'{"id": 1}\n')
+    store.add(output_path, "object-a", "decompressed")
+
+    # Outputs are hardlinks of the stored file, so an edit of the same size reaches the store
+    with open(output_path, "r+b") as output_file:
+        output_file.write(b'{"id": 2}')
+    assert store.lookup("object-a", "decompressed") is None
+
+    # The edited output keeps its content and the object can be stored again
+    assert (tmp_path / "a.jsonl").read_bytes() == b'{"id": 2}\n'
+    fresh_path = write_file(tmp_path / "fresh.jsonl", b'{"id": 1}\n')
+    store.add(fresh_path, "object-a", "decompressed")
+    stored_path = store.lookup("object-a", "decompressed")
+    with open(stored_path, "rb") as stored_file:
+        assert stored_file.read() == b'{"id": 1}\n'
+
+def test_altered_stored_file_is_replaced_when_added_again(tmp_path):
+    store = ObjectStore(str(tmp_path / "store"))
+    first_path = write_file(tmp_path / "first", b"data")
+    store.add(first_path, "object-a", "gzip")
+    with open(first_path, "r+b") as first_file:
+        first_file.write(b"DATA")
+
+    assert store.add(write_file(tmp_path / "second", b"data"), "object-b", "gzip") == "hardlink"
+    stored_path = store.lookup("object-b", "gzip")
+    assert os.path.samefile(stored_path, tmp_path / "second")
@@ -0,0 +1,46 @@
+import asyncio
+import json
+
+import pytest
+
+pytest.importorskip("dap.api")
+
+import orchestrator
+from export_metrics import MetricsRecorder
+from orchestrator import CredentialSession
+
+def test_throttled_responses_slow_the_credential_down(mock_api, tmp_path, monkeypatch):
+    monkeypatch.setattr(orchestrator, "THROTTLE_BACKOFF_INITIAL", 0.2)
+    base_url, server = mock_api("--rate-limit", "2")
+    metrics_path = tmp_path / "metrics.jsonl"
+
+    async def run():
+        async with CredentialSession(base_url, "client", "secret", "mock", request_rate=10,
+                                     metrics=MetricsRecorder(str(metrics_path))) as session:
+            tables = await asyncio.gather(*(session.get_tables("canvas") for _ in range(6)))
+            return session, tables
+
+    session, tables = asyncio.run(run())
+
+    assert tables == [["bench_table"]] * 6
+    # The DAP client retried the 429 responses by itself; the trace hook still saw each of them
+    assert server.stats["throttled"] > 0
+    assert session.limiter.rate < 10
+    events = [json.loads(line) for line in metrics_path.read_text().splitlines()]
+    throttled = [event for event in events if event["phase"] == "throttled"]
+    assert len(throttled) == server.stats["throttled"]
+    assert {event["status"] for event in throttled} == {429}
+    assert all(event["credential"] == "mock" and event["path"] == "/dap/query/canvas/table" for event in throttled)
+
+def test_unthrottled_credential_keeps_its_rate(mock_api):
+    base_url, server = mock_api()
+
+    async def run():
+        async with CredentialSession(base_url, "client", "secret", "mock", request_rate=10) as session:
+            await asyncio.gather(*(session.get_tables("canvas") for _ in range(5)))
+            return session
+
+    session = asyncio.run(run())
+
+    assert session.limiter.rate == 10
+    assert (None, "throttled") not in session.metrics.totals
@@ -0,0 +1,42 @@
+import json
+from types import SimpleNamespace
+
+import pytest
+
+pq = pytest.importorskip("pyarrow.parquet")
+
+from dap_core import ParquetConversion
+from parquet_converter import convert_to_parquet
+
+SCHEMA = SimpleNamespace(version=1, schema={
+    "properties": {
+        "key": {"properties": {"id": {"type": "integer"}}},
+        "value": {"properties": {"account_id": {"type": "integer"}, "name": {"type": "string"}}},
+    },
+})
+
+def write_jsonl(path, ids):
+    with open(path, "w") as jsonl_file:
+        for row_id in ids:
+            jsonl_file.write(json.dumps({"key": {"id": row_id}, "value": {"account_id": row_id % 2, "name": f"name {row_id}"}}) + "\n")
+    return str(path)
+
+def test_tables_of_a_batch_share_one_spawned_pool(tmp_path):
+    conversion = ParquetConversion(partition_by="account_id", workers=2)
+    try:
+        pool = conversion.pool()
+        assert conversion.pool() is pool
+        assert pool._mp_context.get_start_method() == "spawn"
+
+        for table, ids in (("accounts", range(10)), ("users", range(10, 15))):
+            input_files = [write_jsonl(tmp_path / f"{table}_{part}.jsonl", ids[part::2]) for part in range(2)]
+            dataset_directory = tmp_path / "parquet" / table
+            rows = convert_to_parquet(str(dataset_directory), table, SCHEMA, input_files, "jsonl", "account_id", executor=pool)
+
+            assert rows == len(ids)
+            dataset = pq.read_table(str(dataset_directory), partitioning="hive")
+            assert sorted(dataset.column("id").to_pylist()) == list(ids)
+        assert conversion.pool() is pool
+    finally:
+        conversion.close()
+    assert conversion.executor is None
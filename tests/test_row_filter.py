@@ -0,0 +1,63 @@
+import pytest
+
+from dap_core import parse_arguments
+from row_filter import DELETE, KEEP, RowFilter
+
+SCHEMA = {
+    "properties": {
+        "key": {"properties": {"id": {"type": "integer"}}},
+        "value": {
+            "properties": {
+                "account_id": {"type": "integer"},
+                "name": {"type": "string"},
+                "updated_at": {"type": "string"},
+            },
+        },
+    },
+}
+
+def test_record_filter_predicates_and_projection():
+    record_filter = RowFilter(["account_id in 1,2", "updated_at >= 2024-01-01T00:00:00Z"], ["name"]).bind(SCHEMA)
+    assert record_filter.matches({"id": 1}, {"account_id": 2, "updated_at": "2024-02-01T00:00:00Z"}, None)
+    assert not record_filter.matches({"id": 1}, {"account_id": 3, "updated_at": "2024-02-01T00:00:00Z"}, None)
+    assert not record_filter.matches({"id": 1}, {"account_id": 1, "updated_at": "2023-12-31T23:59:59+00:00"}, None)
+    assert record_filter.project({"account_id": 1, "name": "a", "updated_at": "x"}) == {"name": "a"}
+    assert record_filter.keeps_field("key.id") and not record_filter.keeps_field("value.updated_at")
+
+def test_record_filter_compares_csv_strings_by_type():
+    record_filter = RowFilter(["account_id > 9"]).bind(SCHEMA)
+    assert record_filter.matches({"id": "1"}, {"account_id": "10"}, None)
+    assert not record_filter.matches({"id": "1"}, {"account_id": None}, None)
+
+def test_record_filter_keeps_deletes_unless_key_excludes_them():
+    record_filter = RowFilter(["id = 1", "account_id = 5"]).bind(SCHEMA)
+    assert record_filter.matches({"id": 1}, {}, "D")
+    assert not record_filter.matches({"id": 2}, {}, "D")
+
+def test_row_filter_rejects_unknown_columns():
+    with pytest.raises(ValueError):
+        RowFilter(["missing = 1"]).bind(SCHEMA)
+
+def test_record_filter_deletes_rows_moving_out_of_the_filter():
+    record_filter = RowFilter(["id < 10", "account_id in 1,2,3"]).bind(SCHEMA, delete_mismatches=True)
+    assert record_filter.decide({"id": 1}, {"account_id": 2}, "U") == KEEP
+    assert record_filter.decide({"id": 1}, {"account_id": 5}, "U") == DELETE
+    assert record_filter.decide({"id": 11}, {"account_id": 5}, "U") is None
+    assert record_filter.decide({"id": 1}, {}, "D") == KEEP
+
+def test_record_filter_drops_mismatches_without_delete_mismatches():
+    record_filter = RowFilter(["account_id in 1,2,3"]).bind(SCHEMA)
+    assert record_filter.decide({"id": 1}, {"account_id": 5}, "U") is None
+
+def test_malformed_where_is_a_usage_error(capsys):
+    with pytest.raises(SystemExit) as exit_info:
+        parse_arguments(["--client-id", "id", "--client-secret", "secret", "--output-directory", "out",
+                         "--where", "account_id ~ 3"])
+    assert exit_info.value.code == 2
+    assert "--where: Cannot parse the row filter 'account_id ~ 3'" in capsys.readouterr().err
+
+def test_where_and_select_build_the_row_filter():
+    arguments = parse_arguments(["--client-id", "id", "--client-secret", "secret", "--output-directory", "out",
+                                 "--where", "account_id in 1,2", "--select", "name"])
+    assert arguments.row_filter.columns == ["name"]
+    assert parse_arguments(["--client-id", "id", "--client-secret", "secret", "--output-directory", "out"]).row_filter is None
@@ -0,0 +1,84 @@
+import asyncio
+import sqlite3
+from types import SimpleNamespace
+
+import pytest
+
+from sql_loader import RecordSplitter, SQLiteTarget, TableSchemaError, load_job_objects
+
+KEYS = ["id"]
+
+TYPES = {"id": "integer", "name": "string"}
+
+def test_record_splitter_joins_jsonl_chunks():
+    splitter = RecordSplitter("jsonl")
+    assert splitter.feed('{"key": {"id": 1}, "value": {"na') == []
+    records = splitter.feed('me": "a"}}\n{"key": {"id": 2}, "meta": {"action": "D"}}', final=True)
+    assert records == [({"id": 1}, {"name": "a"}, None), ({"id": 2}, {}, "D")]
+
+def test_record_splitter_keeps_quoted_csv_newlines():
+    splitter = RecordSplitter("csv")
+    records = splitter.feed('key.id,value.name,meta.action\n1,"two\nlines",U\n2,NULL')
+    records += splitter.feed(",D\n", final=True)
+    assert records == [({"id": "1"}, {"name": "two\nlines"}, "U"), ({"id": "2"}, {"name": None}, "D")]
+
+def load_rows(path, types, rows):
+    target = SQLiteTarget(path)
+    try:
+        target.create_table("accounts", types, KEYS)
+        target.upsert_rows("accounts", list(types), KEYS, rows)
+        target.commit()
+    finally:
+        target.close()
+
+def test_sqlite_target_adds_new_schema_columns(tmp_path):
+    path = str(tmp_path / "export.db")
+    load_rows(path, TYPES, [(1, "first")])
+    load_rows(path, dict(TYPES, account_id="integer"), [(2, "second", 7)])
+
+    with sqlite3.connect(path) as connection:
+        rows = connection.execute("SELECT id, name, account_id FROM accounts ORDER BY id").fetchall()
+    assert rows == [(1, "first", None), (2, "second", 7)]
+
+def test_sqlite_target_keeps_columns_left_out_of_a_selection(tmp_path):
+    path = str(tmp_path / "export.db")
+    load_rows(path, dict(TYPES, account_id="integer"), [(1, "first", 7)])
+    load_rows(path, {"id": "integer", "account_id": "integer"}, [(2, 8)])
+
+    with sqlite3.connect(path) as connection:
+        rows = connection.execute("SELECT id, name, account_id FROM accounts ORDER BY id").fetchall()
+    assert rows == [(1, "first", 7), (2, None, 8)]
+
+def test_sqlite_target_rejects_changed_column_type(tmp_path):
+    path = str(tmp_path / "export.db")
+    load_rows(path, TYPES, [(1, "first")])
+    with pytest.raises(TableSchemaError, match="name is TEXT instead of INTEGER"):
+        load_rows(path, {"id": "integer", "name": "integer"}, [(2, 2)])
+
+def test_sqlite_target_rejects_changed_primary_key(tmp_path):
+    path = str(tmp_path / "export.db")
+    load_rows(path, TYPES, [(1, "first")])
+    target = SQLiteTarget(path)
+    try:
+        with pytest.raises(TableSchemaError, match="primary key"):
+            target.create_table("accounts", TYPES, ["id", "name"])
+    finally:
+        target.close()
+
+class NoObjectsClient:
+    async def get_resources(self, objects):
+        raise AssertionError("resources of an empty job must not be requested")
+
+def test_load_without_objects_commits_empty_snapshot(tmp_path):
+    path = str(tmp_path / "export.db")
+    load_rows(path, TYPES, [(1, "first")])
+    schema = {"properties": {"key": {"properties": {"id": {"type": "integer"}}},
+                             "value": {"properties": {"name": {"type": "string"}}}}}
+    progress = SimpleNamespace(add_objects=lambda count: None)
+
+    loaded = asyncio.run(load_job_objects(NoObjectsClient(), "accounts", SimpleNamespace(objects=[]),
+                                          SimpleNamespace(schema=schema), "jsonl", f"sqlite:///{path}", True, progress))
+
+    assert loaded == 0
+    with sqlite3.connect(path) as connection:
+        assert connection.execute("SELECT COUNT(*) FROM accounts").fetchone() == (0,)
@@ -0,0 +1,69 @@
+from datetime import datetime, timedelta, timezone
+
+from sync_state import SYNC_STATE_FILE, SyncStateStore
+
+def utc(*args):
+    return datetime(*args, tzinfo=timezone.utc)
+
+def test_watermark_survives_reopening_the_store(tmp_path):
+    store = SyncStateStore.for_directory(tmp_path)
+    assert store.get_watermark("canvas", "accounts") is None
+
+    store.set_watermark("canvas", "accounts", utc(2024, 5, 1, 12), job_id="job-1")
+    reopened = SyncStateStore(str(tmp_path / SYNC_STATE_FILE))
+    assert reopened.get_watermark("canvas", "accounts") == utc(2024, 5, 1, 12)
+    assert reopened.get_watermark("canvas", "users") is None
+    assert reopened.get_watermark("canvas_logs", "accounts") is None
+
+def test_watermark_is_replaced_and_normalized_to_utc(tmp_path):
+    store = SyncStateStore.for_directory(tmp_path)
+    store.set_watermark("canvas", "accounts", utc(2024, 5, 1))
+    store.set_watermark("canvas", "accounts", datetime(2024, 5, 2, 2, tzinfo=timezone(timedelta(hours=2))))
+
+    watermark = store.get_watermark("canvas", "accounts")
+    assert watermark == utc(2024, 5, 2)
+    assert watermark.utcoffset() == timedelta(0)
+
+def test_cleared_watermark_starts_over(tmp_path):
+    store = SyncStateStore.for_directory(tmp_path)
+    store.set_watermark("canvas", "accounts", utc(2024, 5, 1))
+    store.set_watermark("canvas", "users", utc(2024, 5, 1))
+    store.clear_watermark("canvas", "accounts")
+
+    assert store.get_watermark("canvas", "accounts") is None
+    assert store.get_watermark("canvas", "users") == utc(2024, 5, 1)
+
+def test_completed_windows_are_kept_per_table(tmp_path):
+    store = SyncStateStore.for_directory(tmp_path)
+    first = (utc(2024, 1, 1), utc(2024, 1, 2))
+    second = (utc(2024, 1, 2), utc(2024, 1, 3))
+    store.mark_window_completed("canvas", "accounts", *first, job_id="job-1")
+    store.mark_window_completed("canvas", "accounts", *second, job_id="job-2")
+    store.mark_window_completed("canvas", "users", *first)
+
+    reopened = SyncStateStore.for_directory(tmp_path)
+    assert reopened.completed_windows("canvas", "accounts") == {first, second}
+    assert reopened.completed_windows("canvas", "users") == {first}
+    assert reopened.completed_windows("canvas", "courses") == set()
+
+def test_repeated_window_is_recorded_once(tmp_path):
+    store = SyncStateStore.for_directory(tmp_path)
+    window = (utc(2024, 1, 1), utc(2024, 1, 2))
+    store.mark_window_completed("canvas", "accounts", *window, job_id="job-1")
+    store.mark_window_completed("canvas", "accounts", *window, job_id="job-2")
+
+    assert store.completed_windows("canvas", "accounts") == {window}
+    with store.connect() as connection:
+        rows = connection.execute("SELECT job_id FROM backfill_windows").fetchall()
+    assert rows == [("job-2",)]
+
+def test_completed_windows_match_the_windows_of_a_resumed_backfill(tmp_path):
+    from dap_core import split_windows
+
+    store = SyncStateStore.for_directory(tmp_path)
+    windows = split_windows(utc(2024, 1, 1, 6), utc(2024, 1, 4), "day")
+    for start, end in windows[:2]:
+        store.mark_window_completed("canvas", "accounts", start, end)
+
+    completed = SyncStateStore.for_directory(tmp_path).completed_windows("canvas", "accounts")
+    assert [window for window in windows if window not in completed] == windows[2:]